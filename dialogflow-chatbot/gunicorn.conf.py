@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+import tempfile
+
+# gunicorn -c gunicorn.conf.py main:app
+bind = os.environ.get("DIALOGFLOW_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("DIALOGFLOW_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# threads per worker: requests are short and mostly waiting on the network
+worker_class = "gthread"
+threads = int(os.environ.get("DIALOGFLOW_THREADS", 8))
+keepalive = 5
+timeout = 30
+
+# metrics of all workers are aggregated through this directory, see metrics.py. It must be set before the
+# app (and prometheus_client) is imported, hence here rather than in the app
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="dialogflow-metrics-"))
+
+
+def on_starting(server):
+    # samples left over from a previous run would be counted again
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
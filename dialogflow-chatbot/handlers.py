@@ -0,0 +1,61 @@
+# Soft type assertions
+from typing import Callable, Dict, List, Optional
+
+# operation name (the 'operation' entity of the agent) -> handler taking the 'number' entities
+OPERATIONS = {}
+
+
+def operation(name: str) -> Callable:
+    """
+    Registers a math operation handler under the name Dialogflow sends as 'operation'.
+    """
+    def register(handler: Callable[[List[float]], float]) -> Callable[[List[float]], float]:
+        OPERATIONS[name] = handler
+        return handler
+    return register
+
+
+@operation('add')
+def add(numbers: List[float]) -> float:
+    return sum(numbers)
+
+
+@operation('subtract')
+def subtract(numbers: List[float]) -> float:
+    return numbers[0] - numbers[1]
+
+
+@operation('multiply')
+def multiply(numbers: List[float]) -> float:
+    return numbers[0] * numbers[1]
+
+
+@operation('divide')
+def divide(numbers: List[float]) -> float:
+    return numbers[0] / numbers[1]
+
+
+def solve(params: Dict) -> Optional[float]:
+    """
+    Applies the requested operation to the numbers of a Dialogflow query.
+
+    :param params: 'queryResult.parameters' of the webhook request
+    :type params: Dict
+
+    :return: the answer, None if the operation is unknown or impossible (e.g. division by zero)
+    :rtype: Optional[float]
+
+    :raises ValueError: if 'number' is not a list of numbers
+    """
+    handler = OPERATIONS.get(params.get('operation'))
+    numbers = params.get('number') or []
+    # bools are ints, but not numbers anyone asked about
+    if not isinstance(numbers, list) or not all(isinstance(n, (int, float)) and not isinstance(n, bool)
+                                                for n in numbers):
+        raise ValueError(f"Expected a list of numbers, got {numbers!r}")
+    if handler is None or len(numbers) < 2:
+        return None
+    try:
+        return handler(numbers)
+    except ArithmeticError:
+        return None
@@ -0,0 +1,125 @@
+import argparse
+import glob
+import itertools
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Soft type assertions
+from typing import Dict, List
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def load_payloads(directory: str = PAYLOADS_DIR) -> Dict[str, bytes]:
+    """
+    Recorded Dialogflow webhook requests (one JSON file each) to replay.
+
+    :return: file name without extension -> request body
+    :rtype: Dict[str, bytes]
+    """
+    payloads = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, 'rb') as f:
+            payloads[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    if not payloads:
+        raise ValueError(f"No payloads in {directory}")
+    return payloads
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def post(url: str, body: bytes, timeout: float) -> int:
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run(url: str, payloads: Dict[str, bytes], concurrency: int = 32, requests: int = 2000,
+        duration: float = None, timeout: float = 10.0) -> Dict:
+    """
+    Replays the payloads round-robin against the webhook from 'concurrency' threads, for
+    'requests' requests or 'duration' seconds if given.
+
+    :return: throughput, latency percentiles (ms) and errors, overall and per payload
+    :rtype: Dict
+    """
+    names = itertools.cycle(list(payloads))
+    lock = threading.Lock()
+    latencies = {name: [] for name in payloads}
+    errors = {name: 0 for name in payloads}
+    sent = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_payload():
+        with lock:
+            if deadline is None and sent[0] >= requests:
+                return None
+            sent[0] += 1
+            return next(names)
+
+    def worker():
+        while deadline is None or time.perf_counter() < deadline:
+            name = next_payload()
+            if name is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = post(url, payloads[name], timeout) == 200
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies[name].append(elapsed)
+                errors[name] += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    def summary(values: List[float], n_errors: int) -> Dict:
+        return {
+            'requests': len(values),
+            'errors': n_errors,
+            'p50_ms': percentile(values, 0.50),
+            'p90_ms': percentile(values, 0.90),
+            'p99_ms': percentile(values, 0.99),
+            'mean_ms': statistics.fmean(values) if values else None,
+        }
+
+    every = [v for values in latencies.values() for v in values]
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(every) / elapsed if elapsed else 0.0,
+        **summary(every, sum(errors.values())),
+        'payloads': {name: summary(latencies[name], errors[name]) for name in payloads},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay recorded Dialogflow requests against the webhook")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/webhook-math")
+    parser.add_argument("--payloads", default=PAYLOADS_DIR, help="directory of recorded webhook requests")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds instead")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.url, load_payloads(args.payloads), args.concurrency, args.requests,
+                         args.duration, args.timeout), indent=2))
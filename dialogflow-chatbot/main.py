@@ -1,7 +1,14 @@
 import flask
 import json
 import os
+import time
 from flask import send_from_directory, request
+from handlers import OPERATIONS, solve
+from metrics import LATENCY, REQUESTS, render
+
+# intents of the agent, comma separated. Only these become 'intent' label values: the displayName is
+# whatever the caller sends, so arbitrary input could otherwise create unbounded metric series
+INTENTS = set(os.environ.get("DIALOGFLOW_INTENTS", "math").split(","))
 
 # Flask app should start in global layout
 
@@ -17,34 +24,50 @@ def favicon():
 def home():
     return "Hello World"
 
+@app.route('/metrics')
+def metrics():
+    body, content_type = render()
+    return flask.Response(body, content_type=content_type)
+
 @app.route('/webhook-math', methods=['POST'])
 def webhook_math():
-    req = request.get_json(force=True)
-    params = req['queryResult']['parameters']
-
-    n1 = params['number'][0]
-    n2 = params['number'][1]
-    match params['operation']:
-        case 'add':
-            out = sum(n for n in params['number'])
-        case 'subtract':
-            out = n1-n2
-        case 'multiply':
-            out = n1*n2
-        case 'divide':
-            out = n1/n2
-        case _:
-            out = None
-    if out:
-        return {
+    start = time.perf_counter()
+    intent, operation = 'unknown', 'unknown'
+    try:
+        req = request.get_json(force=True)
+        query = req['queryResult']
+        params = query['parameters']
+        # labels are only ever assigned known values: the caller's ones are checked first, and may not
+        # even be hashable
+        intent = 'other'
+        name = query.get('intent', {}).get('displayName')
+        if isinstance(name, str) and name in INTENTS:
+            intent = name
+        operation = 'other'
+        name = params.get('operation')
+        if isinstance(name, str) and name in OPERATIONS:
+            operation = name
+        # operations are looked up in the dispatch table of handlers.py
+        out = solve(params)
+    except Exception:
+        REQUESTS.labels(intent, operation, 'error').inc()
+        LATENCY.labels(intent, operation).observe(time.perf_counter() - start)
+        return {'fulfillmentText': 'Malformed webhook request.'}, 400
+
+    if out is not None:
+        response = {
             'fulfillmentText': f'The answer is: {out}'
         }
     else:
-        return {
+        response = {
             'fulfillmentText': 'This type of math is unsupported or impossible.'
         }
+    REQUESTS.labels(intent, operation, 'answered' if out is not None else 'unsupported').inc()
+    LATENCY.labels(intent, operation).observe(time.perf_counter() - start)
+    return response
 
+# development server only, single process. Deploy with gunicorn: gunicorn -c gunicorn.conf.py main:app
 if __name__ == "__main__":
     app.secret_key = 'ItIsASecret'
-    app.debug = True
+    app.debug = os.environ.get("FLASK_DEBUG", "1") == "1"
     app.run(port=5000)
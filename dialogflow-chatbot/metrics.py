@@ -0,0 +1,34 @@
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Under gunicorn every worker is a separate process: with PROMETHEUS_MULTIPROC_DIR set (see gunicorn.conf.py)
+# the workers write their samples there and /metrics aggregates all of them
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY = Histogram(
+    "dialogflow_webhook_latency_seconds",
+    "Time to handle a webhook request, by intent and operation",
+    ["intent", "operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+REQUESTS = Counter(
+    "dialogflow_webhook_requests",
+    "Webhook requests, by intent, operation and outcome (answered, unsupported, error)",
+    ["intent", "operation", "outcome"],
+)
+
+
+def render() -> tuple:
+    """
+    Current metrics in the Prometheus text format, across every worker process.
+
+    :return: (body, content type)
+    :rtype: tuple
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,225 @@
+import inspect
+import json
+import os
+import time
+
+import torch
+
+# Soft type assertions
+from typing import Callable, Dict, List
+from torch import Tensor
+from transformers.models.bert.modeling_bert import BertModel
+
+BACKENDS = ['eager', 'int8', 'torchscript', 'onnx']
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+
+
+class _TokenEmbeddings(torch.nn.Module):
+    def __init__(self, model: BertModel):
+        """
+        Wraps a transformer so it takes positional tensors and returns only the token
+        embeddings, which is what tracing and ONNX export need.
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: Tensor, attention_mask: Tensor, token_type_ids: Tensor) -> Tensor:
+        return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+
+def _example_inputs(tokenizer) -> List[Tensor]:
+    encoded = tokenizer(["example input for tracing", "a second, somewhat longer example input"],
+                        padding=True, return_tensors='pt')
+    return [encoded[name] for name in INPUT_NAMES]
+
+
+def _positional(encoded_input: Dict) -> List[Tensor]:
+    return [
+        encoded_input[name] if name in encoded_input else torch.zeros_like(encoded_input['input_ids'])
+        for name in INPUT_NAMES
+    ]
+
+
+def load_backend(name: str, model: BertModel, tokenizer, model_dir: str) -> Callable[[Dict], tuple]:
+    """
+    Builds the forward function of an inference backend. Every backend maps a tokenizer
+    output to a tuple whose first element is the (B, T, H) token embeddings, like the
+    eager model output, so pooling is shared.
+
+    - 'eager': the PyTorch model as loaded, fp32
+    - 'int8': dynamic int8 quantization of the Linear layers
+    - 'torchscript': TorchScript trace of the fp32 model
+    - 'onnx': fp32 ONNX export run through onnxruntime on CPU. The export is cached in
+      '<model_dir>/onnx/model.onnx'. Requires the 'onnx' and 'onnxruntime' packages
+
+    :param name: backend name, one of 'BACKENDS'
+    :type name: str
+    :param model: eager fp32 model
+    :type model: BertModel
+    :param tokenizer: tokenizer of the model, used for example inputs
+    :type tokenizer: BertTokenizerFast
+    :param model_dir: model directory
+    :type model_dir: str
+
+    :return: forward function
+    :rtype: Callable[[Dict], tuple]
+    """
+    model.eval()
+    if name == 'eager':
+        return lambda encoded_input: model(**encoded_input)
+
+    if name == 'int8':
+        # in place, so the fp32 weights are not kept around next to the int8 ones
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return lambda encoded_input: model(**encoded_input)
+
+    if name == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(_TokenEmbeddings(model), _example_inputs(tokenizer), strict=False)
+        traced = torch.jit.freeze(traced.eval())
+        return lambda encoded_input: (traced(*_positional(encoded_input)),)
+
+    if name == 'onnx':
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The 'onnx' backend requires onnxruntime: pip install onnx onnxruntime")
+
+        path = os.path.join(model_dir, "onnx", "model.onnx")
+        if not os.path.exists(path):
+            export_onnx(model, tokenizer, path)
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+        def forward(encoded_input: Dict) -> tuple:
+            feeds = {n: t.numpy() for n, t in zip(INPUT_NAMES, _positional(encoded_input))}
+            return (torch.from_numpy(session.run(None, feeds)[0]),)
+
+        return forward
+
+    raise ValueError(f"Unknown backend '{name}', expected one of {BACKENDS}")
+
+
+def export_onnx(model: BertModel, tokenizer, path: str) -> None:
+    """
+    Exports the model's token embeddings to ONNX with dynamic batch and sequence axes.
+
+    :param model: eager fp32 model
+    :type model: BertModel
+    :param tokenizer: tokenizer of the model, used for example inputs
+    :type tokenizer: BertTokenizerFast
+    :param path: output .onnx file
+    :type path: str
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in INPUT_NAMES}
+    dynamic_axes['token_embeddings'] = {0: 'batch', 1: 'sequence'}
+    # newer torch versions default to the dynamo exporter; the TorchScript one handles BERT fine
+    extra = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    tmp = path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            _TokenEmbeddings(model),
+            tuple(_example_inputs(tokenizer)),
+            tmp,
+            input_names=INPUT_NAMES,
+            output_names=['token_embeddings'],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            **extra,
+        )
+    os.replace(tmp, path)
+
+
+def compare_embeddings(reference: Tensor, candidate: Tensor) -> Dict:
+    """
+    Accuracy parity between two sets of sentence embeddings of the same sentences.
+
+    :param reference: (N, d) reference embeddings, e.g. eager fp32
+    :type reference: Tensor
+    :param candidate: (N, d) embeddings from the backend under test
+    :type candidate: Tensor
+
+    :return: mean/min cosine similarity between matching rows, and the fraction of
+        sentences whose nearest neighbour among the others is unchanged
+    :rtype: Dict
+    """
+    reference = torch.nn.functional.normalize(reference, p=2, dim=1)
+    candidate = torch.nn.functional.normalize(candidate, p=2, dim=1)
+    cosine = (reference * candidate).sum(dim=1)
+
+    def neighbours(emb: Tensor) -> Tensor:
+        sim = torch.mm(emb, emb.t())
+        sim.fill_diagonal_(-2)
+        return sim.argmax(dim=1)
+
+    agreement = 1.0
+    if reference.shape[0] > 1:
+        agreement = (neighbours(reference) == neighbours(candidate)).float().mean().item()
+
+    return {
+        'mean_cosine': cosine.mean().item(),
+        'min_cosine': cosine.min().item(),
+        'top1_agreement': agreement,
+    }
+
+
+def benchmark_backends(sentences: List[str],
+                       model_name: str = "paraphrase-MiniLM-L6-v2",
+                       backends: List[str] = None,
+                       batch: int = 32,
+                       repeats: int = 3,
+                       tolerance: float = 0.99) -> List[Dict]:
+    """
+    Measures embedding throughput of each backend and its parity with eager fp32.
+
+    :param sentences: sentences to embed
+    :type sentences: List[str]
+    :param model_name: model name/directory
+    :type model_name: str
+    :param backends: backends to compare, defaults to all
+    :type backends: List[str]
+    :param batch: embedding batch size
+    :type batch: int
+    :param repeats: timed passes over 'sentences' per backend (after one warm-up pass)
+    :type repeats: int
+    :param tolerance: minimum mean cosine similarity to eager fp32 to count as within tolerance
+    :type tolerance: float
+
+    :return: one result per backend with 'sentences_per_sec', the parity metrics of
+        'compare_embeddings' and 'within_tolerance'
+    :rtype: List[Dict]
+    """
+    from classes import QAEmbedder
+
+    reference = QAEmbedder(model_name=model_name).get_embeddings(sentences, batch=batch)
+    results = []
+    for name in backends or BACKENDS:
+        embedder = QAEmbedder(model_name=model_name, backend=name)
+        embeddings = embedder.get_embeddings(sentences, batch=batch)  # warm-up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            embedder.get_embeddings(sentences, batch=batch)
+        elapsed = time.perf_counter() - start
+
+        parity = compare_embeddings(reference, embeddings)
+        results.append({
+            'backend': name,
+            'sentences_per_sec': repeats * len(sentences) / elapsed,
+            **parity,
+            'within_tolerance': parity['mean_cosine'] >= tolerance,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    sample = [
+        'How many teams compete in the Premier League ?',
+        'When does the Premier League starts and finishes ?',
+        'Who has the highest number of goals in the Premier League ?',
+        'Which club won the first Premier League title ?',
+        'How is the Premier League broadcast overseas ?',
+        'What is the name of the Premier League trophy ?',
+        'Which days have the most events played at?',
+        'How many clubs are relegated at the end of each season ?',
+    ] * 16
+    print(json.dumps(benchmark_backends(sample), indent=4))
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Soft type assertions
+from typing import Callable, Dict, List
+from torch import Tensor
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (0 if empty).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class MicroBatcher:
+    def __init__(self,
+                 fn: Callable[[List[str]], Tensor],
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 window: int = 1000):
+        """
+        Coalesces concurrent requests into batches for a single batched call of 'fn'.
+
+        The first queued request opens a batch; the batch is run as soon as it holds
+        'max_batch_size' items or 'max_wait_ms' has passed since it was opened. 'fn'
+        runs in a dedicated worker thread so the event loop is never blocked, and each
+        request gets back the rows of the result that correspond to its own items.
+
+        :param fn: Batched function mapping N strings to an (N, ...) tensor
+        :type fn: Callable[[List[str]], Tensor]
+        :param max_batch_size: Maximum number of items per call of 'fn'. A single request
+            larger than this is still run as one batch
+        :type max_batch_size: int
+        :param max_wait_ms: Maximum time the first request of a batch waits for others
+        :type max_wait_ms: float
+        :param window: Number of recent batches/requests kept for the percentile metrics
+        :type window: int
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = None
+        self._worker = None
+        self._carry = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="microbatch")
+
+        self._started = time.perf_counter()
+        self._requests = 0
+        self._items = 0
+        self._batches = 0
+        self._busy_seconds = 0.0
+        self._batch_sizes = deque(maxlen=window)
+        self._queue_waits = deque(maxlen=window)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, items: List[str]) -> Tensor:
+        """
+        Queues 'items' for the next batch and waits for their results.
+
+        :param items: Strings to process
+        :type items: List[str]
+
+        :return: Rows of the batched result for 'items', in order
+        :rtype: Tensor
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((list(items), future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> List:
+        """
+        Waits for a first request, then keeps gathering requests until the batch is full
+        or the deadline passes. A request that would overflow the batch is carried over
+        to open the next one.
+        """
+        if self._carry is not None:
+            pending, self._carry = [self._carry], None
+        else:
+            pending = [await self._queue.get()]
+        size = len(pending[0][0])
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self._carry = request
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            items = [item for request, _, _ in pending for item in request]
+
+            dispatched = time.perf_counter()
+            for _, _, queued in pending:
+                self._queue_waits.append(dispatched - queued)
+
+            try:
+                result = await loop.run_in_executor(self._executor, self.fn, items)
+            except Exception as e:
+                for _, future, _ in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._busy_seconds += time.perf_counter() - dispatched
+            self._batches += 1
+            self._requests += len(pending)
+            self._items += len(items)
+            self._batch_sizes.append(len(items))
+
+            start = 0
+            for request, future, _ in pending:
+                if not future.done():
+                    future.set_result(result[start:start + len(request)])
+                start += len(request)
+
+    def stats(self) -> Dict:
+        """
+        Throughput, batch size and queue wait metrics.
+
+        :return: counters since start and percentiles over the recent window
+        :rtype: Dict
+        """
+        elapsed = time.perf_counter() - self._started
+        waits_ms = [w * 1000 for w in self._queue_waits]
+        sizes = list(self._batch_sizes)
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'requests': self._requests,
+            'items': self._items,
+            'batches': self._batches,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'items_per_sec': self._items / elapsed if elapsed else 0.0,
+            'items_per_busy_sec': self._items / self._busy_seconds if self._busy_seconds else 0.0,
+            'batch_size_mean': sum(sizes) / len(sizes) if sizes else 0.0,
+            'batch_size_p50': percentile(sizes, 50),
+            'batch_size_max': max(sizes) if sizes else 0,
+            'queue_wait_ms_mean': sum(waits_ms) / len(waits_ms) if waits_ms else 0.0,
+            'queue_wait_ms_p50': percentile(waits_ms, 50),
+            'queue_wait_ms_p99': percentile(waits_ms, 99),
+        }
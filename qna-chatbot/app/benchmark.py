@@ -0,0 +1,469 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import string
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from batching import percentile
+from index import get_index, recall_at_k
+
+# Soft type assertions
+from typing import Dict, List, Tuple
+from torch import Tensor
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+_SUBJECTS = ("the league", "the club", "the stadium", "the season", "the final", "the manager", "the striker",
+             "the referee", "the trophy", "the academy", "the broadcast deal", "the transfer window")
+# every template fills three slots, so together they give ~48k distinct questions
+_TEMPLATES = ("How many {n} did {s} have in {y} ?", "When did {s} first win {o} after {y} ?",
+              "Who owned {s} when it won {o} in {y} ?", "What was the capacity of {s} for its {n} in {y} ?",
+              "Why was {s} fined over {o} in {y} ?", "Which team did {s} face for {o} in {y} ?",
+              "Where did {s} play its {n} in {y} ?", "How much did {s} pay for {o} in {y} ?")
+_NOUNS = ("goals", "matches", "points", "fans", "titles", "home games", "players", "sponsors")
+_OBJECTS = ("the cup", "the title", "a new contract", "promotion", "the derby", "the shield")
+_YEARS = tuple(range(1950, 2024))
+
+
+def synthetic_questions(n: int, seed: int = 0) -> List[str]:
+    """
+    Deterministic, distinct question-like sentences of varied length, for benchmarks that
+    must not depend on the SQuAD file being downloaded. Repeats would be answered by the
+    caches and exact-match tier instead of the index, skewing the numbers.
+
+    :param n: number of questions
+    :type n: int
+    :param seed: random seed
+    :type seed: int
+
+    :rtype: List[str]
+    """
+    slots = {'s': _SUBJECTS, 'n': _NOUNS, 'o': _OBJECTS, 'y': _YEARS}
+    pool = []
+    for template in _TEMPLATES:
+        fields = sorted({field for _, field, _, _ in string.Formatter().parse(template) if field})
+        for values in itertools.product(*(slots[field] for field in fields)):
+            pool.append(template.format(**dict(zip(fields, values))))
+    if n > len(pool):
+        raise ValueError(f"Only {len(pool)} distinct synthetic questions, {n} requested; use a SQuAD corpus")
+    return random.Random(seed).sample(pool, n)
+
+
+def load_questions(corpus: str, n: int, seed: int = 0) -> List[str]:
+    """
+    Benchmark questions: 'synthetic', or the first 'n' answerable questions of a SQuAD file.
+
+    :param corpus: 'synthetic' or a SQuAD json path
+    :type corpus: str
+    :param n: number of questions
+    :type n: int
+
+    :rtype: List[str]
+    """
+    if corpus == 'synthetic':
+        return synthetic_questions(n, seed)
+
+    from ingest import SquadIndex
+    questions = []
+    for _, question, _ in SquadIndex(corpus).iter_qa():
+        questions.append(question)
+        if len(questions) == n:
+            break
+    return questions
+
+
+def environment() -> Dict:
+    """
+    Where the numbers were measured, stored with the results so runs are comparable.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def bench_embedding(questions: List[str],
+                    model_name: str = "paraphrase-MiniLM-L6-v2",
+                    backend: str = "eager",
+                    batch_sizes: List[int] = (1, 8, 32, 128),
+                    thread_counts: List[int] = None,
+                    repeats: int = 3) -> List[Dict]:
+    """
+    Embedding throughput of 'QAEmbedder' for every combination of batch size and torch
+    intra-op thread count. Each combination gets one untimed warm-up pass.
+
+    :param questions: sentences to embed
+    :type questions: List[str]
+    :param model_name: model name/directory
+    :type model_name: str
+    :param backend: inference backend, see 'QAEmbedder'
+    :type backend: str
+    :param batch_sizes: embedding batch sizes
+    :type batch_sizes: List[int]
+    :param thread_counts: torch thread counts, defaults to 1 and the current setting
+    :type thread_counts: List[int]
+    :param repeats: timed passes over 'questions'
+    :type repeats: int
+
+    :return: one result per combination with 'sentences_per_sec' and 'seconds_per_batch'
+    :rtype: List[Dict]
+    """
+    from classes import QAEmbedder
+
+    embedder = QAEmbedder(model_name=model_name, backend=backend)
+    default_threads = torch.get_num_threads()
+    results = []
+    try:
+        for threads in thread_counts or sorted({1, default_threads}):
+            torch.set_num_threads(threads)
+            for batch in batch_sizes:
+                embedder.get_embeddings(questions[:batch * 2], batch=batch)  # warm-up
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    embedder.get_embeddings(questions, batch=batch)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    'backend': backend,
+                    'threads': threads,
+                    'batch': batch,
+                    'sentences_per_sec': repeats * len(questions) / elapsed,
+                    'seconds_per_batch': elapsed / (repeats * -(-len(questions) // batch)),
+                })
+    finally:
+        torch.set_num_threads(default_threads)
+    return results
+
+
+def bench_bulk_embedding(questions: List[str],
+                         model_name: str = "paraphrase-MiniLM-L6-v2",
+                         backend: str = "eager",
+                         workers: List[int] = (0,),
+                         threads_per_worker: int = 1,
+                         batch: int = 32) -> List[Dict]:
+    """
+    Time to embed a whole context, as 'set_context_qa' does, in this process and with
+    process pools of every given size (see 'ingest.EmbeddingPool'). The pool is started and
+    warmed up before timing, as it is only started once per process.
+
+    :param questions: context questions
+    :type questions: List[str]
+    :param workers: pool sizes, 0 embeds in this process
+    :type workers: List[int]
+    :param threads_per_worker: torch intra-op threads per pool process
+    :type threads_per_worker: int
+
+    :return: one result per pool size with 'seconds' and 'sentences_per_sec'
+    :rtype: List[Dict]
+    """
+    from classes import QAEmbedder
+
+    results = []
+    for n in workers:
+        embedder = QAEmbedder(model_name=model_name, backend=backend, workers=n, threads_per_worker=threads_per_worker)
+        if n:
+            embedder.embedding_pool().embed(questions[:n * batch], batch=batch)  # starts every process
+        start = time.perf_counter()
+        embedder.get_embeddings(questions, batch=batch, sort_by_length=True)
+        elapsed = time.perf_counter() - start
+        if n:
+            embedder.embedding_pool().close()
+        results.append({
+            'backend': backend,
+            'workers': n,
+            'threads_per_worker': threads_per_worker if n else torch.get_num_threads(),
+            'sentences': len(questions),
+            'seconds': elapsed,
+            'sentences_per_sec': len(questions) / elapsed,
+        })
+    return results
+
+
+def synthetic_rows(seeds: Tensor, n: int, noise: float = 0.35, seed: int = 0) -> Tensor:
+    """
+    (n, d) normalized rows scattered around real embeddings, so a context of millions of
+    rows keeps the clustered structure of real questions without embedding millions of them.
+
+    :param seeds: (m, d) normalized embeddings of real questions
+    :type seeds: Tensor
+    :param n: rows to generate
+    :type n: int
+    :param noise: scale of the gaussian noise added to the seed rows
+    :type noise: float
+
+    :rtype: Tensor
+    """
+    generator = torch.Generator().manual_seed(seed)
+    rows = torch.empty(n, seeds.shape[1])
+    for i in range(0, n, 65536):
+        m = min(65536, n - i)
+        picks = torch.randint(len(seeds), (m,), generator=generator)
+        chunk = seeds[picks] + noise / seeds.shape[1] ** 0.5 * torch.randn(m, seeds.shape[1], generator=generator)
+        rows[i:i + m] = torch.nn.functional.normalize(chunk, p=2, dim=1)
+    return rows
+
+
+def _latencies(index, queries: Tensor, k: int) -> List[float]:
+    latencies = []
+    for row in queries:
+        start = time.perf_counter()
+        index.search(row.unsqueeze(0), k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def bench_search(seeds: Tensor,
+                 queries: Tensor,
+                 sizes: List[int] = SEARCH_SIZES,
+                 indexes: List[str] = ('flat',),
+                 k: int = 10,
+                 batch: int = 32) -> List[Dict]:
+    """
+    Search latency as the context grows. Every index is built over the first 'size' rows
+    of one synthetic matrix (see 'synthetic_rows') and queried one question at a time
+    (latency percentiles) and 'batch' questions at a time (throughput).
+
+    :param seeds: (m, d) normalized embeddings the synthetic context is generated from
+    :type seeds: Tensor
+    :param queries: (q, d) normalized query embeddings
+    :type queries: Tensor
+    :param sizes: context sizes in rows
+    :type sizes: List[int]
+    :param indexes: index names, see 'index.py'
+    :type indexes: List[str]
+    :param k: neighbours per query
+    :type k: int
+    :param batch: queries per batched search
+    :type batch: int
+
+    :return: one result per size and index with build time, latency p50/p99 (ms),
+        batched queries/sec and recall@k against exact search
+    :rtype: List[Dict]
+    """
+    matrix = synthetic_rows(seeds, max(sizes))
+    results = []
+    for size in sorted(sizes):
+        rows = matrix[:size]
+        for name in indexes:
+            index = get_index(name)
+            start = time.perf_counter()
+            index.build(rows)
+            build_seconds = time.perf_counter() - start
+
+            index.search(queries[:1], k=k)  # warm-up
+            latencies = _latencies(index, queries, k)
+            start = time.perf_counter()
+            for i in range(0, len(queries), batch):
+                index.search(queries[i:i + batch], k=k)
+            batched = time.perf_counter() - start
+
+            results.append({
+                'index': name,
+                'rows': size,
+                'build_seconds': build_seconds,
+                'latency_p50_ms': percentile(latencies, 50),
+                'latency_p99_ms': percentile(latencies, 99),
+                'batched_queries_per_sec': len(queries) / batched,
+                'recall_at_k': recall_at_k(index, queries, k=k) if name != 'flat' else 1.0,
+            })
+            del index
+    return results
+
+
+def _post(url: str, payload: Dict, timeout: float) -> Tuple[int, bytes]:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+def start_server(port: int = 0, env: Dict = None, timeout: float = 300.0) -> Tuple[subprocess.Popen, str]:
+    """
+    Starts the API ('main.py') with uvicorn in a subprocess and waits until it answers.
+
+    :param port: port to listen on, 0 for any free port
+    :type port: int
+    :param env: extra environment variables, e.g. QNA_BACKEND
+    :type env: Dict
+
+    :return: the server process and its base url
+    :rtype: Tuple[subprocess.Popen, str]
+    """
+    if not port:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=APP_DIR, env={**os.environ, **(env or {})},
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(url + "/batching_stats", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError(f"Server not up after {timeout}s")
+
+
+def bench_http(url: str,
+               context_questions: List[str],
+               queries: List[str],
+               concurrency: List[int] = (1, 8, 32),
+               requests: int = 500,
+               top_k: int = 1,
+               timeout: float = 30.0) -> List[Dict]:
+    """
+    Load test of '/get_answer': sets a context, then sends single-question requests from
+    'concurrency' threads. Queries are made unique (numbered) so the result and embedding
+    caches do not hide the model. The server should run without the lexical tier
+    (QNA_LEXICAL_THRESHOLD=off, as 'start_server' is called here), which would answer
+    some of them without the model too.
+
+    :param url: base url of the API
+    :type url: str
+    :param context_questions: questions of the context set before the test
+    :type context_questions: List[str]
+    :param queries: questions to ask, cycled
+    :type queries: List[str]
+    :param concurrency: concurrent clients, one result per value
+    :type concurrency: List[int]
+    :param requests: requests per concurrency level
+    :type requests: int
+    :param top_k: 'top_k' of the requests
+    :type top_k: int
+
+    :return: one result per concurrency level with throughput and latency p50/p99 (ms)
+    :rtype: List[Dict]
+    """
+    _post(url + "/set_context", {'questions': context_questions,
+                                 'answers': [f"answer {i}" for i in range(len(context_questions))]}, timeout=600)
+    results = []
+    counter = iter(range(10 ** 12))
+    lock = threading.Lock()
+    for clients in concurrency:
+        latencies, errors = [], [0]
+
+        def worker(n_requests: int) -> None:
+            for _ in range(n_requests):
+                with lock:
+                    i = next(counter)
+                question = f"{queries[i % len(queries)]} {i}"
+                start = time.perf_counter()
+                try:
+                    status, _ = _post(url + "/get_answer", {'questions': [question], 'top_k': top_k}, timeout)
+                    ok = status == 200
+                except OSError:
+                    ok = False
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    errors[0] += not ok
+
+        shares = [requests // clients + (c < requests % clients) for c in range(clients)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            for future in [pool.submit(worker, share) for share in shares]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        results.append({
+            'concurrency': clients,
+            'requests': len(latencies),
+            'errors': errors[0],
+            'requests_per_sec': len(latencies) / elapsed,
+            'latency_p50_ms': percentile(latencies, 50),
+            'latency_p99_ms': percentile(latencies, 99),
+        })
+    return results
+
+
+def _ints(value: str) -> List[int]:
+    return [int(float(v)) for v in value.split(",")]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark embedding, search and the HTTP API. Results are JSON")
+    parser.add_argument("--suites", default="embedding,search,http", help="comma separated: embedding,search,http")
+    parser.add_argument("--corpus", default="synthetic", help="'synthetic' or a SQuAD json file")
+    parser.add_argument("--model", default="paraphrase-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--sentences", type=int, default=512, help="sentences embedded per embedding pass")
+    parser.add_argument("--batch-sizes", type=_ints, default=[1, 8, 32, 128])
+    parser.add_argument("--threads", type=_ints, default=None, help="torch thread counts, e.g. 1,2,4")
+    parser.add_argument("--embed-workers", type=_ints, default=None,
+                        help="also time embedding --context-size questions with these pool sizes, e.g. 0,4,8")
+    parser.add_argument("--embed-threads", type=int, default=1, help="torch threads per pool process")
+    parser.add_argument("--sizes", type=_ints, default=SEARCH_SIZES, help="context sizes, e.g. 1e3,1e4")
+    parser.add_argument("--indexes", default="flat,ivf",
+                        help="hnsw builds slowly beyond ~1e5 rows; 'sharded' uses one flat shard per CPU")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--url", default=None, help="API to load test; a local server is started if omitted")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=500, help="requests per concurrency level")
+    parser.add_argument("--context-size", type=int, default=2000, help="context questions for the HTTP test")
+    parser.add_argument("--output", default=None, help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    suites = args.suites.split(",")
+    questions = load_questions(args.corpus, max(args.sentences, args.context_size, 2 * args.queries))
+    results = {'environment': environment(), 'config': vars(args),
+               # a corpus with repeated questions measures the caches rather than the index
+               'questions': {'count': len(questions), 'unique': len(set(questions)),
+                             'context_unique': len(set(questions[:args.context_size]))}}
+
+    if 'embedding' in suites:
+        results['embedding'] = bench_embedding(questions[:args.sentences], args.model, args.backend,
+                                               args.batch_sizes, args.threads)
+        if args.embed_workers:
+            results['bulk_embedding'] = bench_bulk_embedding(questions[:args.context_size], args.model, args.backend,
+                                                             args.embed_workers, args.embed_threads)
+
+    if 'search' in suites:
+        from classes import QASearcher
+        searcher = QASearcher(model_name=args.model, backend=args.backend, cache_size=0)
+        seeds = searcher.get_q_embeddings(questions[:args.queries], sort_by_length=True)
+        query_embeddings = searcher.get_q_embeddings(questions[args.queries:2 * args.queries])
+        del searcher
+        results['search'] = bench_search(seeds, query_embeddings, args.sizes, args.indexes.split(","))
+
+    if 'http' in suites:
+        process, url = (None, args.url) if args.url else start_server(env={'QNA_BACKEND': args.backend, 'QNA_LEXICAL_THRESHOLD': 'off'})
+        try:
+            results['http'] = bench_http(url, questions[:args.context_size], questions, args.concurrency,
+                                         args.requests)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,145 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Soft type assertions
+from typing import Any, Callable, Dict, Hashable
+
+
+def normalize_question(question: str) -> str:
+    """
+    Cache key for a question: lower-cased with whitespace collapsed. The MiniLM
+    tokenizer is uncased and splits on whitespace, so questions that only differ in
+    this way produce the same embedding.
+
+    :param question: question text
+    :type question: str
+
+    :return: normalized text
+    :rtype: str
+    """
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+def tensor_nbytes(value: Any) -> int:
+    """
+    Approximate memory footprint of a cached value. Exact for tensors.
+    """
+    if hasattr(value, 'element_size') and hasattr(value, 'numel'):
+        return value.element_size() * value.numel()
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    def __init__(self,
+                 max_entries: int = 10000,
+                 ttl: float = None,
+                 max_bytes: int = None,
+                 size_fn: Callable[[Any], int] = tensor_nbytes):
+        """
+        Thread-safe, bounded least recently used cache.
+
+        Entries are evicted least recently used first once either 'max_entries' or
+        'max_bytes' is exceeded, and are treated as missing once older than 'ttl' seconds.
+
+        :param max_entries: Maximum number of entries
+        :type max_entries: int
+        :param ttl: Time to live of an entry in seconds. No expiry if None
+        :type ttl: float
+        :param max_bytes: Maximum total size of the cached values, as measured by 'size_fn'
+        :type max_bytes: int
+        :param size_fn: Function returning the size in bytes of a value
+        :type size_fn: Callable[[Any], int]
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self._data = OrderedDict()  # key -> (value, size, inserted_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Looks up 'key', marking it as recently used.
+
+        :param key: cache key
+        :type key: Hashable
+        :param default: returned on a miss
+        :type default: Any
+
+        :return: cached value or 'default'
+        :rtype: Any
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Inserts or replaces 'key', evicting least recently used entries if over budget.
+
+        :param key: cache key
+        :type key: Hashable
+        :param value: value to cache
+        :type value: Any
+        """
+        size = self.size_fn(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while self._data and (
+                    len(self._data) > self.max_entries
+                    or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        """
+        Drops every entry. Counters are kept.
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss/eviction counters and current occupancy.
+
+        :rtype: Dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -1,5 +1,17 @@
+import math
+import os
+import threading
+from collections import Counter
+
 import torch
 from transformers import AutoModel, AutoTokenizer
+from backends import load_backend
+from cache import LRUCache, normalize_question
+from context import QAContext, empty_context, stack_rows
+from index import ShardedIndex, get_index, recall_at_k
+from ingest import EmbeddingPool
+from profiling import MODEL_BYTES, model_nbytes, observe_batch, stage
+from store import embedder_fingerprint, load_context, model_path, save_context
 
 # Soft type assertions
 from typing import Dict, Tuple, List
@@ -8,8 +20,15 @@ from transformers.models.bert.tokenization_bert_fast import BertTokenizerFast
 from transformers.modeling_outputs import BaseModelOutputWithPoolingAndCrossAttentions
 from torch import Tensor
 
+# bulk embeddings of at least this many questions go to the embedding pool, when there is one
+PARALLEL_MIN_QUESTIONS = 2048
+
 class QAEmbedder:
-    def __init__(self, model_name:str = "paraphrase-MiniLM-L6-v2"):
+    def __init__(self,
+                 model_name:str = "paraphrase-MiniLM-L6-v2",
+                 backend: str = "eager",
+                 workers: int = 0,
+                 threads_per_worker: int = 1):
         """
         QnA embedding model.
 
@@ -17,10 +36,26 @@ class QAEmbedder:
 
         :param model_name: Directory name with model and tokenizer files
         :type model_name: str
+        :param backend: Inference backend: 'eager' (fp32 PyTorch), 'int8' (dynamically quantized),
+            'torchscript' or 'onnx' (onnxruntime on CPU). See 'backends.py'
+        :type backend: str
+        :param workers: Processes embedding large bulk inputs (e.g. a whole context) in parallel,
+            see 'ingest.EmbeddingPool'. Started on first use. Disabled if 0
+        :type workers: int
+        :param threads_per_worker: torch intra-op threads of each of those processes
+        :type threads_per_worker: int
         """
         self.model = None
         self.tokenizer = None
+        self.forward = None
         self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self._fingerprint = None
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
         self.set_model()
 
     def get_model(self, model_name: str) -> Tuple[BertModel, BertTokenizerFast]:
@@ -33,16 +68,28 @@ class QAEmbedder:
         :return: Model and Tokenizer objects from the directory
         :rtype: Tuple[BertModel, BertTokenizerFast]
         """
-        model = AutoModel.from_pretrained("../" + model_name)
-        tokenizer = AutoTokenizer.from_pretrained("../" + model_name)
+        model = AutoModel.from_pretrained(model_path(model_name))
+        tokenizer = AutoTokenizer.from_pretrained(model_path(model_name))
         return model, tokenizer
 
     def set_model(self) -> None:
         """
         Instantiates a general tokenizer and model for the class using the 'self.get_model'
-        method.
+        method, and the forward function of the selected backend.
         """
         self.model, self.tokenizer = self.get_model(self.model_name)
+        self.forward = load_backend(self.backend, self.model, self.tokenizer, model_path(self.model_name))
+        MODEL_BYTES.set(model_nbytes(self.model))
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Content hash of the model directory and backend, computed once. Identifies which
+        model produced a set of cached embeddings.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = embedder_fingerprint(model_path(self.model_name), self.backend)
+        return self._fingerprint
 
     # get the available questions and answers for a given topic
     def get_qa(self,
@@ -51,6 +98,9 @@ class QAEmbedder:
         """
         Gets the available questions and answers for a given topic (from the json context data)
 
+        Needs the whole file loaded in memory and scans it linearly; prefer 'ingest.SquadIndex'
+        for large files or repeated lookups.
+
         :param topic: specific topic of focus
         :type topic: str
         :param data: the json context data
@@ -77,6 +127,9 @@ class QAEmbedder:
         Mean Pooling - Take attention mask into account for correct averaging
         source: https://huggingface.co/sentence-transformers/paraphrase-MiniLM-L6-v2
 
+        The masked sum is computed as a batched (1, T) x (T, H) product per sentence, so
+        no (B, T, H) expanded mask or masked copy of the token embeddings is built.
+
         :param model_output: ~
         :type model_output: BaseModelOutputWithPoolingAndCrossAttentions
         :param attention_mask: ~
@@ -86,52 +139,124 @@ class QAEmbedder:
         :rtype: Tensor
         """
         token_embeddings = model_output[0]
-
-        input_mask_expanded = (
-            attention_mask
-            .unsqueeze(-1)
-            .expand(token_embeddings.size())
-            .float()
-        )
+        mask = attention_mask.to(token_embeddings.dtype)
 
         pool_emb = (
-                torch.sum(token_embeddings * input_mask_expanded, 1)
-                / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+                torch.bmm(mask.unsqueeze(1), token_embeddings).squeeze(1)
+                / torch.clamp(mask.sum(1, keepdim=True), min=1e-9)
         )
 
         return pool_emb
 
+    def embed_encoded(self, encoded_input: Dict) -> Tensor:
+        """
+        Runs the model on an already tokenized (and padded) batch and mean pools the output.
+
+        :param encoded_input: tokenizer output with 'pt' tensors
+        :type encoded_input: Dict
+
+        :return: (B, d) sentence embeddings
+        :rtype: Tensor
+        """
+        observe_batch(encoded_input['attention_mask'])
+        # Compute token embeddings
+        with torch.no_grad(), stage('forward'):
+            model_output = self.forward(encoded_input)
+
+        # Perform mean pooling
+        with stage('pooling'):
+            return self.mean_pooling(model_output, encoded_input['attention_mask'])
+
     def get_embeddings(self,
                        questions: List,
-                       batch: int = 32) -> Tensor:
+                       batch: int = 32,
+                       sort_by_length: bool = False,
+                       max_length: int = None) -> Tensor:
         """
         Function for converting questions into Tensors (vector embeddings)
         :param questions: Different questions
         :type questions: List
         :param batch: ~
         :type batch: int
+        :param sort_by_length: Tokenize everything first and batch questions of similar token
+            length together, so short questions are not padded up to a long one. The output
+            keeps the input order. Worth it for bulk embedding of large corpora
+        :type sort_by_length: bool
+        :param max_length: Truncate questions to at most this many tokens. Defaults to the
+            model maximum
+        :type max_length: int
 
         :return: Embeddings for each input question
         :rtype: Tensor
         """
+        if sort_by_length and self.workers and len(questions) >= PARALLEL_MIN_QUESTIONS:
+            return self.embedding_pool().embed(list(questions), batch=batch, max_length=max_length)
+        if sort_by_length:
+            return self._get_embeddings_bucketed(questions, batch, max_length)
+
         question_embeddings = []
         for i in range(0, len(questions), batch):
             # Tokenize sentences
-            encoded_input = self.tokenizer(questions[i:i + batch], padding=True, truncation=True, return_tensors='pt')
+            with stage('tokenize'):
+                encoded_input = self.tokenizer(questions[i:i + batch], padding=True, truncation=True,
+                                               max_length=max_length, return_tensors='pt')
 
-            # Compute token embeddings
-            with torch.no_grad():
-                model_output = self.model(**encoded_input)
-
-            # Perform mean pooling
-            batch_embeddings = self.mean_pooling(model_output, encoded_input['attention_mask'])
+            batch_embeddings = self.embed_encoded(encoded_input)
             question_embeddings.append(batch_embeddings)
 
         question_embeddings = torch.cat(question_embeddings, dim=0)
         return question_embeddings
 
+    def embedding_pool(self) -> EmbeddingPool:
+        """
+        The process pool of this embedder, started on first use. A pool inherited through
+        fork is not reused: its processes belong to the parent.
+        """
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = EmbeddingPool(self.model_name, self.backend, self.workers, self.threads_per_worker)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _get_embeddings_bucketed(self, questions: List, batch: int, max_length: int) -> Tensor:
+        """
+        'get_embeddings' with length bucketing. See 'get_embeddings'.
+        """
+        with stage('tokenize'):
+            token_ids = self.tokenizer(list(questions), truncation=True, max_length=max_length,
+                                       return_attention_mask=False, return_token_type_ids=False)['input_ids']
+        order = sorted(range(len(questions)), key=lambda i: len(token_ids[i]))
+
+        question_embeddings = None
+        for i in range(0, len(order), batch):
+            rows = order[i:i + batch]
+            # each bucket is only padded up to its own longest question
+            with stage('tokenize'):
+                encoded_input = self.tokenizer([questions[r] for r in rows], padding=True, truncation=True,
+                                               max_length=max_length, return_tensors='pt')
+            batch_embeddings = self.embed_encoded(encoded_input)
+
+            if question_embeddings is None:
+                question_embeddings = batch_embeddings.new_empty(len(questions), batch_embeddings.shape[1])
+            question_embeddings[rows] = batch_embeddings
+
+        return question_embeddings
+
 class QASearcher:
-    def __init__(self, model_name: str = "paraphrase-MiniLM-L6-v2"):
+    def __init__(self,
+                 model_name: str = "paraphrase-MiniLM-L6-v2",
+                 index: str = "flat",
+                 index_params: Dict = None,
+                 cache_size: int = 10000,
+                 cache_ttl: float = None,
+                 cache_max_bytes: int = 64 * 2 ** 20,
+                 cache_results: bool = True,
+                 backend: str = "eager",
+                 embedder: 'QAEmbedder' = None,
+                 embedding_cache: LRUCache = None,
+                 exact_match: bool = True,
+                 lexical_threshold: float = None,
+                 lexical_prefilter: int = None):
         """
         Defines a QA Search model. This is, given a new question it searches
         the most similar questions in a set 'context' and returns both the best
@@ -139,42 +264,423 @@ class QASearcher:
 
         :param model_name: model name/directory of interest
         :type model_name: str
+        :param index: Nearest-neighbour index used for search. 'flat' (exact), 'ivf' (clustered),
+            'hnsw' (graph) or 'sharded' (any of them, split into shards searched in parallel). See 'index.py'
+        :type index: str
+        :param index_params: Keyword arguments forwarded to the index constructor
+        :type index_params: Dict
+        :param cache_size: Maximum number of cached query embeddings (and results). 0 disables caching
+        :type cache_size: int
+        :param cache_ttl: Time to live in seconds of cached entries. No expiry if None
+        :type cache_ttl: float
+        :param cache_max_bytes: Memory cap of each cache
+        :type cache_max_bytes: int
+        :param cache_results: Also cache the final answers for the current context version
+        :type cache_results: bool
+        :param backend: Inference backend of the embedder, see 'QAEmbedder'
+        :type backend: str
+        :param embedder: Already loaded embedder to share between searchers. 'model_name' and
+            'backend' are ignored if given
+        :type embedder: QAEmbedder
+        :param embedding_cache: Query embedding cache to share between searchers using the same embedder
+        :type embedding_cache: LRUCache
+        :param exact_match: Answer questions whose normalized text is a context question without
+            running the model
+        :type exact_match: bool
+        :param lexical_threshold: Answer questions whose words overlap a context question's by at
+            least this much (Jaccard, see 'lexical.py') without running the model. Such answers
+            carry the overlap as 'lexical_score' and no cosine 'score'. Disabled if None
+        :type lexical_threshold: float
+        :param lexical_prefilter: Only compare the embeddings of the top 'lexical_prefilter' BM25
+            matches of a question, instead of searching the whole index. Questions sharing no
+            word with the context still search the index. Disabled if None
+        :type lexical_prefilter: int
         """
-        self.answers = None
-        self.questions = None
-        self.question_embeddings = None
-        self.embedder = QAEmbedder(model_name=model_name)
+        self.index_name = index
+        self.index_params = index_params or {}
+        self.exact_match = exact_match
+        self.lexical_threshold = lexical_threshold
+        self.lexical_prefilter = lexical_prefilter
+        # questions answered per tier: 'cache', 'exact', 'lexical' (no model call) and 'dense'
+        self.tiers = Counter()
+        self._tiers_lock = threading.Lock()
+        self.embedder = embedder or QAEmbedder(model_name=model_name, backend=backend)
+        self.context = empty_context(get_index(self.index_name, **self.index_params))
+        # serializes writers; readers only dereference 'self.context' once
+        self._update_lock = threading.Lock()
+
+        # query embeddings only depend on the model, so they survive context changes.
+        # Results depend on the context and are dropped whenever it is swapped
+        # an empty cache is falsy (it has a length), so test for None: a shared cache must be kept
+        self.embedding_cache = embedding_cache if embedding_cache is not None else (
+            LRUCache(cache_size, ttl=cache_ttl, max_bytes=cache_max_bytes) if cache_size else None
+        )
+        self.result_cache = (
+            LRUCache(cache_size, ttl=cache_ttl, max_bytes=cache_max_bytes, size_fn=lambda r: 512)
+            if cache_size and cache_results else None
+        )
+
+    @property
+    def questions(self) -> List[str]:
+        return self.context.questions
+
+    @property
+    def answers(self) -> List[str]:
+        return self.context.answers
 
-    def set_context_qa(self, questions: List[str], answers: List[str]) -> None:
+    @property
+    def index(self):
+        return self.context.index
+
+    @property
+    def question_embeddings(self) -> Tensor:
+        return self.context.embeddings
+
+    def _embed_missing(self, context: QAContext, questions: List[str]) -> Tuple[Tensor, int]:
         """
-        Sets the QnA context to be used during search.
+        Embeds the given questions, reusing the rows of 'context' whose content hash matches.
+
+        :param context: context to reuse embeddings from
+        :type context: QAContext
+        :param questions: List of strings with questions
+        :type questions: List[str]
+
+        :return: (N, d) normalized embeddings and the number of questions actually embedded
+        :rtype: Tuple[Tensor, int]
+        """
+        found = context.cached_embeddings(questions)
+        missing = [i for i in range(len(questions)) if i not in found]
+        if missing:
+            new_embeddings = self.get_q_embeddings([questions[i] for i in missing], sort_by_length=True)
+            found.update(zip(missing, new_embeddings))
+        dim = context.index.dim or (new_embeddings.shape[1] if missing else 0)
+        return stack_rows([found[i] for i in range(len(questions))], dim), len(missing)
+
+    def _swap(self, context: QAContext) -> None:
+        if self.lexical_threshold is not None or self.lexical_prefilter:
+            # built here, on the write path, rather than by the first query after every change
+            context.lexical
+        self.context = context
+        if self.result_cache is not None:
+            self.result_cache.clear()
+
+    def set_context_qa(self, questions: List[str], answers: List[str], ids: List[str] = None) -> Dict:
+        """
+        Sets the QnA context to be used during search. Questions whose text is already
+        in the current context are not re-embedded.
 
         :param questions: List of strings with questions
         :type questions: List[str]
         :param answers: List of corresponding BEST answers for each question
         :type answers: List[str]
+        :param ids: Stable ids for each question. Defaults to the list positions
+        :type ids: List[str]
+
+        :return: number of questions 'embedded' and 'reused'
+        :rtype: Dict
         """
-        self.answers = answers
-        self.questions = questions
-        self.question_embeddings = self.get_q_embeddings(questions)
+        ids = [str(i) for i in range(len(questions))] if ids is None else [str(i) for i in ids]
+        with self._update_lock:
+            embeddings, n_embedded = self._embed_missing(self.context, questions)
+            index = get_index(self.index_name, **self.index_params)
+            index.build(embeddings)
+            self._swap(QAContext(ids, list(questions), list(answers), index, version=self.context.version + 1))
 
-    def get_q_embeddings(self, questions: List[str]) -> Tensor:
+        return {'embedded': n_embedded, 'reused': len(questions) - n_embedded}
+
+    def upsert_context_qa(self, ids: List[str], questions: List[str], answers: List[str],
+                          insert: bool = True) -> Dict:
         """
-        Gets the embeddings for the questions in 'context'.
+        Adds new questions and updates existing ones, keyed by id. Only new or changed
+        question texts are embedded; answer-only changes cost no model call. The index
+        and the lookups of the unchanged rows are carried over, not rebuilt: see
+        'QAContext.derive' and the indexes' 'clone' and 'replace' for what is still copied.
 
+        :param ids: Stable question ids
+        :type ids: List[str]
         :param questions: List of strings with questions
         :type questions: List[str]
+        :param answers: List of corresponding BEST answers for each question
+        :type answers: List[str]
+        :param insert: Whether ids not in the context are added. If not, they raise a
+            KeyError listing them and nothing is changed
+        :type insert: bool
+
+        :return: number of questions 'added', 'updated' and 'embedded'
+        :rtype: Dict
+        """
+        # last occurrence wins for repeated ids
+        updates = {str(i): (q, a) for i, q, a in zip(ids, questions, answers)}
+
+        with self._update_lock:
+            context = self.context
+            changed_rows, added_ids = [], []
+            for qid, (question, _) in updates.items():
+                row = context.positions.get(qid)
+                if row is None:
+                    added_ids.append(qid)
+                elif context.questions[row] != question:
+                    changed_rows.append(row)
+            if added_ids and not insert:
+                raise KeyError(added_ids)
+
+            embeddings, n_embedded = self._embed_missing(
+                context, [updates[context.ids[row]][0] for row in changed_rows] + [updates[qid][0] for qid in added_ids]
+            )
+
+            index = context.index
+            if changed_rows or added_ids:
+                index = index.clone()
+            if changed_rows:
+                index.replace(changed_rows, embeddings[:len(changed_rows)])
+            if added_ids:
+                index.add(embeddings[len(changed_rows):])
+            self._swap(context.derive(updates, index, version=context.version + 1))
+
+        return {'added': len(added_ids), 'updated': len(updates) - len(added_ids), 'embedded': n_embedded}
+
+    def update_context_qa(self, ids: List[str], questions: List[str], answers: List[str]) -> Dict:
+        """
+        Updates existing questions, keyed by id. Unlike 'upsert_context_qa' unknown ids
+        are not added: they raise a KeyError listing them, and nothing is changed.
+
+        :param ids: Stable question ids
+        :type ids: List[str]
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param answers: List of corresponding BEST answers for each question
+        :type answers: List[str]
+
+        :return: number of questions 'added', 'updated' and 'embedded'
+        :rtype: Dict
+        """
+        return self.upsert_context_qa(ids, questions, answers, insert=False)
+
+    def add_context_qa(self, questions: List[str], answers: List[str], ids: List[str] = None) -> Dict:
+        """
+        Inserts new questions and answers into the existing context. Only the new
+        questions are embedded and they are added incrementally to the index.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param answers: List of corresponding BEST answers for each question
+        :type answers: List[str]
+        :param ids: Stable ids for the new questions. Defaults to continuing the list positions
+        :type ids: List[str]
+
+        :return: number of questions 'added', 'updated' and 'embedded'
+        :rtype: Dict
+        """
+        if ids is None:
+            used, ids, n = self.context.positions, [], len(self.context)
+            while len(ids) < len(questions):
+                if str(n) not in used:
+                    ids.append(str(n))
+                n += 1
+        return self.upsert_context_qa(ids, questions, answers)
+
+    def delete_context_qa(self, ids: List[str]) -> Dict:
+        """
+        Removes questions from the context by id. Unknown ids are ignored.
+
+        :param ids: Stable question ids
+        :type ids: List[str]
 
-        :return: Embeddings for each question
+        :return: number of questions 'deleted'
+        :rtype: Dict
+        """
+        with self._update_lock:
+            context = self.context
+            drop = {context.positions[str(i)] for i in ids if str(i) in context.positions}
+            if not drop:
+                return {'deleted': 0}
+
+            keep = [row for row in range(len(context)) if row not in drop]
+            index = context.index.rebuild(context.embeddings[keep])
+            self._swap(QAContext(
+                [context.ids[row] for row in keep],
+                [context.questions[row] for row in keep],
+                [context.answers[row] for row in keep],
+                index,
+                version=context.version + 1,
+            ))
+
+        return {'deleted': len(drop)}
+
+    def save_context(self, path: str) -> str:
+        """
+        Saves the current context (ids, questions, answers and the normalized float32
+        embedding matrix) to the on-disk cache at 'path'. See 'store.py'.
+
+        :param path: cache directory
+        :type path: str
+
+        :return: the snapshot directory written
+        :rtype: str
+        """
+        return save_context(path, self.context, self.embedder.fingerprint)
+
+    def load_context(self, path: str) -> bool:
+        """
+        Loads a context saved with 'save_context'. The embedding matrix is memory-mapped
+        rather than read, so workers on the same host share one copy of it. The cache is
+        ignored if it was produced by a different model.
+
+        :param path: cache directory
+        :type path: str
+
+        :return: whether a valid cache was found and loaded
+        :rtype: bool
+        """
+        cached = load_context(path, self.embedder.fingerprint)
+        if cached is None:
+            return False
+
+        _, records, embeddings = cached
+        index = get_index(self.index_name, **self.index_params)
+        index.build(embeddings)
+        with self._update_lock:
+            self._swap(QAContext(records['ids'], records['questions'], records['answers'], index,
+                                 version=self.context.version + 1))
+        return True
+
+    def get_q_embeddings(self, questions: List[str], batch: int = 32, sort_by_length: bool = False) -> Tensor:
+        """
+        Gets the normalized embeddings for the given questions.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param batch: Performs the embedding job 'batch' questions at a time
+        :type batch: int
+        :param sort_by_length: Batch questions of similar token length together, see
+            'QAEmbedder.get_embeddings'. Used for bulk context embedding
+        :type sort_by_length: bool
+
+        :return: (N, d) normalized embeddings for each question
         :rtype: Tensor
         """
-        question_embeddings = self.embedder.get_embeddings(questions)
-        question_embeddings = torch.nn.functional.normalize(question_embeddings, p=2, dim=1)
-        return question_embeddings.transpose(0, 1)
+        question_embeddings = self.embedder.get_embeddings(questions, batch=batch, sort_by_length=sort_by_length)
+        with stage('normalize'):
+            return torch.nn.functional.normalize(question_embeddings, p=2, dim=1)
+
+    def embed_queries(self, questions: List[str], batch: int = 32) -> Tensor:
+        """
+        'get_q_embeddings' for incoming queries, served from the embedding cache where
+        possible. Only questions missing from the cache go through the model.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param batch: Performs the embedding job 'batch' questions at a time
+        :type batch: int
+
+        :return: (N, d) normalized embeddings for each question
+        :rtype: Tensor
+        """
+        if self.embedding_cache is None:
+            return self.get_q_embeddings(questions, batch=batch)
+
+        keys = [normalize_question(q) for q in questions]
+        rows = [self.embedding_cache.get(key) for key in keys]
+        missing = list({key: None for key, row in zip(keys, rows) if row is None})
+        if missing:
+            embedded = dict(zip(missing, self.get_q_embeddings(missing, batch=batch)))
+            for key, row in embedded.items():
+                # clone so a cached row does not keep its whole batch tensor alive
+                self.embedding_cache.put(key, row.clone())
+            rows = [embedded[key] if row is None else row for key, row in zip(keys, rows)]
+        return torch.stack(rows)
+
+    def _count(self, tier: str, n: int = 1) -> None:
+        with self._tiers_lock:
+            self.tiers[tier] += n
+
+    def lookup_answers(self, questions: List[str], top_k: int = 1, min_score: float = None) -> List[Dict]:
+        """
+        Answers what can be answered without the model, trying for each question in turn:
+          - the result cache of the current context version,
+          - an exact match of its normalized text with a context question ('exact_match'),
+          - a context question with (nearly) the same words ('lexical_threshold').
+        The two match tiers only serve 'top_k' == 1 queries.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param top_k: see 'get_answers'
+        :type top_k: int
+        :param min_score: see 'get_answers'
+        :type min_score: float
+
+        :return: the answer for each question, None where it needs the model
+        :rtype: List[Dict]
+        """
+        context = self.context
+        response = []
+        with stage('lookup'):
+            for question in questions:
+                key = normalize_question(question)
+                cached = None
+                if self.result_cache is not None:
+                    cached = self.result_cache.get((context.version, key, top_k, min_score))
+                if cached is not None:
+                    self._count('cache')
+                    response.append({'orig_q': question, **cached})
+                    continue
+
+                row, score, tier, extra = None, None, None, {}
+                if top_k == 1 and self.exact_match:
+                    row = context.rows_by_text.get(key)
+                    # the same normalized text gives the same embedding, so this is the dense result too
+                    score, tier = 1.0, 'exact'
+                if row is None and top_k == 1 and self.lexical_threshold is not None and len(context):
+                    overlap, row = context.lexical.best_match(question)
+                    # a word overlap is not a cosine similarity, so it is not reported as the 'score'
+                    # nor compared with 'min_score'
+                    score, tier, extra = None, 'lexical', {'lexical_score': overlap}
+                    if row is not None and overlap < self.lexical_threshold:
+                        row = None
+                if row is None:
+                    response.append(None)
+                    continue
+
+                self._count(tier)
+                response.append({
+                    'orig_q': question,
+                    'best_id': context.ids[row],
+                    'best_q': context.questions[row],
+                    'best_a': context.answers[row],
+                    'score': score,
+                    'matched': True,
+                    'tier': tier,
+                    **extra,
+                })
+        return response
+
+    def cache_stats(self) -> Dict:
+        """
+        Hit/miss/eviction counters of the query embedding and result caches.
+
+        :rtype: Dict
+        """
+        return {
+            'embeddings': self.embedding_cache.stats() if self.embedding_cache is not None else None,
+            'results': self.result_cache.stats() if self.result_cache is not None else None,
+            'tiers': self.tier_stats(),
+        }
+
+    def tier_stats(self) -> Dict:
+        """
+        Questions answered per lookup tier ('cache', 'exact', 'lexical', 'dense') and the
+        fraction answered without running the model.
+
+        :rtype: Dict
+        """
+        with self._tiers_lock:
+            tiers = {tier: self.tiers[tier] for tier in ('cache', 'exact', 'lexical', 'dense')}
+        total = sum(tiers.values())
+        return {**tiers, 'model_avoided': (total - tiers['dense']) / total if total else 0.0}
 
     def cosine_similarity(self, questions: List[str], batch: int = 32) -> Tensor:
         """
-        Gets the cosine similarity between the new questions and the 'context' questions.
+        Gets the exact cosine similarity between the new questions and every 'context' question.
         This is done to determine how close a given sentence is to another.
 
         :param questions: List of strings with questions
@@ -185,14 +691,54 @@ class QASearcher:
         :return: Cosine similarity tensor
         :rtype: Tensor
         """
-        question_embeddings = self.embedder.get_embeddings(questions, batch=batch)
-        question_embeddings = torch.nn.functional.normalize(question_embeddings, p=2, dim=1)
+        question_embeddings = self.embed_queries(questions, batch=batch)
 
-        cosine_sim = torch.mm(question_embeddings, self.question_embeddings)
+        index = self.context.index
+        with stage('search'):
+            if isinstance(index, ShardedIndex) and len(index.shards) > 1:
+                # one block of columns per shard, without concatenating the shards first
+                cosine_sim = torch.cat([torch.mm(question_embeddings, shard.embeddings.t())
+                                        for shard in index.shards], dim=1)
+            else:
+                cosine_sim = torch.mm(question_embeddings, index.embeddings.t())
 
         return cosine_sim
 
-    def get_answers(self, questions: List[str], batch: int = 32) -> List[Dict]:
+    def search(self, questions: List[str], k: int = 1, batch: int = 32) -> Tuple[Tensor, Tensor]:
+        """
+        Batched top-k retrieval of the closest 'context' questions through the index.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param k: Number of context questions returned per question
+        :type k: int
+        :param batch: Performs the embedding job 'batch' questions at a time
+        :type batch: int
+
+        :return: (B, k) cosine similarity scores and (B, k) context row ids
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        return self.context.index.search(self.embed_queries(questions, batch=batch), k=k)
+
+    def index_recall(self, questions: List[str], k: int = 10) -> float:
+        """
+        Recall of the configured index against exact search for the given questions.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param k: Number of neighbours compared per question
+        :type k: int
+
+        :return: recall@k in [0, 1]
+        :rtype: float
+        """
+        return recall_at_k(self.context.index, self.get_q_embeddings(questions), k=k)
+
+    def get_answers(self,
+                    questions: List[str],
+                    batch: int = 32,
+                    top_k: int = 1,
+                    min_score: float = None) -> List[Dict]:
         """
         Gets the best answers in the stored 'context' for the given new 'questions'.
 
@@ -200,25 +746,115 @@ class QASearcher:
         :type questions: List[str]
         :param batch: Performs the embedding job 'batch' questions at a time
         :type batch: int
+        :param top_k: Number of candidate answers returned per question
+        :type top_k: int
+        :param min_score: Minimum cosine similarity for a context question to count as a match
+        :type min_score: float
 
         :return: a `list` of `dict`'s containing the original question ('orig_q'), the most similar
-            question in the context ('best_q') and the associated answer ('best_a').
+            question in the context ('best_q'), the associated answer ('best_a'), its similarity
+            ('score') and whether it cleared 'min_score' ('matched'). When nothing matches, 'best_*'
+            are None. With 'top_k' > 1, 'candidates' lists every match as 'id', 'q', 'a' and 'score'.
+            'tier' tells how the answer was found, see 'lookup_answers': 'exact' and 'lexical' answers
+            were found without the model. 'exact' answers have a 'score' of 1.0, 'lexical' answers have no
+            'score' and report their word overlap as 'lexical_score'.
+        :rtype:List[Dict]
+        """
+        response = self.lookup_answers(questions, top_k=top_k, min_score=min_score)
+        missing = [i for i, r in enumerate(response) if r is None]
+        if missing:
+            missing_questions = [questions[i] for i in missing]
+            answers = self.answers_from_embeddings(missing_questions, self.embed_queries(missing_questions, batch=batch),
+                                                   top_k=top_k, min_score=min_score)
+            for i, answer in zip(missing, answers):
+                response[i] = answer
+        return response
+
+    def answers_from_embeddings(self,
+                                questions: List[str],
+                                question_embeddings: Tensor,
+                                top_k: int = 1,
+                                min_score: float = None) -> List[Dict]:
+        """
+        Same as 'get_answers' for questions that were already embedded (and normalized),
+        e.g. by a batching front end.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+        :param question_embeddings: (B, d) normalized embeddings of 'questions'
+        :type question_embeddings: Tensor
+        :param top_k: Number of candidate answers returned per question
+        :type top_k: int
+        :param min_score: Minimum cosine similarity for a context question to count as a match
+        :type min_score: float
+
+        :return: see 'get_answers'
         :rtype:List[Dict]
         """
-        similarity = self.cosine_similarity(questions, batch=batch)
+        # a single snapshot is used throughout, so concurrent context updates are never seen half-applied
+        context = self.context
+        self._count('dense', len(questions))
+        with stage('search'):
+            if self.lexical_prefilter and len(context):
+                scores, ids = self._prefiltered_search(context, questions, question_embeddings, top_k)
+            else:
+                scores, ids = context.index.search(question_embeddings, k=top_k)
+
+        # thresholding is done on the whole (B, k) result at once; the rows are then only
+        # converted to lists, never indexed one tensor element at a time
+        matched = ids >= 0
+        if min_score is not None:
+            matched &= scores >= min_score
+        scores, ids, matched = scores.tolist(), ids.tolist(), matched.tolist()
 
         response = []
-        for i in range(similarity.shape[0]):
-            best_ix = similarity[i].argmax()
-            best_q = self.questions[best_ix]
-            best_a = self.answers[best_ix]
-
-            response.append(
-                {
-                    'orig_q': questions[i],
-                    'best_q': best_q,
-                    'best_a': best_a,
-                }
-            )
+        for question, row_scores, row_ids, row_matched in zip(questions, scores, ids, matched):
+            candidates = [
+                {'id': context.ids[ix], 'q': context.questions[ix], 'a': context.answers[ix], 'score': score}
+                for score, ix, ok in zip(row_scores, row_ids, row_matched) if ok
+            ]
+            best = candidates[0] if candidates else None
+
+            result = {
+                'best_id': best['id'] if best else None,
+                'best_q': best['q'] if best else None,
+                'best_a': best['a'] if best else None,
+                'score': best['score'] if best else (row_scores[0] if row_ids[0] >= 0 else None),
+                'matched': best is not None,
+                'tier': 'dense',
+            }
+            if top_k > 1:
+                result['candidates'] = candidates
+            if self.result_cache is not None:
+                self.result_cache.put((context.version, normalize_question(question), top_k, min_score), result)
+            response.append({'orig_q': question, **result})
+
+        return response
+
+    def _prefiltered_search(self,
+                            context: QAContext,
+                            questions: List[str],
+                            question_embeddings: Tensor,
+                            k: int) -> Tuple[Tensor, Tensor]:
+        """
+        'index.search' restricted to the top 'lexical_prefilter' BM25 matches of every
+        question. Questions without any lexical match search the whole index.
 
-        return response
\ No newline at end of file
+        :return: (B, k) scores and (B, k) context row ids, padded with -inf / -1
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        scores = torch.full((len(questions), k), -math.inf)
+        ids = torch.full((len(questions), k), -1, dtype=torch.long)
+        unfiltered = []
+        for i, question in enumerate(questions):
+            rows = [row for _, row in context.lexical.search(question, self.lexical_prefilter)]
+            if not rows:
+                unfiltered.append(i)
+                continue
+            rows = torch.tensor(rows)
+            top = torch.mv(context.index.rows(rows), question_embeddings[i].to(torch.float32)).topk(min(k, len(rows)))
+            scores[i, :len(top.values)] = top.values
+            ids[i, :len(top.values)] = rows[top.indices]
+        if unfiltered:
+            scores[unfiltered], ids[unfiltered] = context.index.search(question_embeddings[unfiltered], k=k)
+        return scores, ids
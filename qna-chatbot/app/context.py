@@ -0,0 +1,187 @@
+import copy
+import hashlib
+
+import torch
+
+# Soft type assertions
+from typing import Dict, List, Tuple
+from torch import Tensor
+from cache import normalize_question
+from index import FlatIndex
+from lexical import BM25Index
+
+
+def content_hash(question: str) -> str:
+    """
+    Hash of a question's text, used to detect whether it needs to be re-embedded.
+
+    :param question: question text
+    :type question: str
+
+    :return: hex digest
+    :rtype: str
+    """
+    return hashlib.sha1(question.encode('utf-8')).hexdigest()
+
+
+class QAContext:
+    def __init__(self,
+                 ids: List[str],
+                 questions: List[str],
+                 answers: List[str],
+                 index: FlatIndex,
+                 version: int = 0):
+        """
+        Immutable snapshot of a QnA search context. Row 'i' of the index holds the
+        normalized embedding of 'questions[i]'.
+
+        Snapshots are never modified after construction. Updates build a new snapshot
+        and the searcher swaps its reference in one assignment, so readers holding the
+        previous snapshot keep a consistent view.
+
+        :param ids: Stable question ids
+        :type ids: List[str]
+        :param questions: Questions, aligned with 'ids'
+        :type questions: List[str]
+        :param answers: Answers, aligned with 'ids'
+        :type answers: List[str]
+        :param index: Index holding one embedding row per question
+        :type index: FlatIndex
+        :param version: Monotonic context version
+        :type version: int
+        """
+        if not len(ids) == len(questions) == len(answers) == len(index):
+            raise ValueError("ids, questions, answers and index rows must have the same length")
+        if len(set(ids)) != len(ids):
+            raise ValueError("Question ids must be unique")
+
+        self.ids = ids
+        self.questions = questions
+        self.answers = answers
+        self.index = index
+        self.version = version
+        self.hashes = [content_hash(q) for q in questions]
+        self.positions = {qid: row for row, qid in enumerate(ids)}
+        self.rows_by_hash = {h: row for row, h in enumerate(self.hashes)}
+        # normalized text -> first row with it, answers verbatim copies of context questions
+        self.rows_by_text = {}
+        for row, question in enumerate(questions):
+            self.rows_by_text.setdefault(normalize_question(question), row)
+        self._lexical = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def derive(self, updates: Dict[str, Tuple[str, str]], index: FlatIndex, version: int) -> 'QAContext':
+        """
+        New snapshot with the given (question, answer) pairs changed or appended, keyed by
+        id. New ids are appended in the order of 'updates'. Only the updated rows are
+        hashed and normalized; the hashes, positions and lookups of the other rows are
+        carried over. The snapshot still copies its row lists and lookup dicts once,
+        since the previous one stays readable: O(N) pointer copies in C, next to the
+        per-row Python work of building a context from scratch.
+
+        A changed row that was the lookup target of a question text or hash shared with
+        other rows drops that entry; those rows are then found by the index instead.
+
+        :param updates: id -> (question, answer)
+        :type updates: Dict[str, Tuple[str, str]]
+        :param index: Index holding the rows of the new snapshot
+        :type index: FlatIndex
+        :param version: Monotonic context version
+        :type version: int
+
+        :return: the new snapshot
+        :rtype: QAContext
+        """
+        context = copy.copy(self)
+        context.ids, context.questions, context.answers = list(self.ids), list(self.questions), list(self.answers)
+        context.hashes = list(self.hashes)
+        context.positions = dict(self.positions)
+        context.rows_by_hash = dict(self.rows_by_hash)
+        context.rows_by_text = dict(self.rows_by_text)
+        context.index = index
+        context.version = version
+        context._lexical = None
+
+        for qid, (question, answer) in updates.items():
+            row = context.positions.get(qid)
+            if row is None:
+                row = context.positions[qid] = len(context.ids)
+                context.ids.append(qid)
+                context.questions.append(question)
+                context.answers.append(answer)
+                context.hashes.append(content_hash(question))
+            else:
+                context.answers[row] = answer
+                if context.questions[row] == question:
+                    continue
+                old_hash, old_text = context.hashes[row], normalize_question(context.questions[row])
+                if context.rows_by_hash.get(old_hash) == row:
+                    del context.rows_by_hash[old_hash]
+                if context.rows_by_text.get(old_text) == row:
+                    del context.rows_by_text[old_text]
+                context.questions[row] = question
+                context.hashes[row] = content_hash(question)
+            context.rows_by_hash[context.hashes[row]] = row
+            context.rows_by_text.setdefault(normalize_question(question), row)
+
+        if len(context.ids) != len(index):
+            raise ValueError("ids, questions, answers and index rows must have the same length")
+        return context
+
+    @property
+    def embeddings(self) -> Tensor:
+        return self.index.embeddings
+
+    @property
+    def lexical(self) -> BM25Index:
+        """
+        BM25 index of the questions, built on first use. Snapshots are immutable, so it
+        never needs updating; a new snapshot builds its own.
+        """
+        if self._lexical is None:
+            self._lexical = BM25Index(self.questions)
+        return self._lexical
+
+    def cached_embeddings(self, questions: List[str]) -> Dict[int, Tensor]:
+        """
+        Looks up already computed embeddings by content hash.
+
+        :param questions: questions to look up
+        :type questions: List[str]
+
+        :return: mapping from position in 'questions' to the stored embedding row
+        :rtype: Dict[int, Tensor]
+        """
+        hits = {}
+        for i, question in enumerate(questions):
+            row = self.rows_by_hash.get(content_hash(question))
+            if row is not None:
+                hits[i] = row
+        if not hits:
+            return {}
+        # one gather, rather than one lookup per row (rows may be spread over shards)
+        return dict(zip(hits, self.index.rows(list(hits.values()))))
+
+
+def empty_context(index: FlatIndex) -> QAContext:
+    """
+    Context with no questions.
+
+    :param index: empty index of the desired type
+    :type index: FlatIndex
+
+    :return: empty context
+    :rtype: QAContext
+    """
+    return QAContext([], [], [], index, version=0)
+
+
+def stack_rows(rows: List[Tensor], dim: int) -> Tensor:
+    """
+    Stacks embedding rows into an (N, d) matrix, handling the empty case.
+    """
+    if not rows:
+        return torch.empty(0, dim)
+    return torch.stack(rows)
@@ -0,0 +1,869 @@
+import copy
+import heapq
+import math
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+# Soft type assertions
+from typing import Dict, List, Tuple
+from torch import Tensor
+
+
+class FlatIndex:
+    def __init__(self, dim: int = None):
+        """
+        Exact (brute force) inner product index over normalized embeddings.
+
+        Every query is compared against every stored row, so results are exact
+        and cost O(N*d) per query. Serves as the baseline for the approximate indexes.
+
+        :param dim: Embedding dimension, inferred from the first 'add' if omitted
+        :type dim: int
+        """
+        self.dim = dim
+        self._reset()
+
+    def _reset(self) -> None:
+        self._buffer = None
+        self._size = 0
+        # rows of the buffer written so far, shared with the clones that share the buffer
+        self._written = [0]
+        # whether the buffer was allocated by this index alone, so 'replace' may write into it
+        self._private = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def embeddings(self) -> Tensor:
+        """
+        View of the stored (N, d) embedding rows.
+        """
+        if self._buffer is None:
+            return torch.empty(0, self.dim or 0)
+        return self._buffer[:self._size]
+
+    def _append(self, embeddings: Tensor) -> Tensor:
+        """
+        Appends rows to the embedding buffer, growing its capacity geometrically so
+        that repeated small inserts stay amortized O(rows added).
+
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: ids assigned to the new rows
+        :rtype: Tensor
+        """
+        embeddings = embeddings.detach().to(torch.float32)
+        n, dim = embeddings.shape
+        if self.dim is None:
+            self.dim = dim
+        if dim != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {dim}")
+
+        if self._buffer is None and embeddings.is_contiguous():
+            # adopt the rows without copying, e.g. a memory-mapped matrix. Later inserts
+            # never write into it: the buffer is full, so they reallocate first
+            self._buffer = embeddings
+            self._size = n
+            self._written = [n]
+            self._private = False
+            return torch.arange(n)
+
+        # a clone sharing the buffer has already written past our rows: reallocate rather than overwrite them
+        if self._buffer is None or self._size + n > self._buffer.shape[0] or self._written[0] != self._size:
+            capacity = max(self._size + n, 2 * (0 if self._buffer is None else self._buffer.shape[0]), 64)
+            buffer = torch.empty(capacity, dim)
+            if self._buffer is not None:
+                buffer[:self._size] = self._buffer[:self._size]
+            self._buffer = buffer
+            self._written = [self._size]
+            self._private = True
+
+        self._buffer[self._size:self._size + n] = embeddings
+        ids = torch.arange(self._size, self._size + n)
+        self._size += n
+        self._written[0] = self._size
+        return ids
+
+    def build(self, embeddings: Tensor) -> None:
+        """
+        (Re)builds the index from scratch for the given embeddings.
+
+        :param embeddings: (N, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        self._reset()
+        self.add(embeddings)
+
+    def clone(self) -> 'FlatIndex':
+        """
+        Copy of the index that rows can be added to or replaced in without affecting
+        readers of the original, in O(1): the embedding buffer is shared. Inserts only
+        write past the original's rows, and 'replace' copies the buffer first.
+
+        :return: copy of the index
+        :rtype: FlatIndex
+        """
+        self._private = False
+        return copy.copy(self)
+
+    def rebuild(self, embeddings: Tensor) -> 'FlatIndex':
+        """
+        New index of the same type and parameters built over the given embeddings.
+        The original index is left untouched.
+
+        :param embeddings: (N, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: new index
+        :rtype: FlatIndex
+        """
+        index = copy.copy(self)
+        index.build(embeddings)
+        return index
+
+    def add(self, embeddings: Tensor) -> Tensor:
+        """
+        Inserts new rows into the index. Ids are assigned sequentially.
+
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: ids assigned to the new rows
+        :rtype: Tensor
+        """
+        return self._append(embeddings)
+
+    def replace(self, ids: Tensor, embeddings: Tensor) -> None:
+        """
+        Overwrites the embeddings of existing rows. Meant for a 'clone': the buffer it
+        shares with the original is copied before being written, once per clone. That
+        copy is O(N*d), a single memcpy; further replaces on the same clone write in place.
+
+        :param ids: row ids
+        :type ids: Tensor
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        if not self._private:
+            self._buffer = self._buffer[:self._size].clone()
+            self._written = [self._size]
+            self._private = True
+        self._buffer[torch.as_tensor(ids, dtype=torch.long)] = embeddings.detach().to(torch.float32)
+
+    def rows(self, ids: Tensor) -> Tensor:
+        """
+        Stored embeddings of the given rows.
+
+        :param ids: row ids
+        :type ids: Tensor
+
+        :return: (n, d) embeddings
+        :rtype: Tensor
+        """
+        return self.embeddings[torch.as_tensor(ids, dtype=torch.long)]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of the stored embedding rows.
+        """
+        embeddings = self.embeddings
+        return embeddings.element_size() * embeddings.numel()
+
+    def search(self, queries: Tensor, k: int = 1) -> Tuple[Tensor, Tensor]:
+        """
+        Batched top-k retrieval by inner product (cosine similarity for normalized inputs).
+
+        :param queries: (B, d) normalized query embeddings
+        :type queries: Tensor
+        :param k: Number of neighbours to return per query
+        :type k: int
+
+        :return: (B, k) scores and (B, k) ids. Missing results are padded with -inf / -1.
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        k_eff = min(k, self._size)
+        scores = torch.full((queries.shape[0], k), -math.inf)
+        ids = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+        if k_eff == 0:
+            return scores, ids
+
+        top = torch.mm(queries.to(torch.float32), self.embeddings.t()).topk(k_eff, dim=1)
+        scores[:, :k_eff] = top.values
+        ids[:, :k_eff] = top.indices
+        return scores, ids
+
+
+class IVFIndex(FlatIndex):
+    def __init__(self, dim: int = None, n_lists: int = None, n_probe: int = 8, n_iter: int = 10, seed: int = 0):
+        """
+        Inverted file index. Rows are clustered with spherical k-means and each query
+        only scans the rows of its 'n_probe' closest clusters, i.e. roughly
+        N * n_probe / n_lists comparisons instead of N.
+
+        :param dim: Embedding dimension, inferred from the first 'add' if omitted
+        :type dim: int
+        :param n_lists: Number of clusters. Defaults to ~sqrt(N) at build time
+        :type n_lists: int
+        :param n_probe: Number of clusters scanned per query
+        :type n_probe: int
+        :param n_iter: k-means iterations used when training the centroids
+        :type n_iter: int
+        :param seed: Random seed for centroid initialization
+        :type seed: int
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+        super().__init__(dim=dim)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self.centroids = None
+        self._trained_size = 0
+        self._lists = []
+        self._list_tensors = {}
+        self._owned = set()  # clusters whose list is not shared with the index this was cloned from
+
+    def train(self, embeddings: Tensor) -> None:
+        """
+        Fits the cluster centroids with spherical k-means.
+
+        :param embeddings: (N, d) normalized training embeddings
+        :type embeddings: Tensor
+        """
+        n = embeddings.shape[0]
+        n_lists = self.n_lists or max(1, int(math.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+
+        generator = torch.Generator().manual_seed(self.seed)
+        centroids = embeddings[torch.randperm(n, generator=generator)[:n_lists]].clone()
+        for _ in range(self.n_iter):
+            assign = torch.mm(embeddings, centroids.t()).argmax(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assign, embeddings)
+            counts = torch.bincount(assign, minlength=n_lists)
+            # keep the previous centroid for clusters that lost all their members
+            empty = counts == 0
+            sums[empty] = centroids[empty]
+            centroids = torch.nn.functional.normalize(sums, p=2, dim=1)
+
+        self.centroids = centroids
+        self._trained_size = n
+        self._lists = [[] for _ in range(n_lists)]
+        self._list_tensors = {}
+        self._owned = set(range(n_lists))
+
+    def rebuild(self, embeddings: Tensor) -> 'IVFIndex':
+        """
+        New index built over the given embeddings. The trained centroids are reused
+        unless the corpus has more than doubled since training, in which case they
+        are re-trained. The original index is left untouched.
+
+        :param embeddings: (N, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: new index
+        :rtype: IVFIndex
+        """
+        index = copy.copy(self)
+        index._reset()
+        if self.centroids is not None and embeddings.shape[0] <= 2 * self._trained_size:
+            index.centroids = self.centroids
+            index._trained_size = self._trained_size
+            index._lists = [[] for _ in range(self.centroids.shape[0])]
+            index._owned = set(range(self.centroids.shape[0]))
+        index.add(embeddings)
+        return index
+
+    def clone(self) -> 'IVFIndex':
+        """
+        Copy of the index that rows can be added to or replaced in without affecting
+        readers of the original. The cluster lists are shared until a change touches them.
+
+        :return: copy of the index
+        :rtype: IVFIndex
+        """
+        index = super().clone()
+        index._lists = list(self._lists)
+        index._list_tensors = dict(self._list_tensors)
+        index._owned = set()
+        return index
+
+    def _own(self, cluster: int) -> List[int]:
+        """
+        List of a cluster's rows, ready to be changed: copied first if it is shared.
+        """
+        if cluster not in self._owned:
+            self._lists[cluster] = list(self._lists[cluster])
+            self._owned.add(cluster)
+        self._list_tensors.pop(cluster, None)
+        return self._lists[cluster]
+
+    def add(self, embeddings: Tensor) -> Tensor:
+        """
+        Inserts new rows, assigning each one to its closest existing centroid.
+        Centroids are trained on the first non-empty insert.
+
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: ids assigned to the new rows
+        :rtype: Tensor
+        """
+        ids = self._append(embeddings)
+        if len(ids) == 0:
+            return ids
+        if self.centroids is None:
+            self.train(self.embeddings)
+            ids = torch.arange(self._size)
+
+        assign = torch.mm(self._buffer[ids], self.centroids.t()).argmax(dim=1)
+        for row, cluster in zip(ids.tolist(), assign.tolist()):
+            self._own(cluster).append(row)
+        return ids[-len(embeddings):]
+
+    def replace(self, ids: Tensor, embeddings: Tensor) -> None:
+        """
+        Overwrites the embeddings of existing rows and moves them to their new closest
+        cluster. Meant for a 'clone', see 'FlatIndex.replace'.
+
+        :param ids: row ids
+        :type ids: Tensor
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        ids = torch.as_tensor(ids, dtype=torch.long)
+        before = torch.mm(self._buffer[ids], self.centroids.t()).argmax(dim=1).tolist()
+        super().replace(ids, embeddings)
+        after = torch.mm(self._buffer[ids], self.centroids.t()).argmax(dim=1).tolist()
+        for row, old, new in zip(ids.tolist(), before, after):
+            if row not in self._lists[old]:
+                old = next(c for c, rows in enumerate(self._lists) if row in rows)
+            if old != new:
+                self._own(old).remove(row)
+                self._own(new).append(row)
+
+    def _list_ids(self, cluster: int) -> Tensor:
+        if cluster not in self._list_tensors:
+            self._list_tensors[cluster] = torch.tensor(self._lists[cluster], dtype=torch.long)
+        return self._list_tensors[cluster]
+
+    def search(self, queries: Tensor, k: int = 1) -> Tuple[Tensor, Tensor]:
+        """
+        Batched approximate top-k retrieval. Only the rows of the 'n_probe' closest
+        clusters are scored for each query.
+
+        :param queries: (B, d) normalized query embeddings
+        :type queries: Tensor
+        :param k: Number of neighbours to return per query
+        :type k: int
+
+        :return: (B, k) scores and (B, k) ids. Missing results are padded with -inf / -1.
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        queries = queries.to(torch.float32)
+        scores = torch.full((queries.shape[0], k), -math.inf)
+        ids = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+        if self._size == 0:
+            return scores, ids
+
+        n_probe = min(self.n_probe, self.centroids.shape[0])
+        probes = torch.mm(queries, self.centroids.t()).topk(n_probe, dim=1).indices
+        for i in range(queries.shape[0]):
+            candidates = torch.cat([self._list_ids(c) for c in probes[i].tolist()])
+            if len(candidates) == 0:
+                continue
+            k_eff = min(k, len(candidates))
+            top = torch.mv(self._buffer[candidates], queries[i]).topk(k_eff)
+            scores[i, :k_eff] = top.values
+            ids[i, :k_eff] = candidates[top.indices]
+        return scores, ids
+
+
+class HNSWIndex(FlatIndex):
+    def __init__(self, dim: int = None, m: int = 16, ef_construction: int = 100, ef_search: int = 64,
+                 seed: int = 0):
+        """
+        Hierarchical navigable small world graph index. Each row is linked to its 'm'
+        closest neighbours on a stack of increasingly sparse layers, and queries walk
+        the graph greedily from the top layer down, visiting O(log N) rows on average.
+
+        :param dim: Embedding dimension, inferred from the first 'add' if omitted
+        :type dim: int
+        :param m: Number of links per row on the upper layers (2*m on layer 0)
+        :type m: int
+        :param ef_construction: Candidate list size used while inserting
+        :type ef_construction: int
+        :param ef_search: Candidate list size used while searching (raised to k if smaller)
+        :type ef_search: int
+        :param seed: Random seed for level assignment
+        :type seed: int
+        """
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self._level_mult = 1 / math.log(max(m, 2))
+        super().__init__(dim=dim)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._random = random.Random(self.seed)
+        self._graph = []  # per layer: {row: [neighbour rows]}
+        self._entry = None
+
+    def _scores(self, query: Tensor, rows: List[int]) -> List[float]:
+        return torch.mv(self._buffer[rows], query).tolist()
+
+    def _search_layer(self, query: Tensor, entries: List[int], ef: int, layer: int) -> List[Tuple[float, int]]:
+        """
+        Best-first search of a single layer.
+
+        :return: up to 'ef' (score, row) pairs, best first
+        :rtype: List[Tuple[float, int]]
+        """
+        visited = set(entries)
+        entry_scores = self._scores(query, entries)
+        candidates = [(-s, r) for s, r in zip(entry_scores, entries)]  # max-heap on score
+        heapq.heapify(candidates)
+        results = [(s, r) for s, r in zip(entry_scores, entries)]  # min-heap on score
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        graph = self._graph[layer]
+        while candidates:
+            neg_score, row = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbours = [n for n in graph[row] if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for score, n in zip(self._scores(query, neighbours), neighbours):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, n))
+                    heapq.heappush(results, (score, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _prune(self, row: int, layer: int) -> None:
+        max_links = 2 * self.m if layer == 0 else self.m
+        links = self._graph[layer][row]
+        if len(links) <= max_links:
+            return
+        scores = self._scores(self._buffer[row], links)
+        keep = sorted(zip(scores, links), reverse=True)[:max_links]
+        self._graph[layer][row] = [n for _, n in keep]
+
+    def _link(self, row: int, level: int) -> int:
+        """
+        Links 'row' to its closest rows on layers 'level' to 0, and them back to it.
+
+        :return: top layer of the entry point
+        :rtype: int
+        """
+        query = self._buffer[row]
+        entry_level = max(l for l in range(len(self._graph)) if self._entry in self._graph[l])
+        entries = [self._entry]
+        for layer in range(entry_level, level, -1):
+            entries = [self._search_layer(query, entries, 1, layer)[0][1]]
+
+        for layer in range(min(level, entry_level), -1, -1):
+            found = [(s, n) for s, n in self._search_layer(query, entries, self.ef_construction, layer) if n != row]
+            neighbours = [n for _, n in found[:self.m]]
+            self._graph[layer][row] = neighbours
+            for n in neighbours:
+                if row not in self._graph[layer][n]:
+                    # a new list rather than an append: clones share the lists of the rows they did not change
+                    self._graph[layer][n] = self._graph[layer][n] + [row]
+                    self._prune(n, layer)
+            entries = [n for _, n in found] or entries
+        return entry_level
+
+    def _insert(self, row: int) -> None:
+        level = int(-math.log(1.0 - self._random.random()) * self._level_mult)
+        while len(self._graph) <= level:
+            self._graph.append({})
+        for layer in range(level + 1):
+            self._graph[layer][row] = []
+
+        if self._entry is None:
+            self._entry = row
+            return
+
+        if level > self._link(row, level):
+            self._entry = row
+
+    def clone(self) -> 'HNSWIndex':
+        """
+        Copy of the index that rows can be added to or replaced in without affecting
+        readers of the original. The layers are copied shallowly: the neighbour lists of
+        rows a change does not touch are shared, never modified in place.
+
+        :return: copy of the index
+        :rtype: HNSWIndex
+        """
+        index = super().clone()
+        index._graph = [dict(layer) for layer in self._graph]
+        index._random = random.Random()
+        index._random.setstate(self._random.getstate())
+        return index
+
+    def add(self, embeddings: Tensor) -> Tensor:
+        """
+        Inserts new rows into the graph one at a time.
+
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: ids assigned to the new rows
+        :rtype: Tensor
+        """
+        ids = self._append(embeddings)
+        for row in ids.tolist():
+            self._insert(row)
+        return ids
+
+    def replace(self, ids: Tensor, embeddings: Tensor) -> None:
+        """
+        Overwrites the embeddings of existing rows and re-links them on their layers.
+        Links other rows hold to them are kept. Meant for a 'clone', see 'FlatIndex.replace'.
+
+        :param ids: row ids
+        :type ids: Tensor
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        super().replace(ids, embeddings)
+        for row in torch.as_tensor(ids, dtype=torch.long).tolist():
+            self._link(row, max(l for l in range(len(self._graph)) if row in self._graph[l]))
+
+    def search(self, queries: Tensor, k: int = 1) -> Tuple[Tensor, Tensor]:
+        """
+        Batched approximate top-k retrieval by greedy graph traversal.
+
+        :param queries: (B, d) normalized query embeddings
+        :type queries: Tensor
+        :param k: Number of neighbours to return per query
+        :type k: int
+
+        :return: (B, k) scores and (B, k) ids. Missing results are padded with -inf / -1.
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        queries = queries.to(torch.float32)
+        scores = torch.full((queries.shape[0], k), -math.inf)
+        ids = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+        if self._entry is None:
+            return scores, ids
+
+        top_layer = len(self._graph) - 1
+        for i in range(queries.shape[0]):
+            entries = [self._entry]
+            for layer in range(top_layer, 0, -1):
+                if self._entry in self._graph[layer]:
+                    entries = [self._search_layer(queries[i], entries, 1, layer)[0][1]]
+            found = self._search_layer(queries[i], entries, max(self.ef_search, k), 0)[:k]
+            scores[i, :len(found)] = torch.tensor([s for s, _ in found])
+            ids[i, :len(found)] = torch.tensor([r for _, r in found], dtype=torch.long)
+        return scores, ids
+
+
+# shard searches of every sharded index run on one thread pool per process, created on first use
+# (a pool inherited through fork has no threads left)
+_shard_pool = None
+_shard_pool_pid = None
+_shard_pool_lock = threading.Lock()
+
+
+def shard_pool() -> ThreadPoolExecutor:
+    """
+    Thread pool searching and building the shards of 'ShardedIndex', one thread per CPU.
+    """
+    global _shard_pool, _shard_pool_pid
+    with _shard_pool_lock:
+        if _shard_pool is None or _shard_pool_pid != os.getpid():
+            _shard_pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="shard")
+            _shard_pool_pid = os.getpid()
+        return _shard_pool
+
+
+class ShardedIndex:
+    def __init__(self, dim: int = None, n_shards: int = None, shard: str = 'flat', shard_params: Dict = None,
+                 min_shard_rows: int = 4096):
+        """
+        Index partitioned into independent shards of contiguous rows, each an index of type
+        'shard'. Queries are searched on every shard in parallel (torch releases the GIL in
+        the matrix products) and the per-shard top-k are merged into the global top-k, so
+        results are the same as a single index of that type over all the rows.
+
+        No single (N, d) matrix is ever allocated: each shard holds its own rows, and a
+        memory-mapped context is split into views of the mapping without copying it.
+
+        Shards run concurrently, so keep the torch intra-op threads low (e.g. one per
+        shard, see 'serve.py --threads-per-worker') to avoid oversubscribing the CPUs.
+
+        :param dim: Embedding dimension, inferred from the first 'add' if omitted
+        :type dim: int
+        :param n_shards: Number of shards the rows are split into at build time. Defaults
+            to the CPU count
+        :type n_shards: int
+        :param shard: Index type of every shard, see 'get_index'
+        :type shard: str
+        :param shard_params: Keyword arguments forwarded to every shard's constructor
+        :type shard_params: Dict
+        :param min_shard_rows: Smallest shard built, so small contexts are not split into
+            shards too small to be worth a thread
+        :type min_shard_rows: int
+        """
+        if shard == 'sharded':
+            raise ValueError("Shards cannot be sharded indexes themselves")
+        self.dim = dim
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.shard = shard
+        self.shard_params = shard_params or {}
+        self.min_shard_rows = min_shard_rows
+        self._reset()
+
+    def _reset(self) -> None:
+        self._shards = []
+        self._offsets = []  # first row id of every shard
+        self._owned = set()  # shards cloned for this index, which it may change in place
+        self._size = 0
+        self.shard_rows = None  # rows per shard, fixed by the first insert
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def shards(self) -> List[FlatIndex]:
+        return list(self._shards)
+
+    @property
+    def embeddings(self) -> Tensor:
+        """
+        The stored (N, d) embedding rows. With more than one shard this concatenates them
+        into a new matrix; prefer 'rows' and 'search'.
+        """
+        if not self._shards:
+            return torch.empty(0, self.dim or 0)
+        if len(self._shards) == 1:
+            return self._shards[0].embeddings
+        return torch.cat([shard.embeddings for shard in self._shards])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shard.nbytes for shard in self._shards)
+
+    def _new_shard(self) -> FlatIndex:
+        return get_index(self.shard, dim=self.dim, **self.shard_params)
+
+    def build(self, embeddings: Tensor) -> None:
+        """
+        (Re)builds the index from scratch, splitting the rows into 'n_shards' shards.
+
+        :param embeddings: (N, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        self._reset()
+        self.add(embeddings)
+
+    def clone(self) -> 'ShardedIndex':
+        """
+        Copy of the index that rows can be added to without affecting readers of the original.
+        Inserts only ever change the last shard, so the other shards are shared, not copied.
+
+        :return: copy of the index
+        :rtype: ShardedIndex
+        """
+        index = copy.copy(self)
+        index._shards = self._shards[:-1] + [shard.clone() for shard in self._shards[-1:]]
+        index._offsets = list(self._offsets)
+        index._owned = {len(self._shards) - 1} if self._shards else set()
+        return index
+
+    def replace(self, ids: Tensor, embeddings: Tensor) -> None:
+        """
+        Overwrites the embeddings of existing rows. Only the shards holding them are
+        copied, once per clone. Meant for a 'clone', see 'FlatIndex.replace'.
+
+        :param ids: row ids
+        :type ids: Tensor
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+        """
+        ids = torch.as_tensor(ids, dtype=torch.long)
+        if len(ids) == 0:
+            return
+        shard_of = torch.searchsorted(torch.tensor(self._offsets), ids, right=True) - 1
+        for s in shard_of.unique().tolist():
+            mask = shard_of == s
+            if s not in self._owned:
+                self._shards[s] = self._shards[s].clone()
+                self._owned.add(s)
+            self._shards[s].replace(ids[mask] - self._offsets[s], embeddings[mask])
+
+    def rebuild(self, embeddings: Tensor) -> 'ShardedIndex':
+        """
+        New index with the same parameters built over the given embeddings. The original
+        index is left untouched.
+
+        :param embeddings: (N, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: new index
+        :rtype: ShardedIndex
+        """
+        index = copy.copy(self)
+        index.build(embeddings)
+        return index
+
+    def add(self, embeddings: Tensor) -> Tensor:
+        """
+        Inserts new rows. The last shard is filled up to 'shard_rows' rows, and the
+        remaining rows go to new shards, built in parallel.
+
+        :param embeddings: (n, d) normalized embeddings
+        :type embeddings: Tensor
+
+        :return: ids assigned to the new rows
+        :rtype: Tensor
+        """
+        n, dim = embeddings.shape
+        if self.dim is None:
+            self.dim = dim
+        if dim != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {dim}")
+        ids = torch.arange(self._size, self._size + n)
+        if n == 0:
+            return ids
+        if self.shard_rows is None:
+            self.shard_rows = max(self.min_shard_rows, math.ceil(n / self.n_shards))
+
+        start = 0
+        if self._shards and len(self._shards[-1]) < self.shard_rows:
+            start = min(n, self.shard_rows - len(self._shards[-1]))
+            self._shards[-1].add(embeddings[:start])
+
+        # slices of a contiguous matrix are contiguous views, which the shards adopt without copying
+        pieces = [embeddings[i:i + self.shard_rows] for i in range(start, n, self.shard_rows)]
+        shards = [self._new_shard() for _ in pieces]
+        if len(pieces) > 1:
+            list(shard_pool().map(lambda pair: pair[0].build(pair[1]), zip(shards, pieces)))
+        else:
+            for shard, piece in zip(shards, pieces):
+                shard.build(piece)
+        for shard in shards:
+            self._offsets.append(self._offsets[-1] + len(self._shards[-1]) if self._shards else 0)
+            self._owned.add(len(self._shards))
+            self._shards.append(shard)
+        self._size += n
+        return ids
+
+    def rows(self, ids: Tensor) -> Tensor:
+        """
+        Stored embeddings of the given rows, gathered from their shards.
+
+        :param ids: row ids
+        :type ids: Tensor
+
+        :return: (n, d) embeddings
+        :rtype: Tensor
+        """
+        ids = torch.as_tensor(ids, dtype=torch.long)
+        out = torch.empty(len(ids), self.dim or 0)
+        if len(ids) == 0:
+            return out
+        shard_of = torch.searchsorted(torch.tensor(self._offsets), ids, right=True) - 1
+        for s in shard_of.unique().tolist():
+            mask = shard_of == s
+            out[mask] = self._shards[s].rows(ids[mask] - self._offsets[s])
+        return out
+
+    def search(self, queries: Tensor, k: int = 1) -> Tuple[Tensor, Tensor]:
+        """
+        Batched top-k retrieval: every shard returns its own top-k and the best k of
+        them are kept.
+
+        :param queries: (B, d) normalized query embeddings
+        :type queries: Tensor
+        :param k: Number of neighbours to return per query
+        :type k: int
+
+        :return: (B, k) scores and (B, k) ids. Missing results are padded with -inf / -1.
+        :rtype: Tuple[Tensor, Tensor]
+        """
+        queries = queries.to(torch.float32)
+        if not self._shards:
+            return (torch.full((queries.shape[0], k), -math.inf),
+                    torch.full((queries.shape[0], k), -1, dtype=torch.long))
+        if len(self._shards) == 1:
+            return self._shards[0].search(queries, k=k)
+
+        results = list(shard_pool().map(lambda shard: shard.search(queries, k=k), self._shards))
+        scores = torch.cat([s for s, _ in results], dim=1)
+        ids = torch.cat([torch.where(i >= 0, i + offset, i) for (_, i), offset in zip(results, self._offsets)], dim=1)
+        # every shard pads its results to k, so there are always at least k columns
+        top = scores.topk(k, dim=1)
+        return top.values, ids.gather(1, top.indices)
+
+
+INDEXES = {
+    'flat': FlatIndex,
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+    'sharded': ShardedIndex,
+}
+
+
+def get_index(name: str = 'flat', **params) -> FlatIndex:
+    """
+    Instantiates an index by name.
+
+    :param name: One of 'flat', 'ivf', 'hnsw' or 'sharded'
+    :type name: str
+    :param params: Keyword arguments forwarded to the index constructor
+    :type params: Dict
+
+    :return: An empty index
+    :rtype: FlatIndex
+    """
+    if name not in INDEXES:
+        raise ValueError(f"Unknown index '{name}', expected one of {sorted(INDEXES)}")
+    return INDEXES[name](**params)
+
+
+def recall_at_k(index: FlatIndex, queries: Tensor, k: int = 10) -> float:
+    """
+    Fraction of the exact top-k neighbours (by brute force over the same rows)
+    that the given index also returns in its top-k.
+
+    :param index: Index to evaluate
+    :type index: FlatIndex
+    :param queries: (B, d) normalized query embeddings
+    :type queries: Tensor
+    :param k: Number of neighbours compared per query
+    :type k: int
+
+    :return: recall in [0, 1]
+    :rtype: float
+    """
+    k = min(k, len(index))
+    if k == 0 or queries.shape[0] == 0:
+        return 1.0
+    exact = torch.mm(queries.to(torch.float32), index.embeddings.t()).topk(k, dim=1).indices
+    _, approx = index.search(queries, k=k)
+
+    hits = 0
+    for truth, found in zip(exact.tolist(), approx.tolist()):
+        hits += len(set(truth) & set(found))
+    return hits / (k * queries.shape[0])
@@ -0,0 +1,382 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import torch
+
+# Soft type assertions
+from typing import Dict, Iterable, Iterator, List, Tuple
+from store import embedder_fingerprint, model_path, write_snapshot
+
+DATA_KEY = re.compile(r'"data"\s*:\s*\[')
+# next to every chunk file, the fingerprint of the model that embedded it
+FINGERPRINT_SUFFIX = ".fingerprint"
+
+
+def iter_articles(path: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    Streams the articles of a SQuAD-format file ('{"version": ..., "data": [article, ...]}')
+    one at a time. Only the current article and one read chunk are held in memory.
+
+    :param path: SQuAD json file
+    :type path: str
+    :param chunk_size: number of characters read at a time
+    :type chunk_size: int
+
+    :return: (byte offset, byte length, article) for every article, in file order
+    :rtype: Iterator[Tuple[int, int, Dict]]
+    """
+    decoder = json.JSONDecoder()
+    # no newline translation, so the characters consumed re-encode to exactly the bytes read
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        buffer, offset, eof = "", 0, False
+
+        def fill() -> bool:
+            nonlocal buffer, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            return not eof
+
+        def consume(n: int) -> None:
+            nonlocal buffer, offset
+            offset += len(buffer[:n].encode('utf-8'))
+            buffer = buffer[n:]
+
+        # skip everything up to the opening bracket of the "data" array
+        while True:
+            match = DATA_KEY.search(buffer)
+            if match:
+                consume(match.end())
+                break
+            if not fill():
+                raise ValueError(f"No 'data' array found in {path}")
+            if len(buffer) > 2 * chunk_size:
+                # keep a tail in case the key straddles two chunks
+                consume(len(buffer) - 64)
+
+        while True:
+            stripped = buffer.lstrip(" \t\r\n,")
+            consume(len(buffer) - len(stripped))
+            if not buffer:
+                if not fill():
+                    raise ValueError(f"Unterminated 'data' array in {path}")
+                continue
+            if buffer[0] == ']':
+                return
+
+            try:
+                article, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # the article is not complete yet
+                if not fill():
+                    raise
+                continue
+
+            length = len(buffer[:end].encode('utf-8'))
+            yield offset, length, article
+            consume(end)
+
+
+def iter_article_qa(article: Dict) -> Iterator[Tuple[str, str, str]]:
+    """
+    The answerable questions of an article, with the first answer of each.
+
+    :param article: SQuAD article
+    :type article: Dict
+
+    :return: (question id, question, answer) tuples
+    :rtype: Iterator[Tuple[str, str, str]]
+    """
+    for paragraph in article['paragraphs']:
+        for qa in paragraph['qas']:
+            if not qa.get('is_impossible', False) and qa['answers']:
+                yield qa['id'], qa['question'], qa['answers'][0]['text']
+
+
+class SquadIndex:
+    def __init__(self, path: str):
+        """
+        Topic index over a SQuAD-format file, built in one streaming pass.
+
+        Only each article's title, byte offset and length are kept, so a topic lookup
+        seeks straight to its article and decodes nothing else.
+
+        :param path: SQuAD json file
+        :type path: str
+        """
+        self.path = path
+        self.topics = {}  # title -> (offset, length, number of answerable questions)
+        for offset, length, article in iter_articles(path):
+            n_questions = sum(1 for _ in iter_article_qa(article))
+            self.topics[article['title']] = (offset, length, n_questions)
+
+    def titles(self) -> List[str]:
+        return list(self.topics)
+
+    def article(self, topic: str) -> Dict:
+        """
+        Reads a single article from disk.
+
+        :param topic: article title
+        :type topic: str
+
+        :return: the article
+        :rtype: Dict
+        """
+        offset, length, _ = self.topics[topic]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length).decode('utf-8'))
+
+    def get_qa(self, topic: str) -> Tuple[List[str], List[str]]:
+        """
+        Gets the available questions and answers for a given topic.
+        Drop-in replacement of 'QAEmbedder.get_qa' that does not need the whole file in memory.
+
+        :param topic: specific topic of focus
+        :type topic: str
+
+        :return: list of questions and corresponding answers
+        :rtype: Tuple[List[str], List[str]]
+        """
+        qa = list(iter_article_qa(self.article(topic)))
+        return [q for _, q, _ in qa], [a for _, _, a in qa]
+
+    def iter_qa(self, topics: List[str] = None) -> Iterator[Tuple[str, str, str]]:
+        """
+        Streams (question id, question, answer) for the given topics, or the whole file.
+
+        :param topics: topics to include, all if None
+        :type topics: List[str]
+
+        :rtype: Iterator[Tuple[str, str, str]]
+        """
+        if topics is not None:
+            for topic in topics:
+                yield from iter_article_qa(self.article(topic))
+            return
+        for _, _, article in iter_articles(self.path):
+            yield from iter_article_qa(article)
+
+
+# per-process embedder of the embedding pool
+_worker_embedder = None
+
+
+def _init_worker(model_name: str, backend: str, threads: int) -> None:
+    global _worker_embedder
+    from classes import QAEmbedder
+
+    torch.set_num_threads(threads)
+    _worker_embedder = QAEmbedder(model_name=model_name, backend=backend)
+
+
+def _embed_texts(questions: List[str], batch: int, max_length: int = None) -> torch.Tensor:
+    return _worker_embedder.get_embeddings(questions, batch=batch, sort_by_length=True, max_length=max_length)
+
+
+def _embed_chunk(path: str, fingerprint: str, ids: List[str], questions: List[str], answers: List[str],
+                 batch: int) -> str:
+    embeddings = torch.nn.functional.normalize(_embed_texts(questions, batch), p=2, dim=1)
+    tmp = path + ".tmp"
+    torch.save({'fingerprint': fingerprint, 'ids': ids, 'questions': questions, 'answers': answers,
+                'embeddings': embeddings}, tmp)
+    os.replace(tmp, path)
+    # written last, so a sidecar matching the model always means the chunk is complete
+    with open(tmp, 'w') as f:
+        f.write(fingerprint)
+    os.replace(tmp, path + FINGERPRINT_SUFFIX)
+    return path
+
+
+class EmbeddingPool:
+    def __init__(self,
+                 model_name: str = "paraphrase-MiniLM-L6-v2",
+                 backend: str = "eager",
+                 workers: int = None,
+                 threads_per_worker: int = 1):
+        """
+        Pool of processes, each with its own copy of the model and 'threads_per_worker'
+        torch threads. Processes are spawned, so they do not inherit a parent's torch thread
+        pools, and each loads the model once when it starts.
+
+        :param model_name: model name/directory
+        :type model_name: str
+        :param backend: inference backend, see 'QAEmbedder'
+        :type backend: str
+        :param workers: number of processes, defaults to CPU count / threads_per_worker
+        :type workers: int
+        :param threads_per_worker: torch intra-op threads per process
+        :type threads_per_worker: int
+        """
+        self.workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(model_name, backend, threads_per_worker))
+
+    def embed(self, questions: List[str], batch: int = 32, max_length: int = None) -> torch.Tensor:
+        """
+        Embeds the questions in parallel: they are cut into a few chunks per process, and
+        each chunk is length-bucketed by the process embedding it.
+
+        :param questions: questions to embed
+        :type questions: List[str]
+        :param batch: embedding batch size
+        :type batch: int
+        :param max_length: truncate questions to at most this many tokens
+        :type max_length: int
+
+        :return: (N, d) embeddings, not normalized, in input order
+        :rtype: torch.Tensor
+        """
+        chunk_size = max(batch, math.ceil(len(questions) / (4 * self.workers)))
+        futures = [self.executor.submit(_embed_texts, questions[i:i + chunk_size], batch, max_length)
+                   for i in range(0, len(questions), chunk_size)]
+        return torch.cat([future.result() for future in futures])
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self) -> 'EmbeddingPool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _chunk_done(path: str, fingerprint: str) -> bool:
+    # reads the sidecar rather than loading the whole chunk
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path + FINGERPRINT_SUFFIX) as f:
+            return f.read() == fingerprint
+    except OSError:
+        return False
+
+
+def embed_corpus(records: Iterable[Tuple[str, str, str]],
+                 checkpoint_dir: str,
+                 model_name: str = "paraphrase-MiniLM-L6-v2",
+                 backend: str = "eager",
+                 workers: int = None,
+                 threads_per_worker: int = 1,
+                 chunk_size: int = 4096,
+                 batch: int = 64) -> List[str]:
+    """
+    Embeds a stream of (id, question, answer) records with a pool of processes, each with
+    its own copy of the model and 'threads_per_worker' torch threads.
+
+    Records are cut into chunks of 'chunk_size' and each embedded chunk is saved to
+    'checkpoint_dir' as soon as it is done, so an interrupted run resumes where it stopped
+    (chunks from a different model are redone). At most two chunks per worker are in
+    flight, so memory stays bounded however large the input is.
+
+    :param records: (id, question, answer) tuples, e.g. 'SquadIndex.iter_qa()'
+    :type records: Iterable[Tuple[str, str, str]]
+    :param checkpoint_dir: directory for the embedded chunks
+    :type checkpoint_dir: str
+    :param model_name: model name/directory
+    :type model_name: str
+    :param backend: inference backend, see 'QAEmbedder'
+    :type backend: str
+    :param workers: number of processes, defaults to CPU count / threads_per_worker
+    :type workers: int
+    :param threads_per_worker: torch intra-op threads per process
+    :type threads_per_worker: int
+    :param chunk_size: records per checkpoint chunk
+    :type chunk_size: int
+    :param batch: embedding batch size
+    :type batch: int
+
+    :return: chunk files, in record order
+    :rtype: List[str]
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    fingerprint = embedder_fingerprint(model_path(model_name), backend)
+
+    def chunks() -> Iterator[List]:
+        current = []
+        for record in records:
+            current.append(record)
+            if len(current) == chunk_size:
+                yield current
+                current = []
+        if current:
+            yield current
+
+    paths = []
+    with EmbeddingPool(model_name, backend, workers, threads_per_worker) as pool:
+        in_flight = set()
+        for i, chunk in enumerate(chunks()):
+            path = os.path.join(checkpoint_dir, f"chunk-{i:06d}.pt")
+            paths.append(path)
+            if _chunk_done(path, fingerprint):
+                continue
+            ids, questions, answers = (list(column) for column in zip(*chunk))
+            in_flight.add(pool.executor.submit(_embed_chunk, path, fingerprint, ids, questions, answers, batch))
+            if len(in_flight) >= 2 * pool.workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        for future in in_flight:
+            future.result()
+
+    return paths
+
+
+def build_store(chunk_paths: List[str], cache_dir: str, fingerprint: str) -> str:
+    """
+    Assembles embedded chunks into an on-disk context snapshot (see 'store.py') that
+    'QASearcher.load_context' memory-maps. Embeddings are copied one chunk at a time.
+
+    :param chunk_paths: chunk files from 'embed_corpus'
+    :type chunk_paths: List[str]
+    :param cache_dir: context cache directory
+    :type cache_dir: str
+    :param fingerprint: fingerprint of the model that produced the embeddings
+    :type fingerprint: str
+
+    :return: the snapshot directory
+    :rtype: str
+    """
+    records = {'ids': [], 'questions': [], 'answers': []}
+    count, dim = 0, 0
+    for path in chunk_paths:
+        chunk = torch.load(path)
+        for key in records:
+            records[key].extend(chunk[key])
+        count += chunk['embeddings'].shape[0]
+        dim = chunk['embeddings'].shape[1]
+
+    embedding_chunks = (torch.load(path)['embeddings'] for path in chunk_paths)
+    return write_snapshot(cache_dir, records, embedding_chunks, count, dim, fingerprint)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Embed a SQuAD-format file into a QnA context cache")
+    parser.add_argument("squad", help="SQuAD json file, e.g. ../train-v2.0.json")
+    parser.add_argument("cache_dir", help="context cache directory to write (QNA_CONTEXT_CACHE/<namespace>)")
+    parser.add_argument("--checkpoint-dir", default="../embeddings", help="directory for embedded chunks")
+    parser.add_argument("--topic", action="append", help="only embed these topics (repeatable)")
+    parser.add_argument("--model", default="paraphrase-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="eager")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    args = parser.parse_args()
+
+    index = SquadIndex(args.squad)
+    print("Topics: {}, answerable questions: {}".format(
+        len(index.topics), sum(n for _, _, n in index.topics.values())))
+
+    chunk_paths = embed_corpus(index.iter_qa(args.topic), args.checkpoint_dir, model_name=args.model,
+                               backend=args.backend, workers=args.workers,
+                               threads_per_worker=args.threads_per_worker, chunk_size=args.chunk_size)
+    snapshot = build_store(chunk_paths, args.cache_dir, embedder_fingerprint(model_path(args.model), args.backend))
+    print("Context written to {}".format(snapshot))
@@ -0,0 +1,117 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# Soft type assertions
+from typing import List, Optional, Set, Tuple
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased word tokens; punctuation and spacing are ignored.
+
+    :param text: question text
+    :type text: str
+
+    :rtype: List[str]
+    """
+    return TOKEN.findall(text.lower())
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """
+    Overlap of two token sets, 1.0 for the same words in any order.
+    """
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class BM25Index:
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75, max_df: float = 0.5):
+        """
+        Inverted index over the context questions, scored with BM25.
+
+        Terms found in more than 'max_df' of the questions ('what', 'the', ...) are left out
+        of the postings: they barely change the ranking but would make every query visit
+        most of the context.
+
+        :param documents: questions, one per context row
+        :type documents: List[str]
+        :param k1: term frequency saturation
+        :type k1: float
+        :param b: document length normalization
+        :type b: float
+        :param max_df: maximum fraction of documents a scored term may appear in
+        :type max_df: float
+        """
+        self.k1 = k1
+        self.b = b
+        self.terms = [set(tokenize(d)) for d in documents]
+        lengths = []
+        postings = {}
+        for row, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((row, tf))
+
+        n = len(documents)
+        average = sum(lengths) / n if n else 0.0
+        self.postings = {}
+        self.idf = {}
+        for term, rows in postings.items():
+            if len(rows) > max(1, max_df * n):
+                continue
+            self.idf[term] = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            # the length normalization only depends on the row, so it is folded in once here
+            self.postings[term] = [
+                (row, tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[row] / average))) for row, tf in rows
+            ]
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[float, int]]:
+        """
+        Best matching rows for a query.
+
+        :param query: question text
+        :type query: str
+        :param k: number of rows returned
+        :type k: int
+
+        :return: up to 'k' (score, row), best first. Empty if no scored term matches
+        :rtype: List[Tuple[float, int]]
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for row, weight in self.postings[term]:
+                scores[row] = scores.get(row, 0.0) + idf * weight
+        return heapq.nlargest(k, ((score, row) for row, score in scores.items()))
+
+    def best_match(self, query: str, k: int = 10) -> Tuple[float, Optional[int]]:
+        """
+        Row among the top 'k' BM25 results whose words overlap the query's the most.
+
+        :param query: question text
+        :type query: str
+        :param k: BM25 results considered
+        :type k: int
+
+        :return: (jaccard overlap, row), (0.0, None) if no word overlaps
+        :rtype: Tuple[float, Optional[int]]
+        """
+        terms = set(tokenize(query))
+        best = (0.0, None)
+        for _, row in self.search(query, k):
+            overlap = jaccard(terms, self.terms[row])
+            if overlap > best[0]:
+                best = (overlap, row)
+        return best
@@ -1,48 +1,395 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
 import uvicorn
-from classes import QASearcher
-from fastapi import FastAPI, Request
+from batching import MicroBatcher
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from namespaces import NAMESPACE_PATTERN, NamespaceManager
+from profiling import REQUEST_SECONDS, SlowRequestProfiler, render, stage, update_memory_gauges
+from serve import memory_usage, process_uptime
 
-qa_search = QASearcher()
-app = FastAPI()
+# Soft type assertions
+from typing import Dict
 
-@app.post("/set_context")
-async def set_context(data: Request):
+# QNA_INDEX selects the search index: 'flat' (exact), 'ivf' or 'hnsw' (approximate), or 'sharded': QNA_SHARD_INDEX
+# (default 'flat') split into QNA_SHARDS shards (default: CPU count) searched in parallel
+# QNA_BACKEND selects the inference backend: 'eager', 'int8', 'torchscript' or 'onnx'
+# QNA_CONTEXT_CACHE is an optional directory where every namespace's context is persisted. They are
+# loaded (memory-mapped) on first use and re-saved after every context change
+# QNA_MEMORY_BUDGET_MB caps the memory of resident contexts; idle namespaces beyond it are paged out to disk
+CONTEXT_CACHE = os.environ.get("QNA_CONTEXT_CACHE")
+MEMORY_BUDGET = int(float(os.environ["QNA_MEMORY_BUDGET_MB"]) * 2 ** 20) if os.environ.get("QNA_MEMORY_BUDGET_MB") else None
+# QNA_LEXICAL_THRESHOLD is the word overlap above which a question is answered without the model (unset or 'off':
+# never) and QNA_LEXICAL_PREFILTER the number of BM25 candidates the dense search is restricted to (unset: all)
+LEXICAL_THRESHOLD = os.environ.get("QNA_LEXICAL_THRESHOLD", "off")
+INDEX = os.environ.get("QNA_INDEX", "flat")
+INDEX_PARAMS = {
+    'n_shards': int(os.environ["QNA_SHARDS"]) if os.environ.get("QNA_SHARDS") else None,
+    'shard': os.environ.get("QNA_SHARD_INDEX", "flat"),
+} if INDEX == "sharded" else None
+# QNA_EMBED_WORKERS processes, with QNA_EMBED_THREADS torch threads each, embed large context uploads in parallel
+namespaces = NamespaceManager(
+    backend=os.environ.get("QNA_BACKEND", "eager"),
+    memory_budget=MEMORY_BUDGET,
+    cache_dir=CONTEXT_CACHE,
+    index=INDEX,
+    index_params=INDEX_PARAMS,
+    embed_workers=int(os.environ.get("QNA_EMBED_WORKERS", 0)),
+    embed_threads=int(os.environ.get("QNA_EMBED_THREADS", 1)),
+    # set by serve.py with several workers: each has its own copy of the contexts, kept in sync through the cache
+    reload_changed=os.environ.get("QNA_SHARED_CONTEXT") == "1",
+    lexical_threshold=None if LEXICAL_THRESHOLD == "off" else float(LEXICAL_THRESHOLD),
+    lexical_prefilter=int(os.environ["QNA_LEXICAL_PREFILTER"]) if os.environ.get("QNA_LEXICAL_PREFILTER") else None,
+)
+# the unscoped endpoints operate on this namespace
+DEFAULT_NAMESPACE = "default"
+# QNA_MIN_SCORE is the default minimum cosine similarity for /get_answer to report a match
+MIN_SCORE = float(os.environ["QNA_MIN_SCORE"]) if os.environ.get("QNA_MIN_SCORE") else None
+# concurrent /get_answer calls, across namespaces, are embedded together in one forward pass of up to
+# QNA_MAX_BATCH questions, waiting at most QNA_MAX_WAIT_MS for a batch to fill up
+batcher = MicroBatcher(
+    namespaces.embed_queries,
+    max_batch_size=int(os.environ.get("QNA_MAX_BATCH", 32)),
+    max_wait_ms=float(os.environ.get("QNA_MAX_WAIT_MS", 5)),
+)
+# QNA_PROFILE_DIR turns on the sampling profiler: requests slower than QNA_PROFILE_SLOW_MS (default 500) have the
+# stacks sampled while they ran written there, ready for flamegraph.pl or speedscope
+profiler = SlowRequestProfiler(
+    os.environ["QNA_PROFILE_DIR"],
+    threshold_ms=float(os.environ.get("QNA_PROFILE_SLOW_MS", 500)),
+) if os.environ.get("QNA_PROFILE_DIR") else None
+startup = {'ready': False}
+
+
+def warm_up() -> Dict:
+    """
+    Loads the default namespace (from the context cache, if any) and runs one forward pass
+    and search, so no request pays for lazy initialization. Does nothing once done.
+
+    :return: 'ready', and the 'cold_start_seconds' and 'warm_up_seconds' it took
+    :rtype: Dict
+    """
+    if startup['ready']:
+        return startup
+    start = time.perf_counter()
+    with namespaces.use(DEFAULT_NAMESPACE, create=True) as qa_search:
+        # straight through the model, so the caches are not filled with the warm-up question
+        embeddings = namespaces.queries.get_q_embeddings(["Which team won the warm-up match ?"])
+        if len(qa_search.context):
+            qa_search.index.search(embeddings, k=1)
+    startup.update(
+        ready=True,
+        cold_start_seconds=process_uptime(),
+        warm_up_seconds=time.perf_counter() - start,
+    )
+    return startup
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # in the background, so /ready answers (503) meanwhile. Under serve.py the parent
+    # process has warmed up before forking and this returns at once
+    task = asyncio.create_task(run_in_threadpool(warm_up))
+    yield
+    task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def instrument(request: Request, call_next):
+    """
+    Records the latency of every request by endpoint, and profiles it if enabled.
+    """
+    start = time.perf_counter()
+    if profiler is not None:
+        with profiler.profile(f"{request.method} {request.url.path}"):
+            response = await call_next(request)
+    else:
+        response = await call_next(request)
+    # the route template, so '/namespaces/{namespace}/...' is one label value and not one per namespace
+    route = request.scope.get('route')
+    REQUEST_SECONDS.labels(request.method, route.path if route is not None else "unmatched").observe(
+        time.perf_counter() - start)
+    return response
+
+
+def check_namespace(namespace: str, create: bool = False) -> None:
+    """
+    Raises a 400 for invalid namespace names and a 404 for unknown namespaces
+    (unless they are about to be created).
+    """
+    if not NAMESPACE_PATTERN.match(namespace):
+        raise HTTPException(status_code=400, detail=f"Invalid namespace name '{namespace}'")
+    if not create and namespace != DEFAULT_NAMESPACE and namespace not in namespaces.names():
+        raise HTTPException(status_code=404, detail=f"Unknown namespace '{namespace}'")
+
+
+@asynccontextmanager
+async def use_namespace(namespace: str):
+    """
+    'NamespaceManager.use' off the event loop: loading a paged out namespace, or paging
+    out others afterwards, reads and writes the disk.
+    """
+    qa_search = await run_in_threadpool(namespaces.acquire, namespace, True)
+    try:
+        yield qa_search
+    finally:
+        await run_in_threadpool(namespaces.release, namespace)
+
+
+@app.post("/namespaces/{namespace}/set_context")
+async def set_context_ns(namespace: str, data: Request):
     """
-    Fastapi POST method that sets the QA context for search.
+    Fastapi POST method that sets the QA context for search in a namespace,
+    creating the namespace if needed.
+
+    Questions already present in the current context are not re-embedded.
 
     Args:
       data(`dict`): Two fields required 'questions' (`list` of `str`)
-        and 'answers' (`list` of `str`)
+        and 'answers' (`list` of `str`). Optional 'ids' (`list` of `str`)
+        with a stable id per question, defaulting to the list positions.
     """
+    check_namespace(namespace, create=True)
     data = await data.json()
-    qa_search.set_context_qa(
-        data['questions'],
-        data['answers']
+    # applied and saved under the namespace's write lock, see 'NamespaceManager.update'
+    counts = await run_in_threadpool(
+        namespaces.update, namespace,
+        lambda qa_search: qa_search.set_context_qa(data['questions'], data['answers'], data.get('ids')),
+        True,
     )
 
-    return {"message": "Search context set"}
+    return {"message": "Search context set", **counts}
 
 
-@app.post("/get_answer")
-async def get_answer(data: Request):
+@app.post("/namespaces/{namespace}/add_context")
+async def add_context_ns(namespace: str, data: Request):
+    """
+    Fastapi POST method that adds questions to a namespace's QA context, keyed by id.
+    Ids already in the context are updated instead.
+
+    Args:
+      data(`dict`): Three fields required 'ids' (`list` of `str`),
+        'questions' (`list` of `str`) and 'answers' (`list` of `str`)
+    """
+    check_namespace(namespace, create=True)
+    data = await data.json()
+    counts = await run_in_threadpool(
+        namespaces.update, namespace,
+        lambda qa_search: qa_search.upsert_context_qa(data['ids'], data['questions'], data['answers']),
+        True,
+    )
+
+    return {"message": "Search context updated", **counts}
+
+
+@app.post("/namespaces/{namespace}/update_context")
+async def update_context_ns(namespace: str, data: Request):
+    """
+    Fastapi POST method that updates questions/answers in a namespace's QA context by id.
+    Only questions whose text changed are re-embedded. Unknown ids are a 404 and
+    leave the context unchanged; use 'add_context' to insert.
+
+    Args:
+      data(`dict`): Three fields required 'ids' (`list` of `str`),
+        'questions' (`list` of `str`) and 'answers' (`list` of `str`)
+    """
+    check_namespace(namespace)
+    data = await data.json()
+    ids, questions, answers = data['ids'], data['questions'], data['answers']
+    try:
+        counts = await run_in_threadpool(
+            namespaces.update, namespace, lambda qa_search: qa_search.update_context_qa(ids, questions, answers), True,
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail={"message": "Unknown ids", "ids": e.args[0]})
+
+    return {"message": "Search context updated", **counts}
+
+
+@app.post("/namespaces/{namespace}/delete_context")
+async def delete_context_ns(namespace: str, data: Request):
+    """
+    Fastapi POST method that removes questions from a namespace's QA context by id.
+
+    Args:
+      data(`dict`): One field required 'ids' (`list` of `str`)
+    """
+    check_namespace(namespace)
+    data = await data.json()
+    counts = await run_in_threadpool(
+        namespaces.update, namespace, lambda qa_search: qa_search.delete_context_qa(data['ids']), True,
+    )
+
+    return {"message": "Search context updated", **counts}
+
+
+@app.post("/namespaces/{namespace}/get_answer")
+async def get_answer_ns(namespace: str, data: Request):
     """
     Fastapi POST method that gets the best question and answer
-    in the set context.
+    in a namespace's context.
 
     Args:
-      data(`dict`): One field required 'questions' (`list` of `str`)
+      data(`dict`): One field required 'questions' (`list` of `str`).
+        Optional 'top_k' (`int`, at least 1) number of candidates per question and
+        'min_score' (`float` or null) minimum similarity for a match, defaulting
+        to the QNA_MIN_SCORE environment variable.
 
     Returns:
-      A `dict` containing the original question ('orig_q'), the most similar
-      question in the context ('best_q') and the associated answer ('best_a').
+      A `dict` per question containing the original question ('orig_q'), the most similar
+      question in the context ('best_q'), the associated answer ('best_a'), the similarity
+      ('score'), whether it cleared 'min_score' ('matched') and the lookup tier that found it
+      ('tier'). With 'top_k' > 1 the 'candidates' are listed too.
     """
+    check_namespace(namespace)
     data = await data.json()
+    questions = data['questions']
+    top_k = data.get('top_k', 1)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+        raise HTTPException(status_code=400, detail=f"'top_k' must be a positive integer, got {top_k!r}")
+    min_score = data.get('min_score', MIN_SCORE)
+    if min_score is not None and (isinstance(min_score, bool) or not isinstance(min_score, (int, float))):
+        raise HTTPException(status_code=400, detail=f"'min_score' must be a number or null, got {min_score!r}")
 
-    response = qa_search.get_answers(data['questions'], batch=1)
-    return response
+    async with use_namespace(namespace) as qa_search:
+        # repeated questions are answered from the result cache without touching the model
+        response = qa_search.lookup_answers(questions, top_k=top_k, min_score=min_score)
+        missing = [i for i, r in enumerate(response) if r is None]
+        if missing:
+            missing_questions = [questions[i] for i in missing]
+            question_embeddings = await batcher.submit(missing_questions)
+            answers = await run_in_threadpool(qa_search.answers_from_embeddings, missing_questions,
+                                              question_embeddings, top_k, min_score)
+            for i, answer in zip(missing, answers):
+                response[i] = answer
+    with stage('serialize'):
+        body = json.dumps(response)
+    return Response(body, media_type="application/json")
+
+
+@app.get("/namespaces/{namespace}/cache_stats")
+async def cache_stats_ns(namespace: str):
+    """
+    Fastapi GET method with the hit/miss/eviction counters of the query embedding
+    (shared by all namespaces) and answer caches of a namespace, and its questions
+    answered per lookup tier.
+    """
+    check_namespace(namespace)
+    async with use_namespace(namespace) as qa_search:
+        return qa_search.cache_stats()
+
+
+@app.delete("/namespaces/{namespace}")
+async def delete_namespace(namespace: str):
+    """
+    Fastapi DELETE method that removes a namespace from memory and disk.
+    """
+    check_namespace(namespace)
+    try:
+        await run_in_threadpool(namespaces.drop, namespace)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": f"Namespace '{namespace}' deleted"}
+
+
+@app.get("/namespaces")
+async def list_namespaces():
+    """
+    Fastapi GET method with every namespace, its size and residency, and the
+    memory budget and paging counters.
+    """
+    return namespaces.stats()
+
+
+@app.post("/set_context")
+async def set_context(data: Request):
+    """
+    Same as '/namespaces/{namespace}/set_context' for the default namespace.
+    """
+    return await set_context_ns(DEFAULT_NAMESPACE, data)
+
+
+@app.post("/add_context")
+async def add_context(data: Request):
+    """
+    Same as '/namespaces/{namespace}/add_context' for the default namespace.
+    """
+    return await add_context_ns(DEFAULT_NAMESPACE, data)
+
+
+@app.post("/update_context")
+async def update_context(data: Request):
+    """
+    Same as '/namespaces/{namespace}/update_context' for the default namespace.
+    """
+    return await update_context_ns(DEFAULT_NAMESPACE, data)
+
+
+@app.post("/delete_context")
+async def delete_context(data: Request):
+    """
+    Same as '/namespaces/{namespace}/delete_context' for the default namespace.
+    """
+    return await delete_context_ns(DEFAULT_NAMESPACE, data)
+
+
+@app.post("/get_answer")
+async def get_answer(data: Request):
+    """
+    Same as '/namespaces/{namespace}/get_answer' for the default namespace.
+    """
+    return await get_answer_ns(DEFAULT_NAMESPACE, data)
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Fastapi GET method for readiness probes: 200 once the model and default context are
+    loaded and warmed up, 503 before. Reports the cold start time and the memory
+    ('rss', 'pss', 'shared', 'private' bytes) of the worker process answering.
+    """
+    body = {**startup, 'pid': os.getpid(), 'memory': memory_usage()}
+    return JSONResponse(body, status_code=200 if startup['ready'] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Fastapi GET method with the Prometheus metrics of every worker: latency histograms
+    per request and per stage (tokenize, forward, pooling, normalize, lookup, search,
+    serialize), embedding batch size and token count distributions, and memory gauges.
+    """
+    update_memory_gauges(namespaces.stats(), memory_usage())
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
+
+@app.get("/batching_stats")
+async def batching_stats():
+    """
+    Fastapi GET method with the micro-batching metrics of /get_answer: throughput,
+    batch sizes and queue wait times.
+    """
+    return batcher.stats()
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Same as '/namespaces/{namespace}/cache_stats' for the default namespace.
+    """
+    return await cache_stats_ns(DEFAULT_NAMESPACE)
 
-# initialises the QA model and starts the uvicorn app
+# starts a single uvicorn worker. The QA model is loaded once, at import. For several workers
+# sharing one copy of the model, use serve.py
 if __name__ == "__main__":
-    qa_search = QASearcher()
     # uvicorn.run(app, host="127.0.0.1", port=8000)
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,435 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # no cross-process write lock outside Unix, where serve.py does not run either
+    fcntl = None
+
+# Soft type assertions
+from typing import Callable, Dict, Iterator, List
+from torch import Tensor
+from cache import LRUCache
+from classes import QAEmbedder, QASearcher
+from store import current_snapshot
+
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+# lock file in every namespace directory, held while a context change is applied and saved
+WRITE_LOCK = "LOCK"
+
+
+def searcher_nbytes(searcher: QASearcher) -> int:
+    """
+    Approximate resident memory of a searcher's context: the embedding matrix plus the
+    question and answer text. The shared model is not included.
+
+    :param searcher: searcher to measure
+    :type searcher: QASearcher
+
+    :return: size in bytes
+    :rtype: int
+    """
+    context = searcher.context
+    text = sum(len(q) + len(a) for q, a in zip(context.questions, context.answers))
+    return context.index.nbytes + text
+
+
+class NamespaceManager:
+    def __init__(self,
+                 model_name: str = "paraphrase-MiniLM-L6-v2",
+                 backend: str = "eager",
+                 memory_budget: int = None,
+                 cache_dir: str = None,
+                 reload_changed: bool = False,
+                 embed_workers: int = 0,
+                 embed_threads: int = 1,
+                 **searcher_params):
+        """
+        Named, independent QnA contexts served from one process.
+
+        Every namespace is a 'QASearcher' with its own context and index, but all of them
+        share one 'QAEmbedder' (one copy of the model weights) and one query embedding cache.
+
+        When the resident contexts exceed 'memory_budget', the least recently used idle
+        namespaces are paged out to 'cache_dir' (see 'store.py') and transparently loaded
+        back on their next use. Namespaces in use are never paged out.
+
+        :param model_name: model name/directory shared by every namespace
+        :type model_name: str
+        :param backend: inference backend of the shared embedder, see 'QAEmbedder'
+        :type backend: str
+        :param memory_budget: Maximum bytes of resident contexts. Unlimited if None
+        :type memory_budget: int
+        :param cache_dir: Directory where namespaces are persisted, one sub-directory each.
+            Existing namespaces in it are picked up lazily. A temporary directory is used if
+            a budget is set without one
+        :type cache_dir: str
+        :param reload_changed: Check 'cache_dir' on every use and reload namespaces that another
+            process saved since they were loaded here, and pick up namespaces it created. For
+            several worker processes serving the same namespaces
+        :type reload_changed: bool
+        :param embed_workers: Processes of the shared embedder's pool for bulk context embedding,
+            see 'QAEmbedder'. Disabled if 0
+        :type embed_workers: int
+        :param embed_threads: torch intra-op threads of each of those processes
+        :type embed_threads: int
+        :param searcher_params: Keyword arguments forwarded to every 'QASearcher' (index, caches)
+        """
+        self.embedder = QAEmbedder(model_name=model_name, backend=backend, workers=embed_workers,
+                                   threads_per_worker=embed_threads)
+        self.memory_budget = memory_budget
+        if cache_dir is None and memory_budget is not None:
+            cache_dir = tempfile.mkdtemp(prefix="qna-namespaces-")
+        self.cache_dir = cache_dir
+        self.reload_changed = reload_changed
+        self.searcher_params = searcher_params
+
+        self.embedding_cache = LRUCache(
+            searcher_params.get('cache_size', 10000),
+            ttl=searcher_params.get('cache_ttl'),
+            max_bytes=searcher_params.get('cache_max_bytes', 64 * 2 ** 20),
+        ) if searcher_params.get('cache_size', 10000) else None
+        # context-less searcher sharing the model and cache, used to embed queries for any namespace
+        self.queries = self._new_searcher()
+
+        self._lock = threading.Lock()
+        self._resident = OrderedDict()  # name -> QASearcher, least recently used first
+        self._pins = {}  # name -> number of users
+        self._saved_versions = {}  # name -> context version last written to disk
+        self._snapshots = {}  # name -> on-disk snapshot the resident context was loaded from or saved as
+        self._namespace_locks = {}  # name -> lock held while loading, saving or deleting it
+        self._on_disk = set()
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            self._on_disk = {n for n in os.listdir(self.cache_dir)
+                             if NAMESPACE_PATTERN.match(n) and current_snapshot(self._path(n))}
+        self.page_outs = 0
+        self.page_ins = 0
+        self.reloads = 0
+
+    def _new_searcher(self) -> QASearcher:
+        return QASearcher(embedder=self.embedder, embedding_cache=self.embedding_cache, **self.searcher_params)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def names(self) -> List[str]:
+        """
+        Every known namespace, resident or paged out.
+        """
+        with self._lock:
+            self._refresh_on_disk()
+            return sorted(set(self._resident) | self._on_disk)
+
+    def _refresh_on_disk(self) -> None:
+        """
+        Picks up namespaces created or deleted by other processes ('reload_changed').
+        Must be called with 'self._lock' held.
+        """
+        if self.reload_changed and self.cache_dir and os.path.isdir(self.cache_dir):
+            self._on_disk = {n for n in os.listdir(self.cache_dir)
+                             if NAMESPACE_PATTERN.match(n) and current_snapshot(self._path(n))}
+
+    def _namespace_lock(self, name: str) -> threading.Lock:
+        """
+        Lock serializing the loading, saving and deletion of one namespace, so slow disk and
+        index work on one namespace never holds up the others. Must be called with
+        'self._lock' held.
+        """
+        return self._namespace_locks.setdefault(name, threading.Lock())
+
+    def _check_resident(self, name: str, snapshot: str) -> QASearcher:
+        """
+        The resident searcher of a namespace, dropped if another process saved (or deleted)
+        it since it was loaded here ('reload_changed'). Must be called with 'self._lock' held.
+        """
+        searcher = self._resident.get(name)
+        if self.reload_changed and self.cache_dir and snapshot != self._snapshots.get(name):
+            if searcher is not None:
+                del self._resident[name]
+                searcher = None
+                self.reloads += 1
+            if snapshot is None:
+                self._on_disk.discard(name)
+                self._snapshots.pop(name, None)
+            else:
+                self._on_disk.add(name)
+        return searcher
+
+    def acquire(self, name: str, create: bool = False) -> QASearcher:
+        """
+        Pins a namespace (it is never paged out while pinned) and gives access to its searcher,
+        loading it from disk if it was paged out. Only bookkeeping happens under the manager
+        lock: loading holds the namespace's own lock, so other namespaces are served meanwhile.
+        Every 'acquire' must be followed by a 'release'.
+
+        :param name: namespace name
+        :type name: str
+        :param create: create the namespace with an empty context if it does not exist
+        :type create: bool
+
+        :return: the namespace's searcher
+        :rtype: QASearcher
+        """
+        if not NAMESPACE_PATTERN.match(name):
+            raise ValueError(f"Invalid namespace name '{name}'")
+
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+            lock = self._namespace_lock(name)
+        try:
+            watch = self.reload_changed and self.cache_dir
+            snapshot = current_snapshot(self._path(name)) if watch else None
+            with self._lock:
+                searcher = self._check_resident(name, snapshot)
+                if searcher is not None:
+                    self._resident.move_to_end(name)
+                    return searcher
+
+            with lock:
+                with self._lock:
+                    # loaded by another thread while this one waited for the lock
+                    searcher = self._resident.get(name)
+                    on_disk = name in self._on_disk
+                if searcher is None:
+                    if on_disk:
+                        searcher = self._new_searcher()
+                        snapshot = current_snapshot(self._path(name))
+                        searcher.load_context(self._path(name))
+                    elif create:
+                        searcher = self._new_searcher()
+                    else:
+                        raise KeyError(name)
+                    with self._lock:
+                        self._resident[name] = searcher
+                        if on_disk:
+                            self._snapshots[name] = snapshot
+                            self._saved_versions[name] = searcher.context.version
+                            self.page_ins += 1
+                with self._lock:
+                    self._resident.move_to_end(name)
+            return searcher
+        except BaseException:
+            self.release(name)
+            raise
+
+    def release(self, name: str) -> None:
+        """
+        Unpins a namespace pinned by 'acquire', and pages out idle namespaces if the resident
+        contexts exceed the budget.
+
+        :param name: namespace name
+        :type name: str
+        """
+        with self._lock:
+            self._pins[name] -= 1
+            victims = self._over_budget()
+        for victim in victims:
+            self._page_out(victim)
+
+    @contextmanager
+    def use(self, name: str, create: bool = False) -> Iterator[QASearcher]:
+        """
+        'acquire' and 'release' around a block.
+
+        :param name: namespace name
+        :type name: str
+        :param create: create the namespace with an empty context if it does not exist
+        :type create: bool
+
+        :return: the namespace's searcher
+        :rtype: Iterator[QASearcher]
+        """
+        searcher = self.acquire(name, create=create)
+        try:
+            yield searcher
+        finally:
+            self.release(name)
+
+    def resident_bytes(self) -> int:
+        """
+        Approximate memory used by the resident contexts.
+        """
+        return sum(searcher_nbytes(s) for s in list(self._resident.values()))
+
+    def _over_budget(self) -> List[str]:
+        """
+        Least recently used idle namespaces to page out for the resident contexts to fit the
+        budget. Must be called with 'self._lock' held.
+        """
+        if self.memory_budget is None or self.cache_dir is None:
+            return []
+        sizes = {name: searcher_nbytes(s) for name, s in self._resident.items()}
+        total = sum(sizes.values())
+        victims = []
+        for name in self._resident:
+            if total <= self.memory_budget:
+                break
+            if self._pins.get(name, 0):
+                continue
+            victims.append(name)
+            total -= sizes[name]
+        return victims
+
+    def _page_out(self, name: str) -> None:
+        """
+        Saves an idle namespace to disk and drops it from memory. Skipped if another thread
+        is loading, saving or deleting it, or picks it up again meanwhile.
+        """
+        with self._lock:
+            lock = self._namespace_lock(name)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                searcher = self._resident.get(name)
+                if searcher is None or self._pins.get(name, 0):
+                    return
+            self._persist(name, searcher)
+            with self._lock:
+                # pinned, or changed after the save: keep it
+                if (self._pins.get(name, 0) or self._resident.get(name) is not searcher
+                        or self._saved_versions.get(name) != searcher.context.version):
+                    return
+                del self._resident[name]
+                self.page_outs += 1
+        finally:
+            lock.release()
+
+    def _persist(self, name: str, searcher: QASearcher) -> None:
+        # the update lock keeps a concurrent writer from changing the context mid-save
+        with searcher._update_lock:
+            version = searcher.context.version
+            with self._lock:
+                saved = self._saved_versions.get(name) == version
+            if not saved:
+                snapshot = searcher.save_context(self._path(name))
+                with self._lock:
+                    self._saved_versions[name] = version
+                    self._snapshots[name] = os.path.basename(snapshot)
+        with self._lock:
+            self._on_disk.add(name)
+
+    def persist(self, name: str) -> None:
+        """
+        Writes a resident namespace to 'cache_dir' if it changed since it was last written.
+
+        :param name: namespace name
+        :type name: str
+        """
+        if self.cache_dir is None:
+            return
+        with self._lock:
+            searcher = self._resident.get(name)
+        if searcher is not None:
+            self._persist(name, searcher)
+
+    @contextmanager
+    def _write_lock(self, name: str) -> Iterator[None]:
+        """
+        Exclusive lock on a namespace's context changes, shared by every process using
+        'cache_dir'. A no-op without one: the searcher's own lock then serializes writers.
+        """
+        if self.cache_dir is None or fcntl is None:
+            yield
+            return
+        os.makedirs(self._path(name), exist_ok=True)
+        with open(os.path.join(self._path(name), WRITE_LOCK), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def update(self, name: str, change: Callable[[QASearcher], Dict], create: bool = False) -> Dict:
+        """
+        Applies a context change to a namespace and writes it to 'cache_dir'.
+
+        The change is made under the namespace's write lock: the context another process
+        saved since it was loaded here is reloaded first ('reload_changed'), and the new
+        context is saved before the lock is released. So changes made concurrently by
+        several workers all end up in the context, rather than the last save winning.
+
+        :param name: namespace name
+        :type name: str
+        :param change: function applying the change to the namespace's searcher, e.g. calling
+            its 'upsert_context_qa'. Its result is returned
+        :type change: Callable[[QASearcher], Dict]
+        :param create: create the namespace with an empty context if it does not exist
+        :type create: bool
+
+        :return: the result of 'change'
+        :rtype: Dict
+        """
+        with self._write_lock(name):
+            with self.use(name, create=create) as searcher:
+                result = change(searcher)
+                if self.cache_dir is not None:
+                    self._persist(name, searcher)
+        return result
+
+    def drop(self, name: str) -> bool:
+        """
+        Deletes a namespace from memory and disk.
+
+        :param name: namespace name
+        :type name: str
+
+        :return: whether the namespace existed
+        :rtype: bool
+        """
+        with self._lock:
+            lock = self._namespace_lock(name)
+        with self._write_lock(name), lock:
+            with self._lock:
+                if self._pins.get(name, 0):
+                    raise RuntimeError(f"Namespace '{name}' is in use")
+                existed = self._resident.pop(name, None) is not None or name in self._on_disk
+                self._on_disk.discard(name)
+                self._saved_versions.pop(name, None)
+                self._snapshots.pop(name, None)
+            if self.cache_dir is not None:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+            return existed
+
+    def embed_queries(self, questions: List[str]) -> Tensor:
+        """
+        Embeds queries with the shared model and cache, for any namespace.
+
+        :param questions: List of strings with questions
+        :type questions: List[str]
+
+        :return: (N, d) normalized embeddings
+        :rtype: Tensor
+        """
+        return self.queries.embed_queries(questions, batch=len(questions))
+
+    def stats(self) -> Dict:
+        """
+        Per-namespace size and residency, and paging counters.
+
+        :rtype: Dict
+        """
+        with self._lock:
+            self._refresh_on_disk()
+            resident = {name: searcher_nbytes(s) for name, s in self._resident.items()}
+            namespaces = {
+                name: {
+                    'resident': name in resident,
+                    'bytes': resident.get(name, 0),
+                    'questions': len(self._resident[name].context) if name in resident else None,
+                }
+                for name in sorted(set(resident) | self._on_disk)
+            }
+        return {
+            'memory_budget': self.memory_budget,
+            'resident_bytes': sum(resident.values()),
+            'page_outs': self.page_outs,
+            'page_ins': self.page_ins,
+            'reloads': self.reloads,
+            'namespaces': namespaces,
+        }
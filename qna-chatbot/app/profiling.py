@@ -0,0 +1,238 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Soft type assertions
+from typing import Dict, Iterator, Tuple
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:  # metrics are optional: without prometheus_client every hook is a no-op
+    Histogram = None
+
+# with PROMETHEUS_MULTIPROC_DIR set (serve.py does) the workers write their samples there and /metrics
+# aggregates all of them. It must be set before this module is imported
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Noop:
+    def labels(self, *args, **kwargs) -> '_Noop':
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+
+if Histogram is not None:
+    STAGE_SECONDS = Histogram(
+        "qna_stage_seconds",
+        "Time spent per processing stage: tokenize, forward, pooling, normalize, lookup, search, serialize",
+        ["stage"], buckets=STAGE_BUCKETS,
+    )
+    REQUEST_SECONDS = Histogram(
+        "qna_request_seconds", "Request latency by endpoint", ["method", "path"], buckets=STAGE_BUCKETS,
+    )
+    BATCH_SIZE = Histogram(
+        "qna_embedding_batch_size", "Sentences per forward pass",
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    )
+    SEQUENCE_LENGTH = Histogram(
+        "qna_embedding_sequence_length", "Padded tokens per sentence of a forward pass",
+        buckets=(8, 16, 24, 32, 48, 64, 96, 128, 256, 512),
+    )
+    TOKENS = Histogram(
+        "qna_embedding_tokens", "Real (unpadded) tokens per sentence",
+        buckets=(4, 8, 12, 16, 24, 32, 48, 64, 128, 256, 512),
+    )
+    # set once in the process loading the model, which the workers share
+    MODEL_BYTES = Gauge("qna_model_bytes", "Parameter and buffer memory of the model", multiprocess_mode="max")
+    CONTEXT_BYTES = Gauge("qna_context_bytes", "Memory of the resident contexts (embeddings and text)",
+                          multiprocess_mode="liveall")
+    CONTEXT_ROWS = Gauge("qna_context_rows", "Questions in a resident namespace context", ["namespace"],
+                         multiprocess_mode="liveall")
+    PROCESS_BYTES = Gauge("qna_process_bytes", "Memory of the worker process, by kind (rss, pss, shared, private)",
+                          ["kind"], multiprocess_mode="liveall")
+else:
+    STAGE_SECONDS = REQUEST_SECONDS = BATCH_SIZE = SEQUENCE_LENGTH = TOKENS = _Noop()
+    MODEL_BYTES = CONTEXT_BYTES = CONTEXT_ROWS = PROCESS_BYTES = _Noop()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times the enclosed block into the 'qna_stage_seconds' histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_batch(attention_mask) -> None:
+    """
+    Records the batch size, padded length and real token counts of a tokenized batch.
+
+    :param attention_mask: (B, T) attention mask of the batch
+    :type attention_mask: Tensor
+    """
+    BATCH_SIZE.observe(attention_mask.shape[0])
+    SEQUENCE_LENGTH.observe(attention_mask.shape[1])
+    for tokens in attention_mask.sum(dim=1).tolist():
+        TOKENS.observe(tokens)
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Current metrics in the Prometheus text format, across every worker process.
+
+    :return: (body, content type)
+    :rtype: Tuple[bytes, str]
+    """
+    if Histogram is None:
+        return b"# prometheus_client is not installed\n", "text/plain; charset=utf-8"
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# frames of threads that are merely waiting for work; their samples are dropped
+IDLE_FRAMES = {('threading.py', 'wait'), ('selectors.py', 'select'), ('thread.py', '_worker'), ('queue.py', 'get'),
+               ('base_events.py', '_run_once')}
+
+
+def _collapse(frame, thread_name: str) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    def __init__(self, directory: str, threshold_ms: float = 500.0, interval_ms: float = 5.0, window: int = 20000):
+        """
+        Opt-in sampling profiler. While requests are in flight a background thread samples
+        the Python stack of every thread each 'interval_ms'. When a request takes longer than
+        'threshold_ms', the samples taken during it are written to 'directory' in the
+        collapsed stack format read by flamegraph.pl and speedscope.
+
+        Work is shared between requests (micro-batching, thread pools), so a dump holds
+        every thread's activity during the slow request, not only its own.
+
+        :param directory: output directory of the '.folded' files
+        :type directory: str
+        :param threshold_ms: requests slower than this are dumped
+        :type threshold_ms: float
+        :param interval_ms: sampling interval
+        :type interval_ms: float
+        :param window: samples kept in memory
+        :type window: int
+        """
+        self.directory = directory
+        self.threshold_ms = threshold_ms
+        self.interval = interval_ms / 1000
+        self.samples = deque(maxlen=window)  # (time, collapsed stack)
+        self.dumps = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._wake:
+                self._wake.wait_for(lambda: self._active > 0)
+            now = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                code = frame.f_code
+                if ident == me or (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                self.samples.append((now, _collapse(frame, names.get(ident, str(ident)))))
+            time.sleep(self.interval)
+
+    @contextmanager
+    def profile(self, label: str) -> Iterator[None]:
+        """
+        Samples while the enclosed request runs and dumps the samples if it was slow.
+
+        :param label: request description used in the file name, e.g. 'POST /get_answer'
+        :type label: str
+        """
+        with self._wake:
+            if self._thread is None:
+                # started lazily, so a profiler created before forking samples in the workers
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+            self._active += 1
+            self._wake.notify_all()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._wake:
+                self._active -= 1
+            if (end - start) * 1000 >= self.threshold_ms:
+                self.dump(label, start, end)
+
+    def dump(self, label: str, start: float, end: float) -> str:
+        """
+        Writes the samples taken between 'start' and 'end' as collapsed stacks.
+
+        :return: the file written
+        :rtype: str
+        """
+        counts = {}
+        for at, stack in list(self.samples):
+            if start <= at <= end:
+                counts[stack] = counts.get(stack, 0) + 1
+        name = "{}-{}-{}-{:.0f}ms.folded".format(
+            time.strftime("%Y%m%dT%H%M%S"), os.getpid(),
+            "".join(c if c.isalnum() else "_" for c in label).strip("_"), (end - start) * 1000,
+        )
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            for stack, count in sorted(counts.items()):
+                f.write(f"{stack} {count}\n")
+        self.dumps += 1
+        return path
+
+
+def model_nbytes(model) -> int:
+    """
+    Memory of a torch model's parameters and buffers.
+    """
+    return sum(t.element_size() * t.numel() for t in [*model.parameters(), *model.buffers()])
+
+
+def update_memory_gauges(stats: Dict, memory: Dict) -> None:
+    """
+    Sets the context and process memory gauges.
+
+    :param stats: 'NamespaceManager.stats()'
+    :type stats: Dict
+    :param memory: 'serve.memory_usage()'
+    :type memory: Dict
+    """
+    CONTEXT_BYTES.set(stats['resident_bytes'])
+    for name, namespace in stats['namespaces'].items():
+        if namespace['resident']:
+            CONTEXT_ROWS.labels(name).set(namespace['questions'])
+    for kind, value in memory.items():
+        PROCESS_BYTES.labels(kind).set(value)
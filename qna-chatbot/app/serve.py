@@ -0,0 +1,221 @@
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# Soft type assertions
+from typing import Dict, List
+
+# seconds after forking before the first memory report, once the workers have served their first requests
+REPORT_DELAY = 5
+IMPORTED = time.perf_counter()
+SMAPS_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Shared_Clean': 'shared', 'Shared_Dirty': 'shared',
+                'Private_Clean': 'private', 'Private_Dirty': 'private'}
+
+
+def memory_usage(pid: int = None) -> Dict:
+    """
+    Memory of a process in bytes, from /proc/<pid>/smaps_rollup (Linux). 'pss' charges
+    every shared page in equal parts to the processes mapping it, so the 'pss' of all
+    workers adds up to the memory they really use together, unlike 'rss'.
+
+    :param pid: process id, the current process if None
+    :type pid: int
+
+    :return: 'rss', 'pss', 'shared' and 'private' bytes. Only the peak 'rss' of the
+        current process where /proc is not available
+    :rtype: Dict
+    """
+    usage = {}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in SMAPS_FIELDS:
+                    key = SMAPS_FIELDS[name]
+                    usage[key] = usage.get(key, 0) + int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        usage = {'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    return usage
+
+
+def process_uptime() -> float:
+    """
+    Seconds since the current process started, imports included (Linux). Elsewhere, seconds
+    since this module was imported.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError):
+        return time.perf_counter() - IMPORTED
+
+
+def worker_memory(pids: List[int]) -> Dict:
+    """
+    Memory of every given process, and their total 'rss' and 'pss'. Their difference is
+    what copy-on-write sharing saves.
+    """
+    usage = {pid: memory_usage(pid) for pid in pids}
+    return {
+        'processes': usage,
+        'total_rss': sum(u.get('rss', 0) for u in usage.values()),
+        'total_pss': sum(u.get('pss', 0) for u in usage.values()),
+    }
+
+
+def listen(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, threads: int, log_level: str) -> None:
+    """
+    Serves 'app' on an inherited listening socket until the worker is told to stop.
+    """
+    import torch
+    import uvicorn
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGALRM):
+        signal.signal(signum, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def serve(host: str = "0.0.0.0",
+          port: int = 8000,
+          workers: int = None,
+          threads_per_worker: int = None,
+          log_level: str = "warning") -> None:
+    """
+    Pre-fork server: the model and the default namespace's context are loaded and warmed
+    up once in this process, which then forks 'workers' uvicorn workers accepting on one
+    shared socket. The workers share the model weights and embedding matrix with the parent
+    copy-on-write instead of loading their own. Dead workers are replaced.
+
+    :param host: interface to listen on
+    :type host: str
+    :param port: port to listen on
+    :type port: int
+    :param workers: number of worker processes, defaults to the CPU count
+    :type workers: int
+    :param threads_per_worker: torch intra-op threads per worker, defaults to CPU count / workers
+    :type threads_per_worker: int
+    :param log_level: uvicorn log level
+    :type log_level: str
+    """
+    workers = workers or os.cpu_count() or 1
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    # worker metrics are aggregated through this directory (see profiling.py). It must be set before
+    # prometheus_client is first imported, and emptied of the samples of a previous run
+    metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="qna-metrics-"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    for name in os.listdir(metrics_dir):
+        if name.endswith(".db"):
+            os.remove(os.path.join(metrics_dir, name))
+
+    # workers hold their own copy of every context after forking. Through the on-disk cache, a context
+    # changed in one worker is reloaded by the others on their next use of it
+    if workers > 1:
+        if not os.environ.get("QNA_CONTEXT_CACHE"):
+            print("QNA_CONTEXT_CACHE is not set: context changes will only reach the worker handling them",
+                  file=sys.stderr, flush=True)
+        os.environ["QNA_SHARED_CONTEXT"] = "1"
+
+    import main
+    startup = main.warm_up()
+    sock = listen(host, port)
+    # everything allocated so far is left alone by the garbage collector in the workers: a
+    # collection would otherwise write to (and so un-share) every page holding a tracked object
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(main.app, sock, threads_per_worker, log_level)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = slot
+
+    stopping = []
+
+    def stop(signum, frame) -> None:
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(signum, frame) -> None:
+        print(json.dumps({'memory': worker_memory([os.getpid(), *children])}), flush=True)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    # 'kill -USR1 <parent pid>' prints the memory of every process again
+    signal.signal(signal.SIGUSR1, report)
+    signal.signal(signal.SIGALRM, report)
+    for slot in range(workers):
+        spawn(slot)
+
+    print(json.dumps({
+        'listening': f"http://{host}:{port}",
+        'workers': workers,
+        'threads_per_worker': threads_per_worker,
+        **{k: v for k, v in startup.items() if k != 'ready'},
+        'parent': {'pid': os.getpid(), **memory_usage()},
+    }), flush=True)
+    signal.alarm(REPORT_DELAY)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        try:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(pid)
+        except ImportError:
+            pass
+        if slot is not None and not stopping:
+            print(json.dumps({'worker_exited': pid, 'status': status, 'respawning': slot}), flush=True)
+            spawn(slot)
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the QnA API from pre-forked workers sharing one loaded model")
+    parser.add_argument("--host", default=os.environ.get("QNA_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("QNA_PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("QNA_WORKERS", 0)) or None)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork; run 'python main.py' instead")
+    serve(args.host, args.port, args.workers, args.threads_per_worker, args.log_level)
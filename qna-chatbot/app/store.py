@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import torch
+
+# Soft type assertions
+from typing import Dict, Iterable, Optional, Tuple
+from torch import Tensor
+from context import QAContext
+
+# bump whenever the on-disk layout changes; older caches are then ignored and rebuilt
+FORMAT_VERSION = 1
+
+CURRENT = "CURRENT"
+META = "meta.json"
+RECORDS = "context.json"
+EMBEDDINGS = "embeddings.f32"
+# a snapshot can be deleted by a concurrent 'write_snapshot' while it is read; loading then
+# starts over from the new CURRENT, at most this many times
+LOAD_ATTEMPTS = 3
+# model directories are looked up here (the project root, next to 'app/') unless given as absolute paths,
+# so the working directory of the process does not matter
+MODEL_ROOT = os.environ.get("QNA_MODEL_ROOT", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def model_path(model_name: str) -> str:
+    """
+    Directory of a model given by name, see 'MODEL_ROOT'.
+
+    :param model_name: model name/directory
+    :type model_name: str
+
+    :return: absolute path
+    :rtype: str
+    """
+    return os.path.join(MODEL_ROOT, model_name)
+
+
+def model_fingerprint(model_dir: str) -> str:
+    """
+    Content hash of every file in a model directory. Embeddings cached for one model
+    are only reused if the fingerprint still matches.
+
+    :param model_dir: directory with model and tokenizer files
+    :type model_dir: str
+
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if not os.path.isfile(path):
+            continue
+        digest.update(name.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def embedder_fingerprint(model_dir: str, backend: str) -> str:
+    """
+    Fingerprint of the embeddings produced by a model directory with a given backend.
+
+    :param model_dir: directory with model and tokenizer files
+    :type model_dir: str
+    :param backend: inference backend name
+    :type backend: str
+
+    :return: fingerprint
+    :rtype: str
+    """
+    return model_fingerprint(model_dir) + ":" + backend
+
+
+def write_snapshot(path: str,
+                   records: Dict,
+                   embedding_chunks: Iterable[Tensor],
+                   count: int,
+                   dim: int,
+                   fingerprint: str,
+                   version: int = 0,
+                   extra: Dict = None) -> str:
+    """
+    Writes a new versioned snapshot directory under 'path' and atomically points
+    'path/CURRENT' at it. Processes that already mapped an older snapshot keep
+    reading it until they reload.
+
+    The embedding matrix is written chunk by chunk through a shared mapping of the output
+    file, so it never has to be held in memory as a whole.
+
+    Layout of a snapshot directory:
+      - meta.json: format version, model fingerprint, row count, dimension, dtype
+      - context.json: ids, questions and answers
+      - embeddings.f32: (count, dim) normalized float32 matrix, row-major
+
+    :param path: cache directory
+    :type path: str
+    :param records: 'ids', 'questions' and 'answers' lists
+    :type records: Dict
+    :param embedding_chunks: (n, dim) embedding blocks, in row order, adding up to 'count' rows
+    :type embedding_chunks: Iterable[Tensor]
+    :param count: total number of rows
+    :type count: int
+    :param dim: embedding dimension
+    :type dim: int
+    :param fingerprint: fingerprint of the model that produced the embeddings
+    :type fingerprint: str
+    :param version: context version
+    :type version: int
+    :param extra: additional metadata to store in meta.json
+    :type extra: Dict
+
+    :return: the snapshot directory
+    :rtype: str
+    """
+    os.makedirs(path, exist_ok=True)
+    name = f"ctx-{version}-{uuid.uuid4().hex[:8]}"
+    snapshot = os.path.join(path, name)
+    os.makedirs(snapshot)
+
+    if count and dim:
+        out = torch.from_file(os.path.join(snapshot, EMBEDDINGS), shared=True, size=count * dim,
+                              dtype=torch.float32).view(count, dim)
+        row = 0
+        for chunk in embedding_chunks:
+            out[row:row + chunk.shape[0]] = chunk
+            row += chunk.shape[0]
+        if row != count:
+            raise ValueError(f"Expected {count} embedding rows, got {row}")
+        del out
+    else:
+        open(os.path.join(snapshot, EMBEDDINGS), 'wb').close()
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'fingerprint': fingerprint,
+        'count': count,
+        'dim': dim,
+        'dtype': 'float32',
+        'version': version,
+        **(extra or {}),
+    }
+    with open(os.path.join(snapshot, RECORDS), 'w') as f:
+        json.dump({key: records[key] for key in ('ids', 'questions', 'answers')}, f)
+    with open(os.path.join(snapshot, META), 'w') as f:
+        json.dump(meta, f)
+
+    pointer = os.path.join(path, f"{CURRENT}.{uuid.uuid4().hex[:8]}")
+    with open(pointer, 'w') as f:
+        f.write(name)
+    os.replace(pointer, os.path.join(path, CURRENT))
+
+    # older snapshots can go; already mapped files stay valid until unmapped
+    for old in os.listdir(path):
+        if old.startswith("ctx-") and old != name:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return snapshot
+
+
+def save_context(path: str, context: QAContext, fingerprint: str, extra: Dict = None) -> str:
+    """
+    Saves a context under 'path' as a new snapshot, see 'write_snapshot'.
+
+    :param path: cache directory
+    :type path: str
+    :param context: context to save
+    :type context: QAContext
+    :param fingerprint: fingerprint of the model that produced the embeddings
+    :type fingerprint: str
+    :param extra: additional metadata to store in meta.json
+    :type extra: Dict
+
+    :return: the snapshot directory
+    :rtype: str
+    """
+    embeddings = context.embeddings.to(torch.float32)
+    return write_snapshot(
+        path,
+        {'ids': context.ids, 'questions': context.questions, 'answers': context.answers},
+        [embeddings],
+        count=embeddings.shape[0],
+        dim=embeddings.shape[1] if embeddings.dim() == 2 else 0,
+        fingerprint=fingerprint,
+        version=context.version,
+        extra=extra,
+    )
+
+
+def current_snapshot(path: str) -> Optional[str]:
+    """
+    Name of the current snapshot under 'path', None if there is none. Changes whenever
+    a new snapshot is written, by this process or any other.
+
+    :param path: cache directory
+    :type path: str
+
+    :rtype: Optional[str]
+    """
+    try:
+        with open(os.path.join(path, CURRENT)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_context(path: str, fingerprint: str) -> Optional[Tuple[Dict, Dict, Tensor]]:
+    """
+    Loads the current snapshot under 'path'. The embedding matrix is memory-mapped
+    (MAP_SHARED, read-only use), so every process loading the same snapshot shares
+    one physical copy through the page cache. A snapshot deleted while it is read, by a
+    concurrent 'write_snapshot', is a retry with the new CURRENT rather than an error.
+
+    :param path: cache directory
+    :type path: str
+    :param fingerprint: fingerprint of the model currently in use
+    :type fingerprint: str
+
+    :return: (meta, records, embeddings), or None if there is no usable cache for this
+        model and format version
+    :rtype: Optional[Tuple[Dict, Dict, Tensor]]
+    """
+    for _ in range(LOAD_ATTEMPTS):
+        name = current_snapshot(path)
+        if name is None:
+            return None
+        try:
+            return _load_snapshot(os.path.join(path, name), fingerprint)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _load_snapshot(snapshot: str, fingerprint: str) -> Optional[Tuple[Dict, Dict, Tensor]]:
+    """
+    Loads one snapshot directory, see 'load_context'. Raises FileNotFoundError if it is
+    deleted before its embeddings are mapped.
+    """
+    try:
+        with open(os.path.join(snapshot, META)) as f:
+            meta = json.load(f)
+    except json.JSONDecodeError:
+        return None
+
+    if meta.get('format_version') != FORMAT_VERSION or meta.get('fingerprint') != fingerprint:
+        return None
+
+    with open(os.path.join(snapshot, RECORDS)) as f:
+        records = json.load(f)
+
+    count, dim = meta['count'], meta['dim']
+    if count == 0:
+        return meta, records, torch.empty(0, dim)
+
+    # 'torch.from_file' creates the file when it is missing, so a deleted snapshot would map as
+    # zeros: hold the file open meanwhile and check that the mapped path is still that file
+    file = os.path.join(snapshot, EMBEDDINGS)
+    with open(file, 'rb') as f:
+        try:
+            embeddings = torch.from_file(file, shared=True, size=count * dim, dtype=torch.float32)
+        except RuntimeError:
+            raise FileNotFoundError(file)
+        try:
+            unchanged = os.stat(file).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            unchanged = False
+    if not unchanged:
+        raise FileNotFoundError(file)
+    return meta, records, embeddings.view(count, dim)
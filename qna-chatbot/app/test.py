@@ -1,15 +1,15 @@
 import json
 from classes import QAEmbedder, QASearcher
+from ingest import SquadIndex
 
 emb = QAEmbedder()
 search = QASearcher()
 
-# Read the context data
-with open("../train-v2.0.json", 'r') as f:
-  data = json.load(f)
+# Index the context data (streamed, the file is never fully loaded)
+squad = SquadIndex("../train-v2.0.json")
 
 # Extract the QnA context/facts
-questions, answers = emb.get_qa(topic='Premier_League', data=data)
+questions, answers = squad.get_qa(topic='Premier_League')
 print("Number of available questions: {}".format(len(questions)))
 
 # Define model
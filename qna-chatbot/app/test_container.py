@@ -1,15 +1,11 @@
 import requests
-import json
-from classes import QAEmbedder
+from ingest import SquadIndex
 
 def test(url: str) -> None:
-    emb = QAEmbedder()
+    # Index data then set the context using POST
+    squad = SquadIndex("../train-v2.0.json")
 
-    # Load data then set the context using POST
-    with open("../train-v2.0.json", 'r') as f:
-        data = json.load(f)
-
-    questions, answers = emb.get_qa(topic='Premier_League', data=data)
+    questions, answers = squad.get_qa(topic='Premier_League')
 
     json_data = {
       'questions': questions,
@@ -0,0 +1,84 @@
+import pytest
+import torch
+
+import context
+from context import QAContext
+from index import get_index
+
+
+def normalized(n: int, d: int = 16, seed: int = 0) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.nn.functional.normalize(torch.randn(n, d, generator=generator), dim=1)
+
+
+def make_context(n: int) -> QAContext:
+    index = get_index('flat')
+    index.build(normalized(n))
+    return QAContext([str(i) for i in range(n)], [f"question {i}" for i in range(n)], ["answer"] * n, index)
+
+
+@pytest.mark.parametrize('n', [1_000, 20_000])
+def test_derive_only_hashes_updated_rows(monkeypatch, n):
+    base = make_context(n)
+    calls = {'hash': 0, 'normalize': 0}
+
+    def counted(name, function):
+        def wrapper(*args):
+            calls[name] += 1
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(context, 'content_hash', counted('hash', context.content_hash))
+    monkeypatch.setattr(context, 'normalize_question', counted('normalize', context.normalize_question))
+
+    index = base.index.clone()
+    index.replace([3], normalized(1, seed=1))
+    index.add(normalized(1, seed=2))
+    derived = base.derive({'3': ("changed", "a"), 'new': ("added", "b")}, index, version=1)
+
+    # the same work whatever the size of the context
+    assert calls == {'hash': 2, 'normalize': 3}
+    assert derived.positions['new'] == n and derived.rows_by_text['changed'] == 3
+    assert base.questions[3] == "question 3" and 'new' not in base.positions
+
+
+@pytest.mark.parametrize('name', ['flat', 'ivf', 'hnsw'])
+def test_replace_copies_the_buffer_once_per_clone(name):
+    original = get_index(name)
+    original.build(normalized(500))
+    before = original.embeddings.clone()
+
+    index = original.clone()
+    index.replace([0], normalized(1, seed=1))
+    buffer = index._buffer.data_ptr()
+    index.replace([1], normalized(1, seed=2))
+
+    assert index._buffer.data_ptr() == buffer != original._buffer.data_ptr()
+    assert torch.equal(original.embeddings, before)
+
+
+@pytest.mark.parametrize('n', [500, 2_000])
+def test_hnsw_replace_only_relinks_neighbours(n):
+    original = get_index('hnsw', m=8, ef_construction=32)
+    original.build(normalized(n))
+
+    index = original.clone()
+    index.replace([n // 2], normalized(1, seed=1))
+
+    changed = sum(links is not original._graph[layer][row]
+                  for layer in range(len(index._graph)) for row, links in index._graph[layer].items())
+    # the row itself and the neighbours linked back to it, on each of its layers
+    assert changed <= (original.m + 1) * len(index._graph)
+
+
+def test_sharded_replace_copies_only_its_shard():
+    original = get_index('sharded', n_shards=4, min_shard_rows=100)
+    original.build(normalized(1_000))
+
+    index = original.clone()
+    index.replace([5], normalized(1, seed=1))
+    first = index.shards[0]
+    index.replace([6], normalized(1, seed=2))
+
+    assert index.shards[0] is first is not original.shards[0]
+    assert all(a is b for a, b in zip(index.shards[1:-1], original.shards[1:-1]))
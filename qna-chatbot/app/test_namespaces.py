@@ -0,0 +1,26 @@
+import os
+
+import pytest
+from namespaces import NamespaceManager
+from store import model_path
+
+MODEL = "paraphrase-MiniLM-L6-v2"
+
+pytestmark = pytest.mark.skipif(not os.path.exists(os.path.join(model_path(MODEL), "model.safetensors")),
+                                reason="model weights not downloaded")
+
+
+def test_namespaces_share_one_embedding_cache(tmp_path):
+    manager = NamespaceManager(model_name=MODEL, cache_dir=str(tmp_path))
+    assert manager.embedding_cache is not None and len(manager.embedding_cache) == 0
+
+    with manager.use('a', create=True) as a, manager.use('b', create=True) as b:
+        assert a.embedding_cache is manager.embedding_cache
+        assert b.embedding_cache is manager.embedding_cache
+        a.set_context_qa(['Where is the stadium ?'], ['downtown'])
+        b.set_context_qa(['Who is the coach ?'], ['bob'])
+        a.get_answers(['where is the stadium'])
+        # embedded once by 'a', then a hit for 'b'
+        b.get_answers(['where is the stadium'])
+
+    assert manager.embedding_cache.stats()['hits'] >= 1
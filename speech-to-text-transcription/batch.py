@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Soft type assertions
+from typing import Dict, Iterable, Iterator, List, Set
+from preprocess import PreprocessingTranscriber
+from transcribers import Transcriber, TranscriptionError, TRANSCRIBERS, get_transcriber
+
+AUDIO_EXTENSIONS = (".m4a", ".mp3", ".mp4", ".wav", ".flac", ".ogg", ".opus", ".webm", ".aac")
+
+
+def iter_jobs(source: str) -> Iterator[Dict]:
+    """
+    Audio files to transcribe, from a directory (searched recursively for audio files) or
+    a manifest: a .jsonl file of {"path": ..., "id": ...} objects, or a text file with one
+    path per line. Relative paths in a manifest are relative to the manifest's directory.
+
+    :param source: directory or manifest file
+    :type source: str
+
+    :return: {'id': ..., 'path': ...} per file, ids default to the path relative to 'source'
+    :rtype: Iterator[Dict]
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield {'id': os.path.relpath(path, source), 'path': path}
+        return
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if source.endswith(".jsonl") else {'path': line}
+            if "://" not in entry['path'] and not os.path.isabs(entry['path']):
+                entry['path'] = os.path.join(base, entry['path'])
+            entry.setdefault('id', os.path.relpath(entry['path'], base) if "://" not in entry['path'] else entry['path'])
+            yield entry
+
+
+class JsonlWriter:
+    def __init__(self, path: str):
+        """
+        Appends one JSON record per line, flushed as soon as it is written.
+
+        Every record comes with a 'receipt' (any value, e.g. its progress log entry) that the
+        writer hands back once the record is on disk, so the caller can log it as done.
+        """
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record: Dict, receipt=None) -> List:
+        """
+        :return: receipts of the records now on disk, here always 'receipt'
+        :rtype: List
+        """
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        return [receipt]
+
+    def close(self) -> List:
+        self.file.close()
+        return []
+
+
+class ParquetWriter:
+    def __init__(self, directory: str, rows_per_file: int = 1000):
+        """
+        Writes records to a directory of Parquet files of 'rows_per_file' rows, so finished
+        files are readable (e.g. as one dataset with pyarrow or pandas) while the run goes on.
+        Requires pyarrow.
+
+        Records are buffered until their file is written, and so are their receipts (see
+        'JsonlWriter'): they are only handed back by the 'write', 'flush' or 'close' call
+        that put the records on disk.
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.rows = []
+        self.receipts = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: Dict, receipt=None) -> List:
+        """
+        :return: receipts of the records now on disk, empty until the buffer is full
+        :rtype: List
+        """
+        self.rows.append(record)
+        self.receipts.append(receipt)
+        if len(self.rows) >= self.rows_per_file:
+            return self.flush()
+        return []
+
+    def flush(self) -> List:
+        if not self.rows:
+            return []
+        name = "part-{}-{:06d}.parquet".format(int(time.time() * 1000), random.randrange(10 ** 6))
+        tmp = os.path.join(self.directory, "." + name)
+        self.pq.write_table(self.pa.Table.from_pylist(self.rows), tmp)
+        os.replace(tmp, os.path.join(self.directory, name))
+        receipts, self.rows, self.receipts = self.receipts, [], []
+        return receipts
+
+    def close(self) -> List:
+        return self.flush()
+
+
+def open_writer(path: str):
+    """
+    Output writer for 'path': Parquet files in a directory if it ends with '.parquet',
+    JSONL otherwise.
+    """
+    return ParquetWriter(path) if path.endswith(".parquet") else JsonlWriter(path)
+
+
+class BatchRunner:
+    def __init__(self,
+                 transcriber: Transcriber,
+                 output: str,
+                 state_path: str = None,
+                 max_in_flight: int = 8,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 retry_failed: bool = False):
+        """
+        Transcribes many audio files concurrently.
+
+        At most 'max_in_flight' files are being transcribed at any time. Retryable failures
+        are retried up to 'retries' times with exponential backoff and jitter. Transcripts
+        are written to 'output' as they complete, and every finished file is logged to
+        'state_path', so an interrupted run skips what it already did when restarted.
+
+        :param transcriber: transcription backend, see 'transcribers.py'
+        :type transcriber: Transcriber
+        :param output: JSONL file, or a directory of Parquet files if it ends with '.parquet'
+        :type output: str
+        :param state_path: progress log, defaults to '<output>.state.jsonl'
+        :type state_path: str
+        :param max_in_flight: concurrent transcriptions
+        :type max_in_flight: int
+        :param retries: extra attempts per file for retryable failures
+        :type retries: int
+        :param backoff: seconds before the first retry, doubled on every further one
+        :type backoff: float
+        :param max_backoff: cap of the retry delay
+        :type max_backoff: float
+        :param retry_failed: also redo files that failed for good in a previous run
+        :type retry_failed: bool
+        """
+        self.transcriber = transcriber
+        self.output = output
+        self.state_path = state_path or output.rstrip("/") + ".state.jsonl"
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_failed = retry_failed
+
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retried = 0
+        self.audio_seconds = 0.0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+        self.latencies = []
+        self.elapsed = 0.0
+
+    def finished_ids(self) -> Set[str]:
+        """
+        Ids recorded in the progress log by previous runs.
+        """
+        finished = set()
+        if not os.path.exists(self.state_path):
+            return finished
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+                if entry['status'] == 'done' or (entry['status'] == 'failed' and not self.retry_failed):
+                    finished.add(entry['id'])
+        return finished
+
+    def _delay(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+    async def _transcribe(self, job: Dict, loop, executor) -> Dict:
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(executor, self.transcriber.transcribe, job['path'])
+            except Exception as e:
+                retryable = e.retryable if isinstance(e, TranscriptionError) else True
+                if not retryable or attempt > self.retries:
+                    return {'id': job['id'], 'status': 'failed', 'attempts': attempt, 'error': repr(e)}
+                self.retried += 1
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            seconds = time.perf_counter() - start
+            return {'id': job['id'], 'status': 'done', 'attempts': attempt, 'seconds': seconds,
+                    'record': {**job, **result, 'attempts': attempt, 'seconds': seconds}}
+
+    async def run(self, jobs: Iterable[Dict]) -> Dict:
+        """
+        Transcribes every job not finished by a previous run.
+
+        :param jobs: {'id': ..., 'path': ...} per file, e.g. from 'iter_jobs'
+        :type jobs: Iterable[Dict]
+
+        :return: run statistics, see 'stats'
+        :rtype: Dict
+        """
+        finished = self.finished_ids()
+        loop = asyncio.get_running_loop()
+        writer = open_writer(self.output)
+        state = open(self.state_path, 'a', encoding='utf-8')
+        pending = iter(jobs)
+        start = time.perf_counter()
+
+        def log(outcomes: List[Dict]) -> None:
+            for outcome in outcomes:
+                state.write(json.dumps(outcome) + "\n")
+            state.flush()
+
+        async def worker(executor):
+            # workers pull from one shared iterator, so the job list is never held in memory
+            for job in pending:
+                if job['id'] in finished:
+                    self.skipped += 1
+                    continue
+                outcome = await self._transcribe(job, loop, executor)
+                if outcome['status'] == 'done':
+                    record = outcome.pop('record')
+                    # logged only once the writer has the transcript on disk (a Parquet writer buffers
+                    # it first): a crash before then redoes the file
+                    log(writer.write(record, outcome))
+                    self.done += 1
+                    self.audio_seconds += record.get('audio_duration') or 0.0
+                    if 'preprocessing' in record:
+                        self.bytes_saved += record['preprocessing']['bytes_saved']
+                        self.seconds_saved += record['preprocessing']['seconds_saved']
+                    self.latencies.append(outcome['seconds'])
+                else:
+                    self.failed += 1
+                    log([outcome])
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="transcriber") as executor:
+                await asyncio.gather(*(worker(executor) for _ in range(self.max_in_flight)))
+        finally:
+            self.elapsed = time.perf_counter() - start
+            log(writer.close())
+            state.close()
+        return self.stats()
+
+    def stats(self) -> Dict:
+        """
+        Counts, throughput and per-file latency of the run.
+
+        :rtype: Dict
+        """
+        latencies = sorted(self.latencies)
+        return {
+            'done': self.done,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'retries': self.retried,
+            'elapsed_seconds': self.elapsed,
+            'files_per_second': self.done / self.elapsed if self.elapsed else 0.0,
+            'audio_seconds': self.audio_seconds,
+            'audio_seconds_per_second': self.audio_seconds / self.elapsed if self.elapsed else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'audio_seconds_saved': self.seconds_saved,
+            'latency_p50': statistics.median(latencies) if latencies else None,
+            'latency_p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Transcribe a directory or manifest of audio files")
+    parser.add_argument("source", help="directory of audio files, or a manifest (.jsonl or one path per line)")
+    parser.add_argument("--output", default="transcripts.jsonl",
+                        help="JSONL file, or a directory of Parquet files if it ends with .parquet")
+    parser.add_argument("--state", default=None, help="progress log, defaults to <output>.state.jsonl")
+    parser.add_argument("--backend", default="assemblyai", choices=list(TRANSCRIBERS))
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=1.0)
+    parser.add_argument("--retry-failed", action="store_true", help="redo files that failed in a previous run")
+    parser.add_argument("--preprocess", action="store_true",
+                        help="decode to 16 kHz mono, remove silence and upload overlapping chunks in parallel")
+    parser.add_argument("--chunk-seconds", type=float, default=300.0)
+    parser.add_argument("--parallel-chunks", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="local backend only: injected failures")
+    args = parser.parse_args()
+
+    params = {'failure_rate': args.failure_rate} if args.backend == "local" else {}
+    transcriber = get_transcriber(args.backend, **params)
+    if args.preprocess:
+        transcriber = PreprocessingTranscriber(transcriber, chunk_seconds=args.chunk_seconds,
+                                               parallel_chunks=args.parallel_chunks)
+    runner = BatchRunner(transcriber, args.output, state_path=args.state,
+                         max_in_flight=args.max_in_flight, retries=args.retries, backoff=args.backoff,
+                         retry_failed=args.retry_failed)
+    print(json.dumps(asyncio.run(runner.run(iter_jobs(args.source))), indent=2))
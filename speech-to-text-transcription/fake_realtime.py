@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import base64
+import json
+import math
+import time
+import uuid
+
+import numpy as np
+
+# Soft type assertions
+from typing import Dict
+
+try:
+    from websockets.asyncio.server import serve as ws_serve
+except ImportError:  # websockets < 13
+    from websockets import serve as ws_serve
+
+from realtime import SAMPLE_RATE, SAMPLE_WIDTH, SessionManager
+
+
+class FakeRealtimeServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, partial_every_ms: int = 250,
+                 final_every_ms: int = 2000, disconnect_after_ms: int = None):
+        """
+        Local stand-in for the realtime transcription websocket, speaking the same JSON
+        messages: 'SessionBegins', then 'PartialTranscript'/'FinalTranscript' as audio
+        arrives and 'SessionTerminated' after a 'terminate_session' request. The text is one
+        placeholder word per 500 ms of audio, so tests can check what was transcribed.
+
+        :param host: interface to listen on
+        :type host: str
+        :param port: port to listen on, 0 for any free port (see 'url' once started)
+        :type port: int
+        :param partial_every_ms: audio between partial transcripts
+        :type partial_every_ms: int
+        :param final_every_ms: audio per final transcript
+        :type final_every_ms: int
+        :param disconnect_after_ms: abruptly drop every connection after this much audio,
+            to exercise reconnects. Never if None
+        :type disconnect_after_ms: int
+        """
+        self.host = host
+        self.port = port
+        self.partial_every_ms = partial_every_ms
+        self.final_every_ms = final_every_ms
+        self.disconnect_after_ms = disconnect_after_ms
+        self.connections = 0
+        self.audio_ms = 0.0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await ws_serve(self._handle, self.host, self.port)
+        self.port = list(self._server.sockets)[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    @staticmethod
+    def _words(start_ms: float, end_ms: float) -> str:
+        return " ".join(f"w{i}" for i in range(int(start_ms // 500), int(math.ceil(end_ms / 500))))
+
+    async def _handle(self, ws, *args) -> None:
+        self.connections += 1
+        await ws.send(json.dumps({'message_type': 'SessionBegins', 'session_id': uuid.uuid4().hex,
+                                  'expires_at': time.time() + 3600}))
+        received_ms, final_ms, partial_ms = 0.0, 0.0, 0.0
+        async for message in ws:
+            message = json.loads(message)
+            if message.get('terminate_session'):
+                if received_ms > final_ms:
+                    await ws.send(json.dumps(self._transcript('FinalTranscript', final_ms, received_ms)))
+                await ws.send(json.dumps({'message_type': 'SessionTerminated'}))
+                return
+
+            audio = base64.b64decode(message['audio_data'])
+            received_ms += len(audio) / SAMPLE_WIDTH * 1000 / SAMPLE_RATE
+            self.audio_ms += len(audio) / SAMPLE_WIDTH * 1000 / SAMPLE_RATE
+            if self.disconnect_after_ms is not None and received_ms >= self.disconnect_after_ms:
+                # drop the connection without a closing handshake
+                ws.transport.abort() if hasattr(ws, 'transport') else await ws.close(code=1011)
+                return
+            if received_ms - final_ms >= self.final_every_ms:
+                await ws.send(json.dumps(self._transcript('FinalTranscript', final_ms, received_ms)))
+                final_ms = partial_ms = received_ms
+            elif received_ms - partial_ms >= self.partial_every_ms:
+                await ws.send(json.dumps(self._transcript('PartialTranscript', final_ms, received_ms)))
+                partial_ms = received_ms
+
+    def _transcript(self, kind: str, start_ms: float, end_ms: float) -> Dict:
+        return {'message_type': kind, 'audio_start': int(start_ms), 'audio_end': int(end_ms),
+                'text': self._words(start_ms, end_ms), 'confidence': 1.0, 'words': []}
+
+
+async def demo(sessions: int, seconds: float, policy: str, disconnect_after_ms: int, speedup: float) -> Dict:
+    """
+    Streams synthetic audio from several concurrent sessions to a fake server and
+    summarizes the events they published.
+    """
+    server = FakeRealtimeServer(disconnect_after_ms=disconnect_after_ms)
+    await server.start()
+    manager = SessionManager(url=server.url, token="fake", policy=policy, backoff=0.05, buffer_seconds=10)
+    packet = (np.sin(np.arange(SAMPLE_RATE // 10) / 5) * 8000).astype(np.int16).tobytes()  # 100 ms
+
+    async def produce(session_id: str) -> None:
+        session = manager.open(session_id)
+        for _ in range(int(seconds * 10)):
+            await session.feed(packet)
+            await asyncio.sleep(0.1 / speedup)
+        await manager.close(session_id)
+
+    counts, finals = {}, {}
+
+    async def consume() -> None:
+        while True:
+            event = await manager.events.get()
+            counts[event['type']] = counts.get(event['type'], 0) + 1
+            if event['type'] == 'final':
+                finals.setdefault(event['session'], []).append(event)
+
+    consumer = asyncio.create_task(consume())
+    stats = {}
+    start = time.perf_counter()
+    producers = [asyncio.create_task(produce(f"call-{i}")) for i in range(sessions)]
+    # sample the manager's stats while the sessions run
+    await asyncio.sleep(seconds / speedup / 2)
+    stats = manager.stats()
+    await asyncio.gather(*producers)
+    elapsed = time.perf_counter() - start
+    while not manager.events.empty():
+        await asyncio.sleep(0.01)
+    consumer.cancel()
+    await server.stop()
+
+    transcribed = {s: max(e['end_ms'] for e in events) / 1000 for s, events in finals.items()}
+    return {
+        'elapsed_seconds': elapsed,
+        'events': counts,
+        'server_connections': server.connections,
+        'transcribed_seconds': transcribed,
+        'midway_stats': stats,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run realtime sessions against a local fake server")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10.0, help="audio per session")
+    parser.add_argument("--policy", default="block")
+    parser.add_argument("--disconnect-after-ms", type=int, default=None)
+    parser.add_argument("--speedup", type=float, default=10.0, help="audio fed this many times faster than realtime")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(demo(args.sessions, args.seconds, args.policy, args.disconnect_after_ms,
+                                      args.speedup)), indent=2, default=str))
@@ -0,0 +1,409 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Soft type assertions
+from typing import Dict, Iterator, List, Tuple
+from transcribers import Transcriber
+
+SAMPLE_RATE = 16_000
+SAMPLE_WIDTH = 2  # 16-bit PCM
+BLOCK_SECONDS = 10
+
+
+def has_ffmpeg() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def decode_pcm(path: str, sample_rate: int = SAMPLE_RATE, block_seconds: float = BLOCK_SECONDS) -> Iterator[bytes]:
+    """
+    Streams an audio file as 16-bit mono PCM at 'sample_rate', one block at a time, so
+    recordings of any length are never held in memory. Any format ffmpeg reads is decoded,
+    downmixed and resampled by ffmpeg; wav files already in the target format are read
+    directly, without ffmpeg.
+
+    :param path: audio file
+    :type path: str
+    :param sample_rate: output sample rate
+    :type sample_rate: int
+    :param block_seconds: seconds of audio per block
+    :type block_seconds: float
+
+    :return: PCM blocks
+    :rtype: Iterator[bytes]
+    """
+    block_frames = int(sample_rate * block_seconds)
+    if path.lower().endswith(".wav"):
+        with wave.open(path, 'rb') as f:
+            if (f.getnchannels(), f.getsampwidth(), f.getframerate()) == (1, SAMPLE_WIDTH, sample_rate):
+                while True:
+                    block = f.readframes(block_frames)
+                    if not block:
+                        return
+                    yield block
+
+    if not has_ffmpeg():
+        raise RuntimeError(f"ffmpeg is required to decode {path}")
+    # stderr goes to a file rather than a pipe: a pipe nobody reads while stdout is streamed
+    # would block ffmpeg as soon as it filled up, and with it this reader
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path, "-f", "s16le", "-acodec", "pcm_s16le",
+             "-ac", "1", "-ar", str(sample_rate), "-"],
+            stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            while True:
+                block = process.stdout.read(block_frames * SAMPLE_WIDTH)
+                if not block:
+                    break
+                yield block
+        finally:
+            process.stdout.close()
+            if process.wait() != 0:
+                stderr.seek(0)
+                error = stderr.read().decode('utf-8', 'replace')
+                raise RuntimeError(f"ffmpeg failed on {path}: {error.strip()}")
+
+
+class EnergyVAD:
+    def __init__(self, sample_rate: int = SAMPLE_RATE, frame_ms: int = 30, threshold_db: float = -40.0,
+                 padding_ms: int = 300):
+        """
+        Energy-based voice activity detection over a stream of 16-bit mono PCM.
+
+        Frames louder than 'threshold_db' (dBFS) are speech. Speech is kept with
+        'padding_ms' of audio on both sides, so silences shorter than twice the padding are
+        kept whole and longer ones are cut down to the padding.
+
+        :param sample_rate: sample rate of the PCM
+        :type sample_rate: int
+        :param frame_ms: analysis frame length
+        :type frame_ms: int
+        :param threshold_db: frame energy above which it is speech, in dBFS
+        :type threshold_db: float
+        :param padding_ms: audio kept before and after speech
+        :type padding_ms: int
+        """
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.threshold_db = threshold_db
+        self.pad_frames = max(1, padding_ms // frame_ms)
+        self._buffer = b""
+        self._offset = 0  # sample offset of the start of '_buffer' in the stream
+        self._preroll = deque(maxlen=self.pad_frames)
+        self._hangover = 0
+        self.samples_in = 0
+        self.samples_kept = 0
+
+    def process(self, pcm: bytes) -> Iterator[Tuple[int, bytes]]:
+        """
+        Feeds PCM and returns the audio to keep so far.
+
+        :param pcm: 16-bit mono PCM, any length
+        :type pcm: bytes
+
+        :return: (sample offset in the stream, PCM) runs of kept audio, in order
+        :rtype: Iterator[Tuple[int, bytes]]
+        """
+        self._buffer += pcm
+        frame_bytes = self.frame_samples * SAMPLE_WIDTH
+        n_frames = len(self._buffer) // frame_bytes
+        if not n_frames:
+            return
+        frames = np.frombuffer(self._buffer[:n_frames * frame_bytes], dtype=np.int16)
+        frames = frames.reshape(n_frames, self.frame_samples).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1)) / 32768.0
+        speech = 20 * np.log10(rms + 1e-10) > self.threshold_db
+
+        for i, is_speech in enumerate(speech):
+            frame = (self._offset + i * self.frame_samples, self._buffer[i * frame_bytes:(i + 1) * frame_bytes])
+            if is_speech:
+                while self._preroll:
+                    yield self._keep(self._preroll.popleft())
+                yield self._keep(frame)
+                self._hangover = self.pad_frames
+            elif self._hangover:
+                yield self._keep(frame)
+                self._hangover -= 1
+            else:
+                # frames pushed out of the pre-roll are the silence that gets removed
+                self._preroll.append(frame)
+
+        self.samples_in += n_frames * self.frame_samples
+        self._offset += n_frames * self.frame_samples
+        self._buffer = self._buffer[n_frames * frame_bytes:]
+
+    def flush(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        Returns the trailing partial frame, if it follows speech. Call at the end of the stream.
+        """
+        if self._buffer and self._hangover:
+            yield self._keep((self._offset, self._buffer))
+        self.samples_in += len(self._buffer) // SAMPLE_WIDTH
+        self._buffer = b""
+
+    def _keep(self, frame: Tuple[int, bytes]) -> Tuple[int, bytes]:
+        self.samples_kept += len(frame[1]) // SAMPLE_WIDTH
+        return frame
+
+
+def iter_chunks(pcm_blocks: Iterator[bytes], vad: EnergyVAD = None, sample_rate: int = SAMPLE_RATE,
+                chunk_seconds: float = 300.0, overlap_seconds: float = 2.0) -> Iterator[Dict]:
+    """
+    Cuts a PCM stream, with silence removed by 'vad' (if given), into chunks of
+    'chunk_seconds' that overlap by 'overlap_seconds'. Chunks are yielded as soon as they
+    are full, so they can be transcribed while the rest of the file is still decoding.
+
+    :param pcm_blocks: 16-bit mono PCM blocks, e.g. from 'decode_pcm'
+    :type pcm_blocks: Iterator[bytes]
+    :param vad: silence remover, None to keep all audio
+    :type vad: EnergyVAD
+    :param sample_rate: sample rate of the PCM
+    :type sample_rate: int
+    :param chunk_seconds: chunk length
+    :type chunk_seconds: float
+    :param overlap_seconds: audio repeated at the start of the next chunk
+    :type overlap_seconds: float
+
+    :return: {'index', 'start' (sample offset in the kept audio), 'pcm', 'segments'}, where
+        'segments' maps the chunk back to the original recording: (sample offset in the
+        chunk, sample offset in the original, number of samples) per contiguous run
+    :rtype: Iterator[Dict]
+    """
+    chunk_samples = int(chunk_seconds * sample_rate)
+    overlap_samples = min(int(overlap_seconds * sample_rate), chunk_samples // 2)
+    pcm, segments = bytearray(), []
+    start, index = 0, 0
+
+    def kept() -> Iterator[Tuple[int, bytes]]:
+        offset = 0
+        for block in pcm_blocks:
+            if vad is None:
+                yield offset, block
+                offset += len(block) // SAMPLE_WIDTH
+            else:
+                yield from vad.process(block)
+        if vad is not None:
+            yield from vad.flush()
+
+    def append(original: int, data: bytes) -> None:
+        position, n = len(pcm) // SAMPLE_WIDTH, len(data) // SAMPLE_WIDTH
+        if segments and segments[-1][0] + segments[-1][2] == position and segments[-1][1] + segments[-1][2] == original:
+            segments[-1] = (segments[-1][0], segments[-1][1], segments[-1][2] + n)
+        else:
+            segments.append((position, original, n))
+        pcm.extend(data)
+
+    for original, data in kept():
+        while data:
+            room = (chunk_samples - len(pcm) // SAMPLE_WIDTH) * SAMPLE_WIDTH
+            append(original, data[:room])
+            original += len(data[:room]) // SAMPLE_WIDTH
+            data = data[room:]
+            if len(pcm) // SAMPLE_WIDTH >= chunk_samples:
+                yield {'index': index, 'start': start, 'pcm': bytes(pcm), 'segments': list(segments)}
+                # the next chunk starts with the tail of this one
+                tail = chunk_samples - overlap_samples
+                carried = [(max(0, o - tail), orig + max(0, tail - o), n - max(0, tail - o))
+                           for o, orig, n in segments if o + n > tail]
+                pcm, segments = bytearray(pcm[tail * SAMPLE_WIDTH:]), carried
+                start += tail
+                index += 1
+
+    if len(pcm) > (overlap_samples * SAMPLE_WIDTH if index else 0):
+        yield {'index': index, 'start': start, 'pcm': bytes(pcm), 'segments': list(segments)}
+
+
+def to_original_ms(segments: List[Tuple[int, int, int]], ms: float, sample_rate: int = SAMPLE_RATE) -> int:
+    """
+    Maps a time within a chunk to the time in the original recording.
+
+    :param segments: chunk segments, see 'iter_chunks'
+    :type segments: List[Tuple[int, int, int]]
+    :param ms: milliseconds from the start of the chunk
+    :type ms: float
+
+    :return: milliseconds from the start of the original recording
+    :rtype: int
+    """
+    sample = int(ms * sample_rate / 1000)
+    for offset, original, n in segments:
+        if sample < offset + n:
+            return int((original + max(0, sample - offset)) * 1000 / sample_rate)
+    offset, original, n = segments[-1]
+    return int((original + sample - offset) * 1000 / sample_rate)
+
+
+# ffmpeg output options and file extension of every upload encoding. opus and mp3 are lossy
+# but made for speech at these bitrates, several times smaller than flac
+ENCODINGS = {
+    'opus': (["-c:a", "libopus", "-b:a", "24k", "-application", "voip"], ".ogg"),
+    'mp3': (["-c:a", "libmp3lame", "-b:a", "32k"], ".mp3"),
+    'flac': (["-c:a", "flac"], ".flac"),
+}
+
+
+def write_chunk(pcm: bytes, path: str, sample_rate: int = SAMPLE_RATE, encoding: str = "wav") -> str:
+    """
+    Saves a chunk for upload, as 16 kHz mono wav or, with ffmpeg, encoded as 'opus', 'mp3'
+    or lossless 'flac' (see 'ENCODINGS').
+
+    :return: path of the written file
+    :rtype: str
+    """
+    if encoding in ENCODINGS:
+        options, extension = ENCODINGS[encoding]
+        path = os.path.splitext(path)[0] + extension
+        # 'run' writes stdin and reads stderr together, so a verbose ffmpeg cannot deadlock it
+        process = subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-f", "s16le",
+                                  "-ar", str(sample_rate), "-ac", "1", "-i", "-", *options, path],
+                                 input=pcm, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {path}: "
+                               f"{process.stderr.decode('utf-8', 'replace').strip()}")
+        return path
+    if encoding != "wav":
+        raise ValueError(f"Unknown encoding '{encoding}', expected 'wav' or one of {sorted(ENCODINGS)}")
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(SAMPLE_WIDTH)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm)
+    return path
+
+
+def stitch(chunks: List[Dict], results: List[Dict], sample_rate: int = SAMPLE_RATE) -> List[Dict]:
+    """
+    Merges the words of overlapping chunk transcripts on the original recording's timeline.
+    Within an overlap, words before its midpoint come from the earlier chunk and the rest
+    from the later one, so nothing is repeated or lost.
+
+    :param chunks: chunks from 'iter_chunks', in order (their 'pcm' may have been dropped)
+    :type chunks: List[Dict]
+    :param results: transcript of each chunk, with chunk-relative word times in ms
+    :type results: List[Dict]
+
+    :return: words with times in ms of the original recording
+    :rtype: List[Dict]
+    """
+    words = []
+    for k, (chunk, result) in enumerate(zip(chunks, results)):
+        # cut points, in ms from the start of this chunk
+        low = (chunks[k - 1]['end'] - chunk['start']) / 2 * 1000 / sample_rate if k else float('-inf')
+        high = ((chunk['end'] + chunks[k + 1]['start']) / 2 - chunk['start']) * 1000 / sample_rate \
+            if k + 1 < len(chunks) else float('inf')
+        for word in result.get('words') or []:
+            if low <= word['start'] < high:
+                words.append({**word,
+                              'start': to_original_ms(chunk['segments'], word['start'], sample_rate),
+                              'end': to_original_ms(chunk['segments'], word['end'], sample_rate)})
+    return words
+
+
+class PreprocessingTranscriber(Transcriber):
+    def __init__(self, transcriber: Transcriber, vad: bool = True, threshold_db: float = -40.0,
+                 padding_ms: int = 300, chunk_seconds: float = 300.0, overlap_seconds: float = 2.0,
+                 parallel_chunks: int = 4, encoding: str = None):
+        """
+        Wraps a transcriber so recordings are decoded to 16 kHz mono, stripped of silence,
+        cut into overlapping chunks transcribed in parallel, and stitched back with
+        timestamps of the original recording. Only speech is uploaded and billed.
+
+        :param transcriber: backend transcribing the chunks
+        :type transcriber: Transcriber
+        :param vad: remove silence, see 'EnergyVAD'
+        :type vad: bool
+        :param threshold_db: speech energy threshold in dBFS
+        :type threshold_db: float
+        :param padding_ms: audio kept around speech
+        :type padding_ms: int
+        :param chunk_seconds: chunk length
+        :type chunk_seconds: float
+        :param overlap_seconds: overlap between consecutive chunks
+        :type overlap_seconds: float
+        :param parallel_chunks: chunks of one recording transcribed at once
+        :type parallel_chunks: int
+        :param encoding: upload format of the chunks, 'opus', 'mp3', 'flac' or 'wav'. Defaults
+            to opus when ffmpeg is available. A recording that fits in one chunk is uploaded as
+            it is instead when that is smaller, e.g. an already compressed short recording
+        :type encoding: str
+        """
+        self.transcriber = transcriber
+        self.name = "preprocess+" + (transcriber.name or "")
+        self.vad = vad
+        self.threshold_db = threshold_db
+        self.padding_ms = padding_ms
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.parallel_chunks = parallel_chunks
+        self.encoding = encoding or ("opus" if has_ffmpeg() else "wav")
+
+    def transcribe(self, path: str) -> Dict:
+        vad = EnergyVAD(threshold_db=self.threshold_db, padding_ms=self.padding_ms) if self.vad else None
+        samples_in = 0
+
+        def counted(blocks: Iterator[bytes]) -> Iterator[bytes]:
+            nonlocal samples_in
+            for block in blocks:
+                samples_in += len(block) // SAMPLE_WIDTH
+                yield block
+
+        input_bytes = os.path.getsize(path)
+        chunks, chunk_paths, futures, upload_bytes, upload_samples = [], [], [], 0, 0
+        original = False
+        with tempfile.TemporaryDirectory(prefix="stt-chunks-") as tmp, \
+                ThreadPoolExecutor(max_workers=self.parallel_chunks) as pool:
+            for chunk in iter_chunks(counted(decode_pcm(path)), vad, chunk_seconds=self.chunk_seconds,
+                                     overlap_seconds=self.overlap_seconds):
+                pcm = chunk.pop('pcm')
+                chunk_path = write_chunk(pcm, os.path.join(tmp, f"chunk-{chunk['index']:05d}.wav"),
+                                         encoding=self.encoding)
+                upload_bytes += os.path.getsize(chunk_path)
+                upload_samples += len(pcm) // SAMPLE_WIDTH
+                chunk['end'] = chunk['start'] + len(pcm) // SAMPLE_WIDTH
+                chunks.append(chunk)
+                chunk_paths.append(chunk_path)
+                # the first chunk waits until a second one shows the recording needs chunking
+                if len(chunk_paths) > 1:
+                    futures.extend(pool.submit(self.transcriber.transcribe, p) for p in chunk_paths[len(futures):])
+            if len(chunk_paths) == 1 and upload_bytes >= input_bytes:
+                # re-encoding made it bigger: the recording itself is the smaller upload
+                original = True
+                futures = [pool.submit(self.transcriber.transcribe, path)]
+            else:
+                futures.extend(pool.submit(self.transcriber.transcribe, p) for p in chunk_paths[len(futures):])
+            # the first failed chunk fails the recording (and is retried by the batch runner)
+            results = [future.result() for future in futures]
+
+        audio_seconds = samples_in / SAMPLE_RATE
+        speech_seconds = (vad.samples_kept if vad else samples_in) / SAMPLE_RATE
+        if original:
+            # already on the timeline of the recording
+            words = results[0].get('words') or []
+            upload_bytes, upload_seconds = input_bytes, audio_seconds
+        else:
+            words = stitch(chunks, results)
+            # chunk overlaps are uploaded twice
+            upload_seconds = upload_samples / SAMPLE_RATE
+        return {
+            'text': " ".join(w['text'] for w in words) if words else " ".join(r['text'] or "" for r in results),
+            'audio_duration': audio_seconds,
+            'transcript_id': ",".join(str(r.get('transcript_id')) for r in results),
+            'words': words,
+            'preprocessing': {
+                'chunks': len(chunks),
+                'uploaded_original': original,
+                'input_bytes': input_bytes,
+                'upload_bytes': upload_bytes,
+                'bytes_saved': input_bytes - upload_bytes,
+                'audio_seconds': audio_seconds,
+                'speech_seconds': speech_seconds,
+                'upload_seconds': upload_seconds,
+                'seconds_saved': audio_seconds - upload_seconds,
+            },
+        }
@@ -0,0 +1,364 @@
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+
+# Soft type assertions
+from typing import Dict, Tuple
+
+try:
+    from websockets.asyncio.client import connect as ws_connect
+    HEADERS_KWARG = "additional_headers"
+except ImportError:  # websockets < 13
+    from websockets import connect as ws_connect
+    HEADERS_KWARG = "extra_headers"
+
+REALTIME_URL = "wss://api.assemblyai.com/v2/realtime/ws"
+SAMPLE_RATE = 16_000
+SAMPLE_WIDTH = 2  # 16-bit PCM
+POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, policy: str = "block"):
+        """
+        Bounded audio buffer between a producer (microphone, call leg) and a websocket sender.
+
+        Audio stays buffered after it is sent until the service acknowledges it with a final
+        transcript, so a reconnect can resend everything not yet transcribed. Positions are
+        byte offsets in the stream. When the unacknowledged audio reaches 'capacity':
+          - 'block' makes the producer wait (backpressure),
+          - 'drop_oldest' discards the oldest audio, even if not transcribed yet,
+          - 'drop_newest' discards the incoming audio.
+
+        :param capacity: maximum buffered bytes
+        :type capacity: int
+        :param policy: one of 'POLICIES'
+        :type policy: str
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', expected one of {list(POLICIES)}")
+        self.capacity = capacity
+        self.policy = policy
+        self._data = bytearray()
+        self.start = 0  # position of the oldest buffered byte
+        self.sent = 0  # position up to which audio was handed to the sender
+        self.dropped = 0
+        self.closed = False
+        self._changed = asyncio.Condition()
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def write(self, data: bytes) -> int:
+        """
+        Appends audio, applying the overflow policy.
+
+        :return: bytes accepted
+        :rtype: int
+        """
+        async with self._changed:
+            if self.closed:
+                raise RuntimeError("Buffer is closed")
+            if self.policy == "block":
+                accepted = 0
+                while accepted < len(data):
+                    await self._changed.wait_for(lambda: len(self._data) < self.capacity or self.closed)
+                    if self.closed:
+                        break
+                    room = self.capacity - len(self._data)
+                    self._data += data[accepted:accepted + room]
+                    accepted += min(room, len(data) - accepted)
+                    self._changed.notify_all()
+                return accepted
+
+            if self.policy == "drop_newest":
+                room = max(0, self.capacity - len(self._data))
+                self.dropped += max(0, len(data) - room)
+                data = data[:room]
+            self._data += data
+            overflow = len(self._data) - self.capacity
+            if overflow > 0:
+                # drop_oldest
+                del self._data[:overflow]
+                self.start += overflow
+                self.sent = max(self.sent, self.start)
+                self.dropped += overflow
+            self._changed.notify_all()
+            return len(data)
+
+    async def read(self, max_bytes: int) -> Tuple[int, bytes]:
+        """
+        Waits for audio not yet sent and marks it sent.
+
+        :return: (position, audio), empty audio once the buffer is closed and drained
+        :rtype: Tuple[int, bytes]
+        """
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.end > self.sent or self.closed)
+            position = self.sent
+            offset = position - self.start
+            data = bytes(self._data[offset:offset + max_bytes])
+            self.sent += len(data)
+            return position, data
+
+    async def ack(self, position: int) -> None:
+        """
+        Releases the audio before 'position', which the service has transcribed for good.
+        """
+        async with self._changed:
+            position = min(max(position, self.start), self.sent)
+            del self._data[:position - self.start]
+            self.start = position
+            self._changed.notify_all()
+
+    async def rewind(self) -> int:
+        """
+        Makes every unacknowledged byte pending again, to resend it after a reconnect.
+
+        :return: the position sending resumes from
+        :rtype: int
+        """
+        async with self._changed:
+            self.sent = self.start
+            self._changed.notify_all()
+            return self.start
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+
+class RealtimeSession:
+    def __init__(self,
+                 session_id: str,
+                 events: asyncio.Queue,
+                 url: str = REALTIME_URL,
+                 token: str = None,
+                 sample_rate: int = SAMPLE_RATE,
+                 buffer_seconds: float = 30.0,
+                 policy: str = "block",
+                 packet_ms: int = 100,
+                 max_reconnects: int = 5,
+                 backoff: float = 0.5):
+        """
+        One realtime transcription stream. Audio passed to 'feed' is buffered and sent by a
+        background task; transcripts are published on 'events' instead of callbacks. If the
+        connection drops, the session reconnects with backoff and resends the audio that was
+        not finally transcribed yet, with event times kept on the stream's own timeline.
+
+        :param session_id: name of the stream, copied into its events
+        :type session_id: str
+        :param events: queue receiving the events of the session
+        :type events: asyncio.Queue
+        :param url: realtime websocket endpoint
+        :type url: str
+        :param token: API key, defaults to the ASSEMBLYAI_API_KEY environment variable
+        :type token: str
+        :param sample_rate: sample rate of the 16-bit mono PCM fed in
+        :type sample_rate: int
+        :param buffer_seconds: audio buffered at most, see 'RingBuffer'
+        :type buffer_seconds: float
+        :param policy: overflow policy of the buffer, see 'RingBuffer'
+        :type policy: str
+        :param packet_ms: audio per websocket message
+        :type packet_ms: int
+        :param max_reconnects: consecutive failed connections before giving up
+        :type max_reconnects: int
+        :param backoff: seconds before the first reconnect, doubled on each further one
+        :type backoff: float
+        """
+        self.session_id = session_id
+        self.events = events
+        self.url = url
+        self.token = token or os.environ.get("ASSEMBLYAI_API_KEY")
+        self.sample_rate = sample_rate
+        self.buffer = RingBuffer(int(buffer_seconds * sample_rate) * SAMPLE_WIDTH, policy)
+        self.packet_bytes = sample_rate * packet_ms // 1000 * SAMPLE_WIDTH
+        self.max_reconnects = max_reconnects
+        self.backoff = backoff
+
+        self.connections = 0
+        self.reconnects = 0
+        self.bytes_sent = 0
+        self.finals = 0
+        self.opened = time.time()
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def feed(self, pcm: bytes) -> int:
+        """
+        Queues audio for transcription. With the 'block' policy this waits while the buffer
+        is full, slowing the producer down to what the connection sustains.
+
+        :return: bytes accepted
+        :rtype: int
+        """
+        return await self.buffer.write(pcm)
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """
+        Ends the audio stream, waits (up to 'timeout') for its last transcripts and closes.
+        """
+        await self.buffer.close()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+
+    def _ms(self, position: int) -> float:
+        return position / SAMPLE_WIDTH * 1000 / self.sample_rate
+
+    def _position(self, ms: float) -> int:
+        return int(ms * self.sample_rate / 1000) * SAMPLE_WIDTH
+
+    async def _publish(self, kind: str, **fields) -> None:
+        await self.events.put({'session': self.session_id, 'type': kind, 'time': time.time(), **fields})
+
+    async def _run(self) -> None:
+        failures = 0
+        while True:
+            base = await self.buffer.rewind()
+            try:
+                url = f"{self.url}?sample_rate={self.sample_rate}"
+                headers = {"Authorization": self.token} if self.token else {}
+                async with ws_connect(url, **{HEADERS_KWARG: headers}) as ws:
+                    self.connections += 1
+                    failures = 0
+                    finished = await self._stream(ws, base)
+                    if finished:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                await self._publish('error', error=repr(e))
+            if failures > self.max_reconnects:
+                # producers get an error instead of blocking forever
+                await self.buffer.close()
+                await self._publish('closed', reason="too many failed connections", dropped_bytes=self.buffer.dropped)
+                return
+            self.reconnects += 1
+            delay = self.backoff * 2 ** max(0, failures - 1) * random.uniform(0.5, 1.0)
+            await self._publish('reconnecting', delay=delay, resume_ms=self._ms(self.buffer.start))
+            await asyncio.sleep(delay)
+        await self._publish('closed', reason="finished", dropped_bytes=self.buffer.dropped)
+
+    async def _stream(self, ws, base: int) -> bool:
+        """
+        Runs one connection: sends buffered audio and handles transcripts until the stream
+        ends (True) or the connection breaks (exception).
+        """
+        sender = asyncio.create_task(self._send(ws))
+        try:
+            async for message in ws:
+                message = json.loads(message)
+                kind = message.get('message_type')
+                if kind == 'SessionBegins':
+                    await self._publish('opened', remote_id=message.get('session_id'), resume_ms=self._ms(base))
+                elif kind in ('PartialTranscript', 'FinalTranscript'):
+                    if not message.get('text') and kind == 'PartialTranscript':
+                        continue
+                    # times are relative to this connection's audio, which starts at 'base'
+                    start_ms = self._ms(base) + message.get('audio_start', 0)
+                    end_ms = self._ms(base) + message.get('audio_end', 0)
+                    final = kind == 'FinalTranscript'
+                    await self._publish('final' if final else 'partial', text=message.get('text', ""),
+                                        start_ms=start_ms, end_ms=end_ms)
+                    if final:
+                        self.finals += 1
+                        await self.buffer.ack(base + self._position(message.get('audio_end', 0)))
+                elif kind == 'SessionTerminated':
+                    return True
+                elif 'error' in message:
+                    raise ConnectionError(message['error'])
+            if sender.done() and sender.exception() is None:
+                return True
+            raise ConnectionError("connection closed by the server")
+        finally:
+            sender.cancel()
+
+    async def _send(self, ws) -> None:
+        while True:
+            _, data = await self.buffer.read(self.packet_bytes)
+            if not data:
+                # closed and drained
+                await ws.send(json.dumps({'terminate_session': True}))
+                return
+            await ws.send(json.dumps({'audio_data': base64.b64encode(data).decode('ascii')}))
+            self.bytes_sent += len(data)
+
+    def stats(self) -> Dict:
+        return {
+            'buffered_bytes': len(self.buffer),
+            'dropped_bytes': self.buffer.dropped,
+            'sent_bytes': self.bytes_sent,
+            'acked_seconds': self._ms(self.buffer.start) / 1000,
+            'connections': self.connections,
+            'reconnects': self.reconnects,
+            'finals': self.finals,
+            'policy': self.buffer.policy,
+        }
+
+
+class SessionManager:
+    def __init__(self, url: str = REALTIME_URL, token: str = None, max_sessions: int = 100, max_events: int = 10000,
+                 **session_params):
+        """
+        Runs many realtime sessions on one event loop, publishing all their transcripts on
+        a single bounded queue ('events'). A slow consumer of the queue slows the sessions
+        down rather than growing memory.
+
+        :param url: realtime websocket endpoint
+        :type url: str
+        :param token: API key, defaults to the ASSEMBLYAI_API_KEY environment variable
+        :type token: str
+        :param max_sessions: concurrent sessions allowed
+        :type max_sessions: int
+        :param max_events: capacity of the event queue
+        :type max_events: int
+        :param session_params: keyword arguments of every 'RealtimeSession'
+        """
+        self.url = url
+        self.token = token
+        self.max_sessions = max_sessions
+        self.session_params = session_params
+        self.events = asyncio.Queue(maxsize=max_events)
+        self.sessions = {}
+
+    def open(self, session_id: str, **params) -> RealtimeSession:
+        """
+        Starts a session. 'params' override the manager's session parameters.
+        """
+        if session_id in self.sessions:
+            raise ValueError(f"Session '{session_id}' is already open")
+        if len(self.sessions) >= self.max_sessions:
+            raise RuntimeError(f"Too many sessions ({self.max_sessions})")
+        session = RealtimeSession(session_id, self.events, url=self.url, token=self.token,
+                                  **{**self.session_params, **params})
+        self.sessions[session_id] = session
+        session.start()
+        return session
+
+    async def close(self, session_id: str) -> None:
+        session = self.sessions.pop(session_id)
+        await session.close()
+
+    async def close_all(self) -> None:
+        await asyncio.gather(*(self.close(session_id) for session_id in list(self.sessions)))
+
+    def stats(self) -> Dict:
+        return {
+            'sessions': {session_id: session.stats() for session_id, session in self.sessions.items()},
+            'queued_events': self.events.qsize(),
+        }
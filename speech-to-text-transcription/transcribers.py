@@ -0,0 +1,160 @@
+import hashlib
+import os
+import random
+import time
+import wave
+
+# Soft type assertions
+from typing import Dict
+
+# words per second of speech produced by the local stand-in
+WORDS_PER_SECOND = 2.5
+# bitrate assumed for compressed audio when estimating its duration from the file size
+COMPRESSED_BITRATE = 128_000
+VOCABULARY = ("the patient infection control hand hygiene prevention ward staff should wear gloves and "
+              "masks when entering isolation rooms clean surfaces every day report symptoms early").split()
+
+
+class TranscriptionError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        """
+        Failed transcription. 'retryable' tells batch runners whether another attempt can
+        succeed (rate limits, timeouts) or not (unsupported audio, rejected request).
+        """
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class Transcriber:
+    """
+    Interface of the transcription backends. 'transcribe' is blocking and must be safe to
+    call from several threads at once.
+    """
+    name = None
+
+    def transcribe(self, path: str) -> Dict:
+        """
+        Transcribes one audio file.
+
+        :param path: local audio file or URL
+        :type path: str
+
+        :return: 'text', 'audio_duration' (seconds), 'transcript_id' and 'words', a list of
+            {'text', 'start', 'end', 'confidence'} with times in milliseconds
+        :rtype: Dict
+        """
+        raise NotImplementedError
+
+
+class AssemblyAITranscriber(Transcriber):
+    name = "assemblyai"
+
+    def __init__(self, api_key: str = None):
+        """
+        Transcription with the AssemblyAI API.
+
+        :param api_key: API key, defaults to the ASSEMBLYAI_API_KEY environment variable
+        :type api_key: str
+        """
+        import assemblyai as aai
+
+        self.aai = aai
+        aai.settings.api_key = api_key or os.environ["ASSEMBLYAI_API_KEY"]
+        self.transcriber = aai.Transcriber()
+
+    def transcribe(self, path: str) -> Dict:
+        try:
+            transcript = self.transcriber.transcribe(path)
+        except Exception as e:
+            # network errors, timeouts and rate limits
+            raise TranscriptionError(repr(e), retryable=True) from e
+        if transcript.status == self.aai.TranscriptStatus.error:
+            raise TranscriptionError(transcript.error or "transcription failed", retryable=False)
+        return {
+            'text': transcript.text,
+            'audio_duration': transcript.audio_duration,
+            'transcript_id': transcript.id,
+            'words': [{'text': w.text, 'start': w.start, 'end': w.end, 'confidence': w.confidence}
+                      for w in transcript.words or []],
+        }
+
+
+def audio_duration(path: str) -> float:
+    """
+    Duration of a wav file, or an estimate from the file size for compressed formats.
+
+    :param path: local audio file
+    :type path: str
+
+    :return: seconds
+    :rtype: float
+    """
+    if path.lower().endswith(".wav"):
+        with wave.open(path, 'rb') as f:
+            return f.getnframes() / f.getframerate()
+    return os.path.getsize(path) * 8 / COMPRESSED_BITRATE
+
+
+class LocalTranscriber(Transcriber):
+    name = "local"
+
+    def __init__(self, realtime_factor: float = 0.01, latency: float = 0.05, failure_rate: float = 0.0,
+                 seed: int = 0):
+        """
+        Offline stand-in for a transcription API, to test and benchmark batch runs without
+        network or cost. It sleeps like a remote service would and returns deterministic
+        placeholder words with timestamps spread over the audio duration.
+
+        :param realtime_factor: processing seconds per second of audio
+        :type realtime_factor: float
+        :param latency: fixed seconds per request
+        :type latency: float
+        :param failure_rate: probability of a retryable failure per request
+        :type failure_rate: float
+        :param seed: seed of the failure injection
+        :type seed: int
+        """
+        self.realtime_factor = realtime_factor
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def transcribe(self, path: str) -> Dict:
+        duration = audio_duration(path)
+        time.sleep(self.latency + duration * self.realtime_factor)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise TranscriptionError(f"injected failure for {path}", retryable=True)
+
+        digest = hashlib.sha1(os.path.basename(path).encode('utf-8')).digest()
+        n_words = int(duration * WORDS_PER_SECOND)
+        step = 1000 / WORDS_PER_SECOND
+        words = [{'text': VOCABULARY[(digest[i % len(digest)] + i) % len(VOCABULARY)],
+                  'start': int(i * step), 'end': int((i + 0.8) * step), 'confidence': 1.0}
+                 for i in range(n_words)]
+        return {
+            'text': " ".join(w['text'] for w in words),
+            'audio_duration': duration,
+            'transcript_id': "local-" + digest.hex()[:16],
+            'words': words,
+        }
+
+
+TRANSCRIBERS = {
+    AssemblyAITranscriber.name: AssemblyAITranscriber,
+    LocalTranscriber.name: LocalTranscriber,
+}
+
+
+def get_transcriber(name: str, **params) -> Transcriber:
+    """
+    Creates a transcription backend by name.
+
+    :param name: one of 'TRANSCRIBERS'
+    :type name: str
+    :param params: backend arguments
+
+    :rtype: Transcriber
+    """
+    if name not in TRANSCRIBERS:
+        raise ValueError(f"Unknown transcriber '{name}', expected one of {list(TRANSCRIBERS)}")
+    return TRANSCRIBERS[name](**params)
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from main import PROFILES, summarize_batch
+
+# SUMMARIZER_QUEUE_SIZE bounds the number of jobs waiting to run; further submissions get a 503
+QUEUE_SIZE = int(os.environ.get("SUMMARIZER_QUEUE_SIZE", 16))
+# SUMMARIZER_BATCH_SIZE is the number of documents per batched generate call
+BATCH_SIZE = int(os.environ.get("SUMMARIZER_BATCH_SIZE", 16))
+# SUMMARIZER_PROFILE is the default speed profile of jobs, see 'PROFILES' in main.py
+PROFILE = os.environ.get("SUMMARIZER_PROFILE", "default")
+# SUMMARIZER_KEEP_JOBS is the number of finished jobs kept for retrieval, oldest dropped first
+KEEP_JOBS = int(os.environ.get("SUMMARIZER_KEEP_JOBS", 100))
+
+app = FastAPI()
+
+
+class Job:
+    def __init__(self, documents: list, min_length: int, max_length: int, profile: str):
+        """
+        A bulk summarization request and its results so far. Only touched from the event loop.
+        """
+        self.id = uuid.uuid4().hex
+        self.documents = documents
+        self.min_length = min_length
+        self.max_length = max_length
+        self.profile = profile
+        self.status = "queued"
+        self.error = None
+        self.results = []  # {'index': ..., 'summary': ...}, in completion order
+        self.batches = 0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.updated = asyncio.Event()
+
+    def notify(self) -> None:
+        # wake up current streamers, later ones wait on a fresh event
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def summary(self) -> dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'profile': self.profile,
+            'documents': len(self.documents),
+            'completed': len(self.results),
+            'batches': self.batches,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+jobs = OrderedDict()  # job id -> Job
+queue = None
+# the model runs on a single thread; batching, not concurrency, gives the throughput
+executor = ThreadPoolExecutor(max_workers=1)
+
+
+async def run_jobs() -> None:
+    """
+    Runs queued jobs one after the other, publishing the results of every batch as it finishes.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await queue.get()
+        job.status = "running"
+        job.started = time.time()
+        job.notify()
+        batches = summarize_batch(job.documents, job.min_length, job.max_length, batch_size=BATCH_SIZE,
+                                  profile=job.profile)
+        try:
+            while True:
+                # one batch per executor call, so results are streamed between batches
+                batch = await loop.run_in_executor(executor, next, batches, None)
+                if batch is None:
+                    break
+                job.results.extend({'index': i, 'summary': summary} for i, summary in batch)
+                job.batches += 1
+                job.notify()
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = repr(e)
+        job.finished = time.time()
+        job.notify()
+        queue.task_done()
+        forget_finished_jobs()
+
+
+def forget_finished_jobs() -> None:
+    finished = [job_id for job_id, job in jobs.items() if job.status in ("done", "failed")]
+    for job_id in finished[:max(0, len(finished) - KEEP_JOBS)]:
+        del jobs[job_id]
+
+
+def get_job(job_id: str) -> Job:
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return jobs[job_id]
+
+
+@app.on_event("startup")
+async def start_worker():
+    global queue
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    asyncio.create_task(run_jobs())
+
+
+@app.post("/jobs")
+async def submit_job(data: Request):
+    """
+    Fastapi POST method that queues a bulk summarization job.
+
+    Args:
+      data(`dict`): One field required 'documents' (`list` of `str`).
+        Optional 'min_length' (`int`, default 30) and 'max_length'
+        (`int`, default 150) of each summary, and the speed 'profile'
+        (`str`, default SUMMARIZER_PROFILE).
+
+    Returns:
+      The 'job_id' to poll ('/jobs/{job_id}') or stream ('/jobs/{job_id}/stream').
+      A 503 is returned while the queue is full.
+    """
+    data = await data.json()
+    documents = data['documents']
+    if not isinstance(documents, list) or not all(isinstance(d, str) for d in documents):
+        raise HTTPException(status_code=400, detail="'documents' must be a list of strings")
+    profile = data.get('profile', PROFILE)
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile '{profile}', expected one of {list(PROFILES)}")
+    job = Job(documents, int(data.get('min_length', 30)), int(data.get('max_length', 150)), profile)
+    try:
+        queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later")
+    jobs[job.id] = job
+    return {'job_id': job.id, 'queued': queue.qsize()}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """
+    Fastapi GET method with a job's status and the summaries finished so far.
+    """
+    job = get_job(job_id)
+    return {**job.summary(), 'results': job.results}
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str):
+    """
+    Fastapi GET method streaming a job's summaries as newline-delimited JSON, one line
+    per document as soon as its batch finishes, then a final line with the job status.
+    """
+    job = get_job(job_id)
+
+    async def lines():
+        sent = 0
+        while True:
+            updated = job.updated
+            while sent < len(job.results):
+                yield json.dumps(job.results[sent]) + "\n"
+                sent += 1
+            if job.status in ("done", "failed"):
+                yield json.dumps(job.summary()) + "\n"
+                return
+            await updated.wait()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs")
+async def list_jobs():
+    """
+    Fastapi GET method with the queue length and every known job's status.
+    """
+    return {'queued': queue.qsize(), 'queue_size': QUEUE_SIZE, 'jobs': [job.summary() for job in jobs.values()]}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,5 +1,25 @@
+import threading
+from contextlib import closing
+
 import streamlit as st
-from main import summarizer_bart
+from main import summarizer_bart, warm_up
+from registry import registry
+
+
+@st.cache_resource
+def load_models():
+    """
+    Loads both models once per server process; every session and rerun reuses them.
+    """
+    warm_up()
+    return registry
+
+
+# display name -> summarizer_bart method
+MODELS = {
+    'bart-large-cnn-samsum (pipeline)': 'pipeline_summarizer',
+    'bart-large-cnn (tokenizing)': 'tokenizing_summarizer',
+}
 
 st.title('Text summarizer based on BART :robot_face:')
 
@@ -33,32 +53,75 @@ evolve, its impact on customer engagement is expected to grow even further, shap
 of business-customer relationships.
 """
 
+with st.spinner("Loading models..."):
+    load_models()
+
 text = st.text_area('Input text', value=text_block, height=300)
 min_length = st.slider('Minimum word length', 15, 30, 20)
 max_length = st.slider('Maximum word length', 30, 300, 150)
+models = st.multiselect('Models', list(MODELS), default=list(MODELS),
+                        help="Without streaming, selected models run concurrently")
+timeout = st.number_input('Timeout per model (seconds, 0 for none)', min_value=0, value=0, step=10)
+stream = st.checkbox('Stream the summaries as they are generated (greedy decoding, lower quality)', value=False,
+                     help="Streaming cannot use beam search: summaries are decoded greedily, and models run one "
+                          "after the other. Changing an input or pressing Stop interrupts the generation")
 
 # On click of the button, start the summarization process
-if st.button("Summarize"):
+if st.button("Summarize", disabled=not models):
+
+    sb = summarizer_bart(text=text,
+                         min_length=min_length,
+                         max_length=max_length)
+
+    if stream:
+        # any rerun (Stop, or a changed input) aborts this script run, which closes the stream and
+        # stops the generation at its next token
+        st.button("Stop")
+        for i, (model, method) in enumerate((m, MODELS[m]) for m in models):
+            st.subheader('Summary {} ({})'.format(i + 1, model))
+            placeholder = st.empty()
+            timer = threading.Timer(timeout, sb.cancel) if timeout else None
+            if timer:
+                timer.start()
+            summary = ""
+            try:
+                with closing(sb.stream(method)) as chunks:
+                    for summary in chunks:
+                        placeholder.markdown(summary + " ▌")
+                placeholder.markdown(summary)
+            finally:
+                if timer:
+                    timer.cancel()
+            if sb.cancelled.is_set():
+                st.error("{}: timed out after {}s".format(model, timeout))
+                break
+            timing = sb.timings[method]
+            if timing.get('cached'):
+                st.caption("{}: cached".format(method))
+            else:
+                st.caption("{}: model load {:.2f}s, generation {:.2f}s".format(
+                    method, timing['load_seconds'], timing['generate_seconds']))
+        else:
+            st.success("Completed successfully!")
+        st.stop()
 
     # Call the long-running process function
     with st.spinner("Running... Please wait."):
-        sb = summarizer_bart(text=text,
-                             min_length=min_length,
-                             max_length=max_length)
 
-        # Display the result after the function is finished
-        summ1 = sb.pipeline_summarizer()[0]['summary_text']
-        summ2 = sb.tokenizing_summarizer()
+        # Display the result after the function is finished. Identical inputs are answered from memory
+        summaries = sb.summarize([MODELS[m] for m in models], timeout=timeout or None)
 
         with st.container():
-            s1 = st.text_area('Summary 1', value=summ1, height=100)
-            s2 = st.text_area('Summary 2', value=summ2, height=100)
+            for i, (model, method) in enumerate((m, MODELS[m]) for m in models):
+                if summaries[method] is None:
+                    st.error("{}: {}".format(model, sb.errors[method]))
+                    continue
+                st.text_area('Summary {} ({})'.format(i + 1, model), value=summaries[method], height=100)
+                timing = sb.timings[method]
+                if timing.get('cached'):
+                    st.caption("{}: cached".format(method))
+                else:
+                    st.caption("{}: model load {:.2f}s, generation {:.2f}s".format(
+                        method, timing['load_seconds'], timing['generate_seconds']))
 
     st.success("Completed successfully!")
-
-
-
-
-
-
-
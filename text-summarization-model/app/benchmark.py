@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from collections import Counter
+
+import main
+from main import PROFILES, summarizer_bart
+from registry import registry
+
+# Soft type assertions
+from typing import Dict, List
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples.json")
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def _ngrams(tokens: List[str], n: int) -> Counter:
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def _f1(overlap: int, candidate: int, reference: int) -> float:
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / candidate, overlap / reference
+    return 2 * precision * recall / (precision + recall)
+
+
+def _lcs(a: List[str], b: List[str]) -> int:
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def rouge(candidate: str, reference: str) -> Dict[str, float]:
+    """
+    ROUGE-1, ROUGE-2 and ROUGE-L F1 scores on lower-cased words, without stemming.
+
+    :param candidate: summary to score
+    :type candidate: str
+    :param reference: summary to compare against
+    :type reference: str
+
+    :return: scores between 0 and 1
+    :rtype: Dict[str, float]
+    """
+    c, r = WORD.findall(candidate.lower()), WORD.findall(reference.lower())
+    scores = {}
+    for n in (1, 2):
+        c_grams, r_grams = _ngrams(c, n), _ngrams(r, n)
+        scores[f'rouge{n}'] = _f1(sum((c_grams & r_grams).values()), sum(c_grams.values()), sum(r_grams.values()))
+    scores['rougeL'] = _f1(_lcs(c, r), len(c), len(r))
+    return scores
+
+
+def benchmark_profiles(samples: List[Dict], profiles: List[str], min_length: int = 30, max_length: int = 150,
+                       repeats: int = 1) -> Dict:
+    """
+    Latency, throughput and quality of the speed profiles on a fixed sample set.
+
+    Every profile summarizes every sample with 'tokenizing_summarizer' after its model is
+    loaded, so load time is not counted. Quality is ROUGE against the summaries of the
+    'default' profile, which is always run.
+
+    :param samples: {'id': ..., 'text': ...} documents
+    :type samples: List[Dict]
+    :param profiles: profiles to compare, see 'PROFILES'
+    :type profiles: List[str]
+    :param min_length: Minimum word length of summary
+    :type min_length: int
+    :param max_length: Maximum word length of summary
+    :type max_length: int
+    :param repeats: runs per sample, the fastest one counts
+    :type repeats: int
+
+    :return: per-profile metrics
+    :rtype: Dict
+    """
+    profiles = ['default'] + [p for p in profiles if p != 'default']
+    summaries, results = {}, {}
+    for profile in profiles:
+        tokenizer, _ = registry.get(main.register_profile(profile))
+        latencies, generated, summaries[profile] = [], 0, []
+        for sample in samples:
+            best = None
+            for _ in range(repeats):
+                summarizer = summarizer_bart(sample['text'], min_length, max_length, profile=profile)
+                start = time.perf_counter()
+                summary = summarizer.tokenizing_summarizer()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            latencies.append(best)
+            generated += len(tokenizer(summary)['input_ids'])
+            summaries[profile].append(summary)
+
+        scores = [rouge(s, ref) for s, ref in zip(summaries[profile], summaries['default'])]
+        results[profile] = {
+            **PROFILES[profile],
+            'latency_mean': statistics.mean(latencies),
+            'latency_p50': statistics.median(latencies),
+            'latency_max': max(latencies),
+            'tokens_per_second': generated / sum(latencies),
+            'speedup': None,
+            **{k: statistics.mean(score[k] for score in scores) for k in ('rouge1', 'rouge2', 'rougeL')},
+            'load_seconds': registry.stats()['load_seconds'].get(main.register_profile(profile)),
+        }
+    for profile in profiles:
+        results[profile]['speedup'] = results['default']['latency_mean'] / results[profile]['latency_mean']
+    return {'samples': len(samples), 'min_length': min_length, 'max_length': max_length, 'profiles': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the speed profiles of summarizer_bart")
+    parser.add_argument("--profile", action="append", choices=list(PROFILES),
+                        help="profiles to compare (repeatable), all by default")
+    parser.add_argument("--samples", default=SAMPLES, help="json list of {'id', 'text'} documents")
+    parser.add_argument("--min-length", type=int, default=30)
+    parser.add_argument("--max-length", type=int, default=150)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--model", help="use this checkpoint instead of " + main.TOKENIZING_MODEL)
+    parser.add_argument("--distilled-model", help="use this checkpoint instead of " + main.DISTILLED_MODEL)
+    args = parser.parse_args()
+
+    for settings in PROFILES.values():
+        if args.model and settings['model'] == main.TOKENIZING_MODEL:
+            settings['model'] = args.model
+        elif args.distilled_model and settings['model'] == main.DISTILLED_MODEL:
+            settings['model'] = args.distilled_model
+
+    with open(args.samples) as f:
+        samples = json.load(f)
+    report = benchmark_profiles(samples, args.profile or list(PROFILES), args.min_length, args.max_length,
+                                args.repeats)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,97 @@
+import math
+import re
+
+# Soft type assertions
+from typing import List, Tuple
+
+SENTENCE_END = re.compile(r'(?:(?<=[.!?])|(?<=[.!?]["\')\]]))\s+(?=[A-Z0-9"\'(\[])')
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits text on sentence boundaries (terminal punctuation followed by whitespace and
+    an upper-case letter, digit or opening quote/bracket). Line breaks inside a sentence
+    are collapsed.
+
+    :param text: Input block of text
+    :type text: str
+
+    :return: sentences, in order
+    :rtype: List[str]
+    """
+    text = re.sub(r'\s+', ' ', text).strip()
+    if not text:
+        return []
+    return [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+
+
+def split_oversized(sentences: List[str], lengths: List[int], window: int) -> Tuple[List[str], List[int]]:
+    """
+    Cuts sentences longer than 'window' tokens into word runs that fit it, so text without
+    punctuation still gets windowed instead of truncated. Token counts of the pieces are
+    estimated in proportion to their words.
+
+    :param sentences: sentences, in order
+    :type sentences: List[str]
+    :param lengths: token count of each sentence
+    :type lengths: List[int]
+    :param window: maximum tokens per window
+    :type window: int
+
+    :return: sentences and token counts, with every count at most about 'window'
+    :rtype: Tuple[List[str], List[int]]
+    """
+    out_sentences, out_lengths = [], []
+    for sentence, length in zip(sentences, lengths):
+        words = sentence.split()
+        if length <= window or len(words) < 2:
+            out_sentences.append(sentence)
+            out_lengths.append(length)
+            continue
+        # aim a little under the window, the per-piece estimate is not exact
+        pieces = min(len(words), math.ceil(length / (0.9 * window)))
+        step = math.ceil(len(words) / pieces)
+        for i in range(0, len(words), step):
+            piece = words[i:i + step]
+            out_sentences.append(" ".join(piece))
+            out_lengths.append(math.ceil(length * len(piece) / len(words)))
+    return out_sentences, out_lengths
+
+
+def make_windows(sentences: List[str], lengths: List[int], window: int, overlap: int) -> List[str]:
+    """
+    Groups consecutive sentences into windows of at most 'window' tokens. Each window
+    after the first starts with the trailing sentences of the previous one, up to
+    'overlap' tokens, so context carries over the cut. A single sentence longer than
+    'window' gets a window of its own (and is truncated by the tokenizer).
+
+    :param sentences: sentences, in order
+    :type sentences: List[str]
+    :param lengths: token count of each sentence
+    :type lengths: List[int]
+    :param window: maximum tokens per window
+    :type window: int
+    :param overlap: maximum tokens repeated from the previous window
+    :type overlap: int
+
+    :return: window texts
+    :rtype: List[str]
+    """
+    windows = []
+    start = 0
+    while start < len(sentences):
+        end, size = start, 0
+        while end < len(sentences) and (end == start or size + lengths[end] <= window):
+            size += lengths[end]
+            end += 1
+        windows.append(" ".join(sentences[start:end]))
+        if end >= len(sentences):
+            break
+
+        # step back over up to 'overlap' tokens of trailing sentences, always moving forward
+        next_start, carried = end, 0
+        while next_start - 1 > start and carried + lengths[next_start - 1] <= overlap:
+            next_start -= 1
+            carried += lengths[next_start]
+        start = next_start
+    return windows
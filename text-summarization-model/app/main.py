@@ -1,8 +1,234 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+
+import torch
 from transformers import pipeline, BartForConditionalGeneration, BartTokenizer, BartConfig
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+# Soft type assertions
+from typing import Dict, Iterator, List, Tuple
+from chunking import make_windows, split_oversized, split_sentences
+from registry import registry
 # from ktrain.text.summarization import TransformerSummarizer
 
+PIPELINE_MODEL = "philschmid/bart-large-cnn-samsum"
+TOKENIZING_MODEL = "facebook/bart-large-cnn"
+DISTILLED_MODEL = "sshleifer/distilbart-cnn-12-6"
+
+# Speed profiles of the tokenizing/hierarchical summarizers, from slowest to fastest
+#   model: checkpoint, quantize: int8 dynamic quantization of the Linear layers,
+#   num_beams: 1 is greedy decoding, max_input_tokens: cap on the tokens fed to the encoder. The
+#   decoder's cross-attention cache holds every input token for every beam, so capping the input
+#   and the beams bounds generation memory and time; longer texts are summarized hierarchically
+PROFILES = {
+    'default': {'model': TOKENIZING_MODEL, 'quantize': False, 'num_beams': 4, 'max_input_tokens': None},
+    'int8': {'model': TOKENIZING_MODEL, 'quantize': True, 'num_beams': 4, 'max_input_tokens': None},
+    'greedy': {'model': TOKENIZING_MODEL, 'quantize': False, 'num_beams': 1, 'max_input_tokens': None},
+    'distilled': {'model': DISTILLED_MODEL, 'quantize': False, 'num_beams': 4, 'max_input_tokens': None},
+    'fast': {'model': DISTILLED_MODEL, 'quantize': True, 'num_beams': 1, 'max_input_tokens': 512},
+}
+
+METHODS = ('pipeline_summarizer', 'tokenizing_summarizer')
+
+# both summarizers can run side by side; torch releases the GIL while generating
+pool = ThreadPoolExecutor(max_workers=len(METHODS), thread_name_prefix="summarizer")
+# SUMMARIZER_CACHE_SIZE finished summaries are memoized on (text hash, method, model, min/max length)
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARIZER_CACHE_SIZE", 256))
+summary_cache = OrderedDict()  # key -> summary, least recently used first
+summary_cache_lock = threading.Lock()
+
+
+class SummaryCancelled(Exception):
+    """
+    Raised by a summarizer whose generation was stopped with 'summarizer_bart.cancel'.
+    """
+
+
+class CancelCriteria(StoppingCriteria):
+    def __init__(self, event: threading.Event):
+        """
+        Stops generation at the next token once 'event' is set.
+        """
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.event.is_set()
+
+
+class LockedTokenizer:
+    def __init__(self, tokenizer):
+        """
+        Tokenizer of a resident model, shared by the worker threads and every session. A fast
+        tokenizer called concurrently with different truncation or padding settings raises
+        'RuntimeError: Already borrowed', so its calls are serialized; they are short next to
+        generation, which is not. Other attributes are passed through.
+        """
+        self._tokenizer = tokenizer
+        self._lock = threading.RLock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            return self._tokenizer(*args, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._tokenizer)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._tokenizer, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
+def load_pipeline(model_name: str):
+    """
+    Loads a summarization pipeline.
+    """
+    summarizer = pipeline("summarization", model=model_name)
+    summarizer.tokenizer = LockedTokenizer(summarizer.tokenizer)
+    return summarizer
+
+
+def load_bart(model_name: str, quantize: bool = False):
+    """
+    Loads a BART tokenizer and conditional generation model, optionally with its Linear
+    layers dynamically quantized to int8 (CPU only).
+    """
+    model = BartForConditionalGeneration.from_pretrained(model_name)
+    model.eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return LockedTokenizer(BartTokenizer.from_pretrained(model_name)), model
+
+
+def register_profile(profile: str) -> str:
+    """
+    Registers the model of a speed profile in the process-wide registry.
+
+    :param profile: key of 'PROFILES'
+    :type profile: str
+
+    :return: registry key of the model
+    :rtype: str
+    """
+    settings = PROFILES[profile]
+    key = "bart:" + settings['model'] + (":int8" if settings['quantize'] else "")
+    registry.register(key, partial(load_bart, settings['model'], settings['quantize']))
+    return key
+
+
+def register_models(pipeline_model: str = PIPELINE_MODEL, tokenizing_model: str = TOKENIZING_MODEL) -> None:
+    """
+    Registers the models used by `summarizer_bart` in the process-wide registry.
+    """
+    registry.register("pipeline:" + pipeline_model, partial(load_pipeline, pipeline_model))
+    registry.register("bart:" + tokenizing_model, partial(load_bart, tokenizing_model))
+
+
+def warm_up() -> None:
+    """
+    Loads both summarization models ahead of the first request.
+    """
+    register_models()
+    registry.warm_up(["pipeline:" + PIPELINE_MODEL, "bart:" + TOKENIZING_MODEL])
+
+
+def generate_summaries(tokenizer, model, texts: List[str], min_length: int, max_length: int,
+                       max_input_length: int = None, num_beams: int = 4,
+                       stopping_criteria: StoppingCriteriaList = None) -> List[str]:
+    """
+    Summarizes several texts in one padded, batched beam search.
+
+    :param texts: Input blocks of text, ideally of similar token length to limit padding
+    :type texts: List[str]
+    :param min_length: Minimum token length of each summary
+    :type min_length: int
+    :param max_length: Maximum token length of each summary
+    :type max_length: int
+    :param max_input_length: Inputs are truncated to this many tokens
+    :type max_input_length: int
+    :param num_beams: Beams of the search, 1 for greedy decoding
+    :type num_beams: int
+    :param stopping_criteria: Extra stopping criteria, e.g. 'CancelCriteria'
+    :type stopping_criteria: StoppingCriteriaList
+
+    :return: one summary per text
+    :rtype: List[str]
+    """
+    inputs = tokenizer(texts, return_tensors='pt', padding=True, truncation=True,
+                       max_length=max_input_length or model.config.max_position_embeddings)
+    with torch.inference_mode():
+        summary_ids = model.generate(inputs['input_ids'],
+                                     attention_mask=inputs['attention_mask'],
+                                     num_beams=num_beams,
+                                     min_length=min_length,
+                                     max_length=max_length,
+                                     early_stopping=num_beams > 1,
+                                     use_cache=True,
+                                     stopping_criteria=stopping_criteria)
+    return tokenizer.batch_decode(summary_ids, skip_special_tokens=True)
+
+
+def summarize_batch(documents: List[str], min_length: int, max_length: int, batch_size: int = 16,
+                    profile: str = "default") -> Iterator[List[Tuple[int, str]]]:
+    """
+    Summarizes many documents with the model of a speed profile, batch by batch.
+
+    Documents are sorted by token length and cut into batches of 'batch_size', so each
+    padded beam search runs on documents of similar length. Documents longer than the
+    model input are summarized hierarchically on their own (see 'hierarchical_summarizer').
+    Results are yielded as soon as each batch is done.
+
+    :param documents: Input blocks of text
+    :type documents: List[str]
+    :param min_length: Minimum word length of each summary
+    :type min_length: int
+    :param max_length: Maximum word length of each summary
+    :type max_length: int
+    :param batch_size: Documents per generate call
+    :type batch_size: int
+    :param profile: speed profile, see 'PROFILES'
+    :type profile: str
+
+    :return: (document index, summary) pairs of each finished batch
+    :rtype: Iterator[List[Tuple[int, str]]]
+    """
+    tokenizer, model = registry.get(register_profile(profile))
+    settings = PROFILES[profile]
+
+    window = model.config.max_position_embeddings - 2
+    if settings['max_input_tokens']:
+        window = min(window, settings['max_input_tokens'])
+    lengths = [len(ids) for ids in tokenizer(list(documents), add_special_tokens=False)['input_ids']]
+    order = sorted(range(len(documents)), key=lengths.__getitem__)
+    short = [i for i in order if lengths[i] <= window]
+    long = [i for i in order if lengths[i] > window]
+
+    for start in range(0, len(short), batch_size):
+        indices = short[start:start + batch_size]
+        summaries = generate_summaries(tokenizer, model, [documents[i] for i in indices], min_length, max_length,
+                                       window + 2, settings['num_beams'])
+        yield list(zip(indices, summaries))
+
+    for i in long:
+        summarizer = summarizer_bart(documents[i], min_length, max_length, parallelism=batch_size, profile=profile)
+        yield [(i, summarizer.hierarchical_summarizer())]
+
+
 class summarizer_bart():
-    def __init__(self, text: str, min_length: int, max_length: int):
+    def __init__(self, text: str, min_length: int, max_length: int,
+                 window_tokens: int = None, overlap_tokens: int = 64, parallelism: int = 8,
+                 profile: str = "default"):
         """
         Summarizer model making use of the pre-trained BART model.
 
@@ -12,14 +238,162 @@ class summarizer_bart():
         :type min_length: int
         :param max_length: Maximum word length of summary
         :type max_length: int
+        :param window_tokens: Tokens per window for texts longer than the model input,
+            defaults to the model's maximum input length
+        :type window_tokens: int
+        :param overlap_tokens: Tokens repeated between consecutive windows
+        :type overlap_tokens: int
+        :param parallelism: Windows summarized together in one batched generate call
+        :type parallelism: int
+        :param profile: Speed profile of the tokenizing and hierarchical summarizers, see 'PROFILES'
+        :type profile: str
 
-        For a given set of text, returns a summarized version.
+        For a given set of text, returns a summarized version. Texts that do not fit the
+        model input are summarized hierarchically, see 'hierarchical_summarizer'.
         """
-        self.model = "philschmid/bart-large-cnn-samsum"
-        self.model2 = "facebook/bart-large-cnn"
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile '{profile}', expected one of {list(PROFILES)}")
+        self.model = PIPELINE_MODEL
+        self.model2 = PROFILES[profile]['model']
+        self.profile = profile
         self.text = text
         self.min_length = min_length
         self.max_length = max_length
+        self.window_tokens = window_tokens
+        self.overlap_tokens = overlap_tokens
+        self.parallelism = parallelism
+        # seconds spent getting each model (0 when already resident) and generating, per method
+        self.timings = {}
+        self.errors = {}
+        self.cancelled = threading.Event()
+        # every 'summarize' and 'stream' call has its own cancel event, so a timed out or abandoned call
+        # does not cancel the next ones. The summarizer methods find theirs through '_local'
+        self._local = threading.local()
+        self._events = set()
+        self._events_lock = threading.Lock()
+        registry.register("pipeline:" + self.model, partial(load_pipeline, self.model))
+        self.model2_key = register_profile(profile)
+
+    def _timed_get(self, key: str, method: str):
+        start = time.perf_counter()
+        model = registry.get(key)
+        self.timings[method] = {'load_seconds': time.perf_counter() - start}
+        return model
+
+    def cancel(self) -> None:
+        """
+        Stops every running generation of this summarizer at its next token. The
+        interrupted summarizers raise 'SummaryCancelled', a running 'stream' just ends.
+        Later 'summarize' and 'stream' calls are not affected.
+        """
+        self.cancelled.set()
+        with self._events_lock:
+            for event in self._events:
+                event.set()
+
+    @contextmanager
+    def _cancellable(self, event: threading.Event) -> Iterator[None]:
+        """
+        Makes 'cancel' set 'event' too, meanwhile.
+        """
+        with self._events_lock:
+            self._events.add(event)
+        try:
+            yield
+        finally:
+            with self._events_lock:
+                self._events.discard(event)
+
+    @contextmanager
+    def _call(self, event: threading.Event) -> Iterator[None]:
+        """
+        Runs the summarizer methods of the current thread under the cancel event of one call.
+        """
+        previous = getattr(self._local, 'event', None)
+        self._local.event = event
+        try:
+            with self._cancellable(event):
+                yield
+        finally:
+            self._local.event = previous
+
+    def _event(self) -> threading.Event:
+        # methods called directly, outside 'summarize', only stop on 'cancel'
+        event = getattr(self._local, 'event', None)
+        return self.cancelled if event is None else event
+
+    def _stopping(self, event: threading.Event = None) -> StoppingCriteriaList:
+        return StoppingCriteriaList([CancelCriteria(self._event() if event is None else event)])
+
+    def _check_cancelled(self) -> None:
+        if self._event().is_set():
+            raise SummaryCancelled()
+
+    def _cache_key(self, method: str) -> Tuple:
+        model = self.model if method == 'pipeline_summarizer' else self.profile + ":" + self.model2
+        return hashlib.sha256(self.text.encode('utf-8')).hexdigest(), method, model, self.min_length, self.max_length
+
+    def _summary_text(self, method: str, event: threading.Event) -> str:
+        with self._call(event):
+            summary = getattr(self, method)()
+        return summary[0]['summary_text'] if method == 'pipeline_summarizer' else summary
+
+    def summarize(self, methods: List[str] = METHODS, timeout: float = None) -> Dict[str, str]:
+        """
+        Runs one or both summarizers, concurrently in the shared worker pool. Results are
+        memoized, so resubmitting the same text and lengths returns without generating.
+
+        :param methods: 'pipeline_summarizer' and/or 'tokenizing_summarizer'
+        :type methods: List[str]
+        :param timeout: Seconds to wait for each summarizer. Unlimited if None
+        :type timeout: float
+
+        :return: summary text per method, None for the ones that timed out or failed
+            (see 'self.errors')
+        :rtype: Dict[str, str]
+        """
+        unknown = set(methods) - set(METHODS)
+        if unknown:
+            raise ValueError(f"Unknown summarizers {sorted(unknown)}, expected some of {list(METHODS)}")
+
+        summaries, futures, events = {}, {}, {}
+        self.errors = {}
+        for method in methods:
+            key = self._cache_key(method)
+            with summary_cache_lock:
+                if key in summary_cache:
+                    summary_cache.move_to_end(key)
+                    summaries[method] = summary_cache[key]
+                    self.timings[method] = {'cached': True}
+                    continue
+            events[method] = threading.Event()
+            futures[method] = pool.submit(self._summary_text, method, events[method])
+
+        if futures:
+            wait(futures.values(), timeout=timeout)
+        for method, future in futures.items():
+            if not future.done():
+                # stop the late ones so they free their worker right away
+                events[method].set()
+        for method, future in futures.items():
+            if not future.done():
+                self.errors[method] = f"timed out after {timeout}s"
+                summaries[method] = None
+            elif future.exception() is not None:
+                self.errors[method] = repr(future.exception())
+                summaries[method] = None
+            else:
+                summaries[method] = future.result()
+                self._memoize(self._cache_key(method), summaries[method])
+        return {method: summaries[method] for method in methods}
+
+    @staticmethod
+    def _memoize(key: Tuple, summary: str) -> None:
+        with summary_cache_lock:
+            summary_cache[key] = summary
+            summary_cache.move_to_end(key)
+            while len(summary_cache) > SUMMARY_CACHE_SIZE:
+                summary_cache.popitem(last=False)
 
     def pipeline_summarizer(self) -> str:
         """
@@ -29,8 +403,18 @@ class summarizer_bart():
         :return: Summarized text based on input params
         :rtype: str
         """
-        summarizer = pipeline("summarization", model=self.model)
-        return summarizer(self.text, min_length=self.min_length, max_length=self.max_length, do_sample=False)
+        summarizer = self._timed_get("pipeline:" + self.model, 'pipeline_summarizer')
+
+        start = time.perf_counter()
+        if self._fits(summarizer.tokenizer, summarizer.model):
+            summary = summarizer(self.text, min_length=self.min_length, max_length=self.max_length, do_sample=False,
+                                 stopping_criteria=self._stopping())
+            self._check_cancelled()
+        else:
+            summary = [{'summary_text': self._map_reduce(summarizer.tokenizer, summarizer.model,
+                                                         'pipeline_summarizer')}]
+        self.timings['pipeline_summarizer']['generate_seconds'] = time.perf_counter() - start
+        return summary
 
     def tokenizing_summarizer(self) -> str:
         """
@@ -40,22 +424,184 @@ class summarizer_bart():
         :return: Summarized text based on input params
         :rtype: str
         """
-        # Tokenizer and model loading for bart-large-cnn
-        tokenizer = BartTokenizer.from_pretrained(self.model2)
-        model = BartForConditionalGeneration.from_pretrained(self.model2)
+        # Tokenizer and model of the profile, loaded once per process
+        tokenizer, model = self._timed_get(self.model2_key, 'tokenizing_summarizer')
+
+        start = time.perf_counter()
+        if not self._fits(tokenizer, model):
+            summary = self._map_reduce(tokenizer, model, 'tokenizing_summarizer')
+            self.timings['tokenizing_summarizer']['generate_seconds'] = time.perf_counter() - start
+            return summary
 
         # Transmitting the encoded inputs to the model.generate() function
+        num_beams = PROFILES[self.profile]['num_beams']
         inputs = tokenizer.batch_encode_plus([self.text], return_tensors='pt')
-        summary_ids = model.generate(inputs['input_ids'],
-                                     num_beams=4,
-                                     min_length=self.min_length,
-                                     max_length=self.max_length,
-                                     early_stopping=True)
+        with torch.inference_mode():
+            summary_ids = model.generate(inputs['input_ids'],
+                                         num_beams=num_beams,
+                                         min_length=self.min_length,
+                                         max_length=self.max_length,
+                                         early_stopping=num_beams > 1,
+                                         stopping_criteria=self._stopping())
+        self._check_cancelled()
 
         # Decoding and printing the summary
         summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+        self.timings['tokenizing_summarizer']['generate_seconds'] = time.perf_counter() - start
+        return summary
+
+    def hierarchical_summarizer(self) -> str:
+        """
+        Map-reduce summarizer for texts of any length, using the model of the speed profile
+        (`facebook/bart-large-cnn` by default).
+
+        The text is split on sentence boundaries into overlapping windows of 'window_tokens'
+        tokens, which are summarized together in batched generate calls of 'parallelism'
+        windows. The partial summaries are joined and summarized the same way until they
+        fit a single window, which gets the final summary. The cost grows linearly with
+        the length of the text and no part of it is dropped.
+
+        :return: Summarized text based on input params
+        :rtype: str
+        """
+        tokenizer, model = self._timed_get(self.model2_key, 'hierarchical_summarizer')
+
+        start = time.perf_counter()
+        summary = self._map_reduce(tokenizer, model, 'hierarchical_summarizer')
+        self.timings['hierarchical_summarizer']['generate_seconds'] = time.perf_counter() - start
         return summary
 
+    def _window(self, model) -> int:
+        # room for the <s> and </s> tokens added around every window
+        limit = model.config.max_position_embeddings - 2
+        if PROFILES[self.profile]['max_input_tokens']:
+            limit = min(limit, PROFILES[self.profile]['max_input_tokens'])
+        return min(self.window_tokens, limit) if self.window_tokens else limit
+
+    def _fits(self, tokenizer, model) -> bool:
+        return len(tokenizer(self.text, add_special_tokens=False)['input_ids']) <= self._window(model)
+
+    def _generate(self, tokenizer, model, texts: List[str], min_length: int, max_length: int) -> List[str]:
+        """
+        Summarizes several texts with padded, batched generate calls of 'parallelism' texts.
+        """
+        summaries = []
+        batch = self.parallelism or len(texts)
+        for i in range(0, len(texts), batch):
+            self._check_cancelled()
+            summaries.extend(generate_summaries(tokenizer, model, texts[i:i + batch], min_length, max_length,
+                                                self._window(model) + 2, PROFILES[self.profile]['num_beams'],
+                                                self._stopping()))
+        self._check_cancelled()
+        return summaries
+
+    def _map_reduce(self, tokenizer, model, method: str) -> str:
+        text = self._reduce(tokenizer, model, method)
+        return self._generate(tokenizer, model, [text], self.min_length, self.max_length)[0]
+
+    def _reduce(self, tokenizer, model, method: str) -> str:
+        """
+        Summarizes the text level by level until it fits a single window, without the final pass.
+        """
+        window = self._window(model)
+        overlap = min(self.overlap_tokens, window // 2)
+        text = self.text
+        levels = []
+        while True:
+            sentences = split_sentences(text)
+            lengths = [len(ids) for ids in tokenizer(sentences, add_special_tokens=False)['input_ids']] \
+                if sentences else []
+            total = sum(lengths)
+            if total <= window or (levels and total >= levels[-1]['tokens']):
+                # fits a single window, or the previous pass did not shrink it any further
+                break
+
+            sentences, lengths = split_oversized(sentences, lengths, window)
+            windows = make_windows(sentences, lengths, window, overlap)
+            partial = self._generate(tokenizer, model, windows, min(self.min_length, self.max_length),
+                                     self.max_length)
+            levels.append({'tokens': total, 'windows': len(windows)})
+            text = " ".join(partial)
+
+        self.timings[method]['levels'] = levels
+        return text
+
+    def stream(self, method: str = 'tokenizing_summarizer') -> Iterator[str]:
+        """
+        Generates a summary with the model of 'method', yielding the text decoded so far
+        after every new token. Streaming decodes greedily, whatever the profile's beams.
+        Long texts are first reduced hierarchically and only the final pass is streamed.
+
+        Closing the generator (or calling 'cancel') stops the generation at its next token.
+        Completed summaries are memoized like the ones of 'summarize'.
+
+        :param method: 'pipeline_summarizer' or 'tokenizing_summarizer', selecting the model
+        :type method: str
+
+        :return: growing summary text
+        :rtype: Iterator[str]
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown summarizer '{method}', expected one of {list(METHODS)}")
+        key = self._cache_key(method) + ('stream',)
+        with summary_cache_lock:
+            if key in summary_cache:
+                summary_cache.move_to_end(key)
+                self.timings[method] = {'cached': True}
+                yield summary_cache[key]
+                return
+
+        if method == 'pipeline_summarizer':
+            summarizer = self._timed_get("pipeline:" + self.model, method)
+            tokenizer, model = summarizer.tokenizer, summarizer.model
+        else:
+            tokenizer, model = self._timed_get(self.model2_key, method)
+
+        start = time.perf_counter()
+        event = threading.Event()
+        with self._call(event):
+            text = self.text if self._fits(tokenizer, model) else self._reduce(tokenizer, model, method)
+        inputs = tokenizer([text], return_tensors='pt', truncation=True, max_length=self._window(model) + 2)
+        streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                with torch.inference_mode():
+                    model.generate(inputs['input_ids'],
+                                   attention_mask=inputs['attention_mask'],
+                                   num_beams=1,
+                                   min_length=self.min_length,
+                                   max_length=self.max_length,
+                                   streamer=streamer,
+                                   stopping_criteria=self._stopping(event))
+            except Exception as e:
+                errors.append(e)
+                # unblock the consumer
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="summarizer-stream", daemon=True)
+        summary, finished = "", False
+        with self._cancellable(event):
+            thread.start()
+            try:
+                for piece in streamer:
+                    if piece:
+                        summary += piece
+                        yield summary
+                finished = True
+            finally:
+                if not finished:
+                    # the consumer stopped listening
+                    event.set()
+                thread.join()
+        if errors:
+            raise errors[0]
+
+        self.timings[method]['generate_seconds'] = time.perf_counter() - start
+        if not event.is_set():
+            self._memoize(key, summary)
+
     ## Basically the same as the second method, packaged differently.
     # def ktrain_summarizer(self, text: str) -> str:
     #     """
@@ -100,10 +646,13 @@ if __name__ == '__main__':
 
     sm = summarizer_bart(text=text_block, min_length=30, max_length=200)
 
-    summ1 = sm.pipeline_summarizer()[0]['summary_text']
-    summ2 = sm.tokenizing_summarizer()
+    # both summarizers run concurrently
+    summaries = sm.summarize()
+    summ1 = summaries['pipeline_summarizer']
+    summ2 = summaries['tokenizing_summarizer']
 
     print(summ1)
     print()
     print(summ2)
     print()
+    print(sm.timings)
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Soft type assertions
+from typing import Any, Callable, Dict, List
+
+
+def model_nbytes(obj: Any) -> int:
+    """
+    Memory taken by the parameters of a model, a pipeline or a (tokenizer, model) tuple.
+
+    :param obj: loaded object
+    :type obj: Any
+
+    :return: size in bytes
+    :rtype: int
+    """
+    if isinstance(obj, (tuple, list)):
+        return sum(model_nbytes(o) for o in obj)
+    model = getattr(obj, 'model', obj)
+    if hasattr(model, 'parameters'):
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    return 0
+
+
+class ModelRegistry:
+    def __init__(self, ram_budget: int = None):
+        """
+        Process-wide registry that keeps each model loaded once.
+
+        Models are registered with a loader and loaded lazily on first use. When the
+        resident models exceed 'ram_budget', the least recently used ones are dropped and
+        reloaded on their next use. Load time is tracked separately from use.
+
+        :param ram_budget: Maximum bytes of resident model parameters. Unlimited if None
+        :type ram_budget: int
+        """
+        self.ram_budget = ram_budget
+        self._loaders = {}
+        self._resident = OrderedDict()  # name -> (model, size), least recently used first
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.load_seconds = {}
+        self.loads = {}
+        self.evictions = 0
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        """
+        Registers a loader. Nothing is loaded until 'get' is called.
+
+        :param name: model key
+        :type name: str
+        :param loader: function returning the loaded model
+        :type loader: Callable[[], Any]
+        """
+        with self._lock:
+            self._loaders.setdefault(name, loader)
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        """
+        Returns a resident model, loading it first if needed. Concurrent callers of the
+        same model wait for a single load.
+
+        :param name: model key
+        :type name: str
+
+        :return: the loaded model
+        :rtype: Any
+        """
+        with self._locks[name]:
+            with self._lock:
+                if name in self._resident:
+                    self._resident.move_to_end(name)
+                    return self._resident[name][0]
+
+            start = time.perf_counter()
+            model = self._loaders[name]()
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.load_seconds[name] = elapsed
+                self.loads[name] = self.loads.get(name, 0) + 1
+                self._resident[name] = (model, model_nbytes(model))
+                self._evict(keep=name)
+            return model
+
+    def _evict(self, keep: str) -> None:
+        if self.ram_budget is None:
+            return
+        total = sum(size for _, size in self._resident.values())
+        for name in list(self._resident):
+            if total <= self.ram_budget:
+                break
+            if name == keep:
+                continue
+            total -= self._resident.pop(name)[1]
+            self.evictions += 1
+
+    def warm_up(self, names: List[str] = None) -> None:
+        """
+        Loads models ahead of their first use, e.g. at startup.
+
+        :param names: models to load, all registered ones if None
+        :type names: List[str]
+        """
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def stats(self) -> Dict:
+        """
+        Resident models with their size, and load counters/times.
+
+        :rtype: Dict
+        """
+        with self._lock:
+            return {
+                'ram_budget': self.ram_budget,
+                'resident': {name: size for name, (_, size) in self._resident.items()},
+                'load_seconds': dict(self.load_seconds),
+                'loads': dict(self.loads),
+                'evictions': self.evictions,
+            }
+
+
+# shared by every summarizer in the process. SUMMARIZER_RAM_BUDGET_MB caps resident model memory
+registry = ModelRegistry(
+    int(float(os.environ["SUMMARIZER_RAM_BUDGET_MB"]) * 2 ** 20) if os.environ.get("SUMMARIZER_RAM_BUDGET_MB") else None
+)
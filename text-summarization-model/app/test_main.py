@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import BartConfig, BartForConditionalGeneration, PreTrainedTokenizerFast, pipeline
+
+import main
+from registry import ModelRegistry
+
+WORDS = ("the club signed a new striker before the season and the fans filled the stadium for every home game "
+         "while the manager praised the academy players who scored in the derby").split()
+TEXT = " ".join(WORDS * 3)
+
+
+def make_tokenizer() -> PreTrainedTokenizerFast:
+    vocab = {word: i for i, word in enumerate(['<s>', '<pad>', '</s>', '<unk>'] + sorted(set(WORDS)))}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token='<s>', eos_token='</s>', pad_token='<pad>',
+                                   unk_token='<unk>')
+
+
+@pytest.fixture(autouse=True)
+def tiny_models(monkeypatch):
+    """
+    Both summarizers backed by a tiny random BART, each model with its own tokenizer as when loaded.
+    """
+    torch.manual_seed(0)
+    config = BartConfig(vocab_size=len(set(WORDS)) + 4, d_model=16, encoder_layers=1, decoder_layers=1,
+                        encoder_attention_heads=2, decoder_attention_heads=2, encoder_ffn_dim=32,
+                        decoder_ffn_dim=32, max_position_embeddings=512, pad_token_id=1, bos_token_id=0,
+                        eos_token_id=2, decoder_start_token_id=2, forced_eos_token_id=2)
+    model = BartForConditionalGeneration(config).eval()
+
+    def load_pipeline(model_name):
+        summarizer = pipeline("summarization", model=model, tokenizer=make_tokenizer())
+        summarizer.tokenizer = main.LockedTokenizer(summarizer.tokenizer)
+        return summarizer
+
+    monkeypatch.setattr(main, 'registry', ModelRegistry())
+    monkeypatch.setattr(main, 'summary_cache', OrderedDict())
+    monkeypatch.setattr(main, 'load_pipeline', load_pipeline)
+    monkeypatch.setattr(main, 'load_bart', lambda model_name, quantize=False: (main.LockedTokenizer(make_tokenizer()),
+                                                                               model))
+
+
+def test_summarize_after_timeout():
+    summarizer = main.summarizer_bart(TEXT, 5, 30)
+    assert summarizer.summarize(timeout=0.0001) == {method: None for method in main.METHODS}
+
+    summaries = summarizer.summarize()
+    assert summarizer.errors == {}
+    assert all(summaries[method] is not None for method in main.METHODS)
+
+
+def test_stream_after_close():
+    summarizer = main.summarizer_bart(TEXT, 5, 30)
+    stream = summarizer.stream()
+    next(stream)
+    stream.close()
+
+    assert list(summarizer.stream())
+    assert summarizer.summarize()['tokenizing_summarizer'] is not None
+
+
+def test_concurrent_sessions_share_tokenizers():
+    errors = []
+
+    def session(i):
+        try:
+            for _ in range(3):
+                summarizer = main.summarizer_bart(TEXT + " derby" * i, 5, 10 + i)
+                summarizer.summarize()
+                errors.extend(summarizer.errors.values())
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_locked_tokenizer_across_threads():
+    tokenizer = main.LockedTokenizer(make_tokenizer())
+    errors = []
+
+    def work(i):
+        try:
+            for _ in range(300):
+                # different truncation and padding settings on every thread
+                tokenizer([TEXT, "the club"], padding=True, truncation=True, max_length=8 + i)
+                tokenizer.decode(list(range(4, 30)))
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []